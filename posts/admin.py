@@ -1,12 +1,26 @@
 from django.contrib import admin
 from .models import Post, Comment
+from .search import search_comments, search_posts
 
 @admin.register(Post)
 class PostAdmin(admin.ModelAdmin):
     list_display = ('title', 'created_at', 'updated_at')
+    # Shows the search box, the title and the content are searched by get_search_results()
     search_fields = ('title', 'content')
 
+    def get_search_results(self, request, queryset, search_term):
+        # Full-text search by the index instead of ILIKE '%term%' scans
+        if not search_term:
+            return queryset, False
+        return search_posts(queryset, search_term), False
+
 @admin.register(Comment)
 class CommentAdmin(admin.ModelAdmin):
     list_display = ('post', 'author', 'created_at')
-    search_fields = ('author', 'content')
+    # Shows the search box, the content is searched by get_search_results()
+    search_fields = ('content',)
+
+    def get_search_results(self, request, queryset, search_term):
+        if not search_term:
+            return queryset, False
+        return search_comments(queryset, search_term), False
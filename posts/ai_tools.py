@@ -1,64 +1,441 @@
+import asyncio
+import json
 import os
+import random
 import time
 
+from asgiref.sync import sync_to_async
+from django.conf import settings
 from dotenv import load_dotenv
 import google.generativeai as genai
 
+from posts.cache_tools import get_shared_cache
+from posts.circuit_breaker import CircuitBreaker
+from posts.moderation_cache import moderation_cache
+from posts.prefilter import prefilter
+from posts.rate_limiter import ai_rate_limiter
+
 load_dotenv()
 
 genai.configure(api_key=os.getenv("API_GEMINI"))
 model = genai.GenerativeModel("gemini-1.5-flash")
 
-def moderate_content_with_ai(text):
+SAFETY_CATEGORIES = {
+    7: "HARM_CATEGORY_HARASSMENT",
+    8: "HARM_CATEGORY_HATE_SPEECH",
+    9: "HARM_CATEGORY_SEXUALLY_EXPLICIT",
+    10: "HARM_CATEGORY_DANGEROUS_CONTENT"
+}
+
+
+MODERATION_UNAVAILABLE_VERDICT = (True, "Error while AI text proceeds")
+
+# The batch auto reply answer is a JSON list of replies
+BATCH_GENERATION_KWARGS = {"generation_config": {"response_mime_type": "application/json"}}
+
+circuit_breaker = CircuitBreaker(
+    "gemini",
+    failure_threshold=settings.AI_CIRCUIT_FAILURE_THRESHOLD,
+    recovery_timeout=settings.AI_CIRCUIT_RECOVERY_TIMEOUT,
+)
+
+
+class AIServiceUnavailable(Exception):
+    pass
+
+
+class AIRateLimitExceeded(AIServiceUnavailable):
+    pass
+
+
+def get_backoff_delay(attempt):
     """
-    The function checks the text for inappropriate content.
-    :param text: str
-    :return: Bool, str
+    Exponential backoff with full jitter.
+    :param attempt: int, starting from 0
+    :return: float, seconds
+    """
+    return random.uniform(0, min(settings.AI_RETRY_MAX_DELAY, settings.AI_RETRY_BASE_DELAY * 2 ** attempt))
+
+
+def get_rate_limit_wait(waited):
     """
-    response = None
-    safety_categories = {
-        7: "HARM_CATEGORY_HARASSMENT",
-        8: "HARM_CATEGORY_HATE_SPEECH",
-        9: "HARM_CATEGORY_SEXUALLY_EXPLICIT",
-        10: "HARM_CATEGORY_DANGEROUS_CONTENT"
-    }
-    text_proc = f'Please check the following text for obscene language and insults: "{text}"'
-
-    count = 0
-    while count <= 3 and not response:
-        count += 1
+    Takes a token of the AI-service rate limiter.
+    :param waited: float, seconds already waited for the token
+    :return: float, seconds to wait before the next attempt, 0 if the token has been taken
+    :raises AIRateLimitExceeded: if the token can't be taken within `AI_RATE_LIMIT_MAX_WAIT` seconds
+    """
+    wait = ai_rate_limiter.try_acquire()
+    if wait and waited + wait > settings.AI_RATE_LIMIT_MAX_WAIT:
+        raise AIRateLimitExceeded("AI-service rate limit is exceeded")
+    return wait
+
+
+def wait_for_rate_limit():
+    waited = 0
+    while wait := get_rate_limit_wait(waited):
+        time.sleep(wait)
+        waited += wait
+
+
+async def await_rate_limit():
+    waited = 0
+    # The shared rate limiter is blocking, it is called in a thread
+    while wait := await sync_to_async(get_rate_limit_wait)(waited):
+        await asyncio.sleep(wait)
+        waited += wait
+
+
+def generate_content(prompt, **kwargs):
+    """
+    The function sends the prompt to the AI-service, the request is retried with a backoff if it fails.
+    While the AI-service is down, the circuit breaker is open and the function fails fast.
+    Every attempt takes a token of the rate limiter shared by all workers, so bursts are spread
+    to the provider quota instead of being rejected.
+    :param prompt: str
+    :return: GenerateContentResponse
+    :raises AIServiceUnavailable: if the AI-service is not available
+    """
+    for attempt in range(settings.AI_RETRY_ATTEMPTS):
+        if not circuit_breaker.allow_request():
+            break
+
+        wait_for_rate_limit()
+
         try:
-            response = model.generate_content(text_proc)
+            response = model.generate_content(prompt, **kwargs)
         except Exception as e:  # I don't know what type of error can be received from the AI-service
             print("Error while AI text proceeds: ", str(e))
-            time.sleep(5)
-
-    if not response:
-        print("Content has been blocked because of AI-moderation is not available")
-        return True, "Error while AI text proceeds"
-    else:
-        if hasattr(response, 'candidates') and response.candidates:
-            for candidate in response.candidates:
-                for rating in candidate.safety_ratings:
-                    category_name = safety_categories.get(rating.category, "UNKNOWN_CATEGORY")
-                    if rating.probability >= 2:
-                        return True, category_name
-
-                return False, ""
+            circuit_breaker.record_failure()
+            if attempt + 1 < settings.AI_RETRY_ATTEMPTS:
+                time.sleep(get_backoff_delay(attempt))
         else:
+            circuit_breaker.record_success()
+            return response
+
+    raise AIServiceUnavailable("AI-service is not available")
+
+
+async def agenerate_content(prompt, **kwargs):
+    """
+    Async version of generate_content(), the request doesn't block the event loop.
+    The circuit breaker and the rate limiter are kept in the shared cache, they are called in a thread.
+    :param prompt: str
+    :return: GenerateContentResponse
+    :raises AIServiceUnavailable: if the AI-service is not available
+    """
+    for attempt in range(settings.AI_RETRY_ATTEMPTS):
+        if not await sync_to_async(circuit_breaker.allow_request)():
+            break
+
+        await await_rate_limit()
+
+        try:
+            response = await model.generate_content_async(prompt, **kwargs)
+        except Exception as e:  # I don't know what type of error can be received from the AI-service
+            print("Error while AI text proceeds: ", str(e))
+            await sync_to_async(circuit_breaker.record_failure)()
+            if attempt + 1 < settings.AI_RETRY_ATTEMPTS:
+                await asyncio.sleep(get_backoff_delay(attempt))
+        else:
+            await sync_to_async(circuit_breaker.record_success)()
+            return response
+
+    raise AIServiceUnavailable("AI-service is not available")
+
+
+def prefilter_content(text):
+    """
+    The function checks the text with the local pre-moderation rules.
+    :param text: str
+    :return: (Bool, str) if the text is obviously clean or inappropriate, otherwise None
+    """
+    if not settings.MODERATION_PREFILTER_ENABLED:
+        return None
+    return prefilter.check(text)
+
+
+def get_known_verdict(text):
+    """
+    The function returns the verdict of the local pre-moderation or the cached verdict.
+    :param text: str
+    :return: (Bool, str) or None if the text has to be checked by the AI-service
+    """
+    return prefilter_content(text) or moderation_cache.get(text)
+
+
+def get_known_verdicts(texts):
+    """
+    The function returns the known verdicts of the distinct texts, see get_known_verdict().
+    :param texts: list of str
+    :return: dict of (Bool, str) or None by the text
+    """
+    return {text: get_known_verdict(text) for text in dict.fromkeys(texts)}
+
+
+def cache_verdicts(verdicts):
+    """
+    The function stores the verdicts in the moderation cache.
+    :param verdicts: dict of (Bool, str) by the text
+    """
+    for text, verdict in verdicts.items():
+        moderation_cache.set(text, verdict)
+
+
+def get_moderation_prompt(text):
+    return f'Please check the following text for obscene language and insults: "{text}"'
+
+
+def moderate_content_with_ai(text):
+    """
+    The function checks the text for inappropriate content.
+    Obvious cases are decided locally and verdicts are cached by the normalized content hash,
+    so only new ambiguous content reaches the AI-service.
+    :param text: str
+    :return: Bool, str
+    :raises AIServiceUnavailable: if the AI-service is not available
+    """
+    verdict = get_known_verdict(text)
+    if verdict is not None:
+        return verdict
+
+    response = generate_content(get_moderation_prompt(text))
+
+    verdict = get_verdict_from_response(response)
+    moderation_cache.set(text, verdict)
+
+    return verdict
+
+
+async def amoderate_content_with_ai(text):
+    """
+    Async version of moderate_content_with_ai().
+    :param text: str
+    :return: Bool, str
+    :raises AIServiceUnavailable: if the AI-service is not available
+    """
+    # The shared tier of the moderation cache is blocking, it is read and written in a thread
+    verdict = await sync_to_async(get_known_verdict)(text)
+    if verdict is not None:
+        return verdict
+
+    response = await agenerate_content(get_moderation_prompt(text))
+
+    verdict = get_verdict_from_response(response)
+    await sync_to_async(moderation_cache.set)(text, verdict)
+
+    return verdict
+
+
+def moderate_contents_with_ai(texts):
+    """
+    The function checks several texts for inappropriate content with as few requests to the AI-service as possible.
+    Obvious, cached and repeated texts are not sent. Up to `MODERATION_BATCH_SIZE` texts are sent with one request,
+    see check_texts_with_ai().
+    :param texts: list of str
+    :return: list of (Bool, str) in the order of the texts
+    :raises AIServiceUnavailable: if the AI-service is not available
+    """
+    verdicts = get_known_verdicts(texts)
+    unchecked = [text for text, verdict in verdicts.items() if verdict is None]
+
+    batch_size = settings.MODERATION_BATCH_SIZE
+    for start in range(0, len(unchecked), batch_size):
+        verdicts.update(check_texts_with_ai(unchecked[start:start + batch_size]))
+
+    return [verdicts[text] for text in texts]
+
+
+async def amoderate_contents_with_ai(texts):
+    """
+    Async version of moderate_contents_with_ai(), the batches are checked concurrently.
+    :param texts: list of str
+    :return: list of (Bool, str) in the order of the texts
+    :raises AIServiceUnavailable: if the AI-service is not available
+    """
+    verdicts = await sync_to_async(get_known_verdicts)(texts)
+    unchecked = [text for text, verdict in verdicts.items() if verdict is None]
+
+    batch_size = settings.MODERATION_BATCH_SIZE
+    for batch_verdicts in await asyncio.gather(*(
+        acheck_texts_with_ai(unchecked[start:start + batch_size]) for start in range(0, len(unchecked), batch_size)
+    )):
+        verdicts.update(batch_verdicts)
+
+    return [verdicts[text] for text in texts]
+
+
+def check_texts_with_ai(texts):
+    """
+    The function checks the texts by the safety ratings of the AI response, the same way as a single text.
+    The texts are sent together; if the ratings are fine, all of them are clean. Otherwise the texts are split
+    in halves which are checked again, so an inappropriate text gets the verdict of its own request, and a few
+    inappropriate texts in a batch cost a few more requests. The answer itself is not used, so the texts can't
+    change the verdicts of each other.
+    :param texts: list of str
+    :return: dict of (Bool, str) by the text
+    :raises AIServiceUnavailable: if the AI-service is not available
+    """
+    verdict = get_verdict_from_response(generate_content(get_batch_moderation_prompt(texts)))
+    if verdict[0] and len(texts) > 1:
+        middle = len(texts) // 2
+        return {**check_texts_with_ai(texts[:middle]), **check_texts_with_ai(texts[middle:])}
+
+    verdicts = dict.fromkeys(texts, verdict)
+    cache_verdicts(verdicts)
+    return verdicts
+
+
+async def acheck_texts_with_ai(texts):
+    """
+    Async version of check_texts_with_ai(), the halves are checked concurrently.
+    :param texts: list of str
+    :return: dict of (Bool, str) by the text
+    :raises AIServiceUnavailable: if the AI-service is not available
+    """
+    verdict = get_verdict_from_response(await agenerate_content(get_batch_moderation_prompt(texts)))
+    if verdict[0] and len(texts) > 1:
+        middle = len(texts) // 2
+        first, second = await asyncio.gather(acheck_texts_with_ai(texts[:middle]), acheck_texts_with_ai(texts[middle:]))
+        return {**first, **second}
+
+    verdicts = dict.fromkeys(texts, verdict)
+    await sync_to_async(cache_verdicts)(verdicts)
+    return verdicts
+
+
+def get_batch_moderation_prompt(texts):
+    """
+    The function asks the AI-service to check the texts, a single text gets the prompt of moderate_content_with_ai().
+    :param texts: list of str
+    :return: str
+    """
+    if len(texts) == 1:
+        return get_moderation_prompt(texts[0])
+    return "Please check the following texts for obscene language and insults:\n" + "\n".join(
+        json.dumps(text) for text in texts
+    )
+
+
+def get_verdict_from_response(response):
+    """
+    The function converts the safety ratings of the AI response into a moderation verdict.
+    :param response: GenerateContentResponse
+    :return: Bool, str
+    """
+    if hasattr(response, 'candidates') and response.candidates:
+        for candidate in response.candidates:
+            for rating in candidate.safety_ratings:
+                category_name = SAFETY_CATEGORIES.get(rating.category, "UNKNOWN_CATEGORY")
+                if rating.probability >= 2:
+                    return True, category_name
+
             return False, ""
 
+    return False, ""
+
+
+def get_post_context(post):
+    """
+    The function returns the post context used by the auto reply prompts.
+    Long posts are summarized by the AI-service once per post version (`updated_at`), the summary is
+    cached, so the whole post is not resent with every reply. If the AI-service is not available,
+    the post is truncated instead.
+    :param post: Post instance
+    :return: str
+    """
+    max_length = settings.AUTO_REPLY_CONTEXT_MAX_LENGTH
+    if len(post.content) <= max_length:
+        return post.content
+
+    key = f"post_context:{post.id}:{post.updated_at.timestamp()}"
+    context = get_shared_cache().get(key)
+    if context is not None:
+        return context
+
+    try:
+        context = generate_content(
+            f"Summarize the following post in at most {max_length} characters: '{post.content}'"
+        ).text[:max_length]
+    except (AIServiceUnavailable, ValueError):  # ValueError - the answer has been blocked by the AI-service
+        return post.content[:max_length]
+
+    get_shared_cache().set(key, context, timeout=settings.AUTO_REPLY_CONTEXT_CACHE_TTL)
+    return context
 
 
 def generate_relevant_reply(post, comment):
     """
     The function generates a relevant response to a comment using AI
+    The prompt starts with the post context, so that the prompts of the same post share a prefix.
     :param post: Post instance
     :param comment: Comment instance
     :return: str
+    :raises AIServiceUnavailable: if the AI-service is not available
     """
 
-    prompt = f"Generate a relevant response to this comment: '{comment.content}' based on the post: '{post.content}'"
-    reply = model.generate_content(prompt)
+    prompt = (
+        f"Based on the post: '{get_post_context(post)}', "
+        f"generate a relevant response to this comment: '{comment.content}'"
+    )
+    reply = generate_content(prompt)
 
     return reply.text
+
+
+def generate_relevant_replies(post, comments):
+    """
+    The function generates relevant responses to several comments of the post with a single request to the AI-service.
+    If the batch answer can't be parsed, the comments without a reply are answered one by one.
+    :param post: Post instance
+    :param comments: list of Comment instances
+    :return: dict of the reply text by the comment ID
+    :raises AIServiceUnavailable: if the AI-service is not available
+    """
+    if len(comments) == 1:
+        return {comments[0].id: generate_relevant_reply(post, comments[0])}
+
+    response = generate_content(get_batch_reply_prompt(post, comments), **BATCH_GENERATION_KWARGS)
+    replies = get_batch_replies_from_response(comments, response)
+    for comment in comments:
+        if comment.id not in replies:
+            replies[comment.id] = generate_relevant_reply(post, comment)
+
+    return replies
+
+
+def get_batch_reply_prompt(post, comments):
+    """
+    The function asks the AI-service to answer the numbered comments of the post.
+    :param post: Post instance
+    :param comments: list of Comment instances
+    :return: str
+    """
+    numbered_comments = "\n".join(f"{i}. {json.dumps(comment.content)}" for i, comment in enumerate(comments))
+    return (
+        f"Based on the post: '{get_post_context(post)}', "
+        "generate a relevant response to each of the following numbered comments. "
+        "Answer with a JSON list of objects with the keys: \"id\" - the number of the comment, \"reply\" - the response.\n"
+        f"{numbered_comments}"
+    )
+
+
+def get_batch_replies_from_response(comments, response):
+    """
+    The function maps the replies of the batch answer back to the comments.
+    :param comments: list of Comment instances
+    :param response: GenerateContentResponse
+    :return: dict of the reply text by the comment ID, the comments without a valid reply are omitted
+    """
+    replies = {}
+    try:
+        items = json.loads(response.text)
+    except (ValueError, TypeError):  # The answer has been blocked by the AI-service or is not a valid JSON
+        return replies
+
+    for item in items if isinstance(items, list) else []:
+        if not isinstance(item, dict) or not isinstance(item.get("id"), int) or not 0 <= item["id"] < len(comments):
+            continue
+        if isinstance(item.get("reply"), str) and item["reply"].strip():
+            replies[comments[item["id"]].id] = item["reply"]
+
+    return replies
@@ -0,0 +1,35 @@
+from django.conf import settings
+from django.core.cache import cache, caches
+from django.core.cache.backends.redis import RedisCache
+
+
+def get_shared_cache():
+    """
+    Returns the cache shared between workers (Redis) or the default cache if it is not configured.
+    :return: BaseCache
+    """
+    if is_cache_shared():
+        return caches[settings.SHARED_CACHE_ALIAS]
+    return cache
+
+
+def is_cache_shared():
+    """
+    Returns whether the shared cache is configured. Otherwise get_shared_cache() is local to the process,
+    so an invalidation is not seen by the other workers.
+    """
+    return settings.SHARED_CACHE_ALIAS in settings.CACHES
+
+
+def get_shared_redis():
+    """
+    Returns the Redis client of the shared cache for the operations the cache API doesn't have
+    (Lua scripts, sorted sets), or None if the shared cache is not configured. The client shares
+    the connection pool and the configuration of the cache.
+    :return: redis.Redis or None
+    """
+    shared_cache = get_shared_cache()
+    if not isinstance(shared_cache, RedisCache):
+        return None
+    # Django's RedisCache has no public accessor of its client
+    return shared_cache._cache.get_client(write=True)
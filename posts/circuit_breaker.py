@@ -0,0 +1,72 @@
+import time
+
+from posts.cache_tools import get_shared_cache
+
+
+class CircuitBreaker:
+    """
+    Circuit breaker around calls to an external service.
+
+    The state is kept in the shared cache, so that all workers stop calling the service together:
+        - closed: requests are allowed, consecutive failures are counted;
+        - open: after `failure_threshold` failures requests fail fast for `recovery_timeout` seconds;
+        - half-open: after the timeout one probe request is allowed, its result closes or opens the circuit.
+    """
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, name, failure_threshold, recovery_timeout):
+        self.key = f"circuit_breaker:{name}"
+        self.failure_threshold = failure_threshold
+        self.recovery_timeout = recovery_timeout
+
+    @property
+    def failures_key(self):
+        return f"{self.key}:failures"
+
+    @property
+    def opened_at_key(self):
+        return f"{self.key}:opened_at"
+
+    @property
+    def state(self):
+        opened_at = get_shared_cache().get(self.opened_at_key)
+        if opened_at is None:
+            return self.CLOSED
+        if time.time() - opened_at < self.recovery_timeout:
+            return self.OPEN
+        return self.HALF_OPEN
+
+    def allow_request(self):
+        """
+        Returns True if the request to the service may be sent.
+        In the half-open state only one probe request is allowed per recovery timeout.
+        """
+        state = self.state
+        if state == self.CLOSED:
+            return True
+        if state == self.HALF_OPEN:
+            return get_shared_cache().add(f"{self.key}:probe", True, timeout=self.recovery_timeout)
+        return False
+
+    def record_success(self):
+        cache = get_shared_cache()
+        if cache.get(self.failures_key):
+            cache.delete_many([self.failures_key, self.opened_at_key])
+
+    def record_failure(self):
+        """
+        Counts the failure, the counter is incremented atomically, so the failures of concurrent workers are not lost.
+        """
+        cache = get_shared_cache()
+        cache.add(self.failures_key, 0, timeout=None)
+        try:
+            failures = cache.incr(self.failures_key)
+        except ValueError:  # The counter has been reset by a success meanwhile
+            cache.add(self.failures_key, 1, timeout=None)
+            failures = 1
+
+        if failures >= self.failure_threshold or cache.get(self.opened_at_key) is not None:
+            cache.set(self.opened_at_key, time.time(), timeout=None)
+            cache.delete(f"{self.key}:probe")
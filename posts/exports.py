@@ -0,0 +1,84 @@
+import csv
+import json
+
+from django.core.serializers.json import DjangoJSONEncoder
+
+from posts.models import Comment
+from posts.views.views_analytics import get_datetime_range
+
+EXPORT_FORMATS = {
+    "csv": "text/csv",
+    "ndjson": "application/x-ndjson",
+}
+EXPORT_FIELDS = (
+    "id", "post_id", "parent_id", "author_id", "author__username", "content", "created_at", "updated_at",
+    "is_blocked", "block_reason", "moderation_status",
+)
+EXPORT_CHUNK_SIZE = 2000
+
+
+class Echo:
+    """File-like object which returns the written value instead of storing it, see the Django CSV docs."""
+
+    def write(self, value):
+        return value
+
+
+def get_export_queryset(start_date=None, end_date=None, is_blocked=None):
+    """
+    Returns the rows of the comments to export.
+    :param start_date: first creation date, not limited if None
+    :param end_date: last creation date, not limited if None
+    :param is_blocked: export only blocked (True) or not blocked (False) comments, all if None
+    :return: QuerySet of dicts with EXPORT_FIELDS
+    """
+    comments = Comment.objects.all()
+    if start_date:
+        start, _ = get_datetime_range(start_date, start_date)
+        comments = comments.filter(created_at__gte=start)
+    if end_date:
+        _, end = get_datetime_range(end_date, end_date)
+        comments = comments.filter(created_at__lt=end)
+    if is_blocked is not None:
+        comments = comments.filter(is_blocked=is_blocked)
+
+    return comments.values(*EXPORT_FIELDS).order_by("id")
+
+
+def get_row_writer(export_format):
+    """
+    Returns the header line and the function which formats a row in the export format.
+    :param export_format: "csv" or "ndjson"
+    :return: (str, function)
+    """
+    if export_format == "csv":
+        writer = csv.writer(Echo())
+        return writer.writerow(EXPORT_FIELDS), lambda row: writer.writerow([row[field] for field in EXPORT_FIELDS])
+
+    return "", lambda row: json.dumps(row, cls=DjangoJSONEncoder) + "\n"
+
+
+def export_rows(queryset, export_format):
+    """
+    Yields the exported lines. The rows are read with a server-side cursor in chunks,
+    so the memory use doesn't depend on the number of comments.
+    """
+    header, write_row = get_row_writer(export_format)
+    if header:
+        yield header
+
+    for row in queryset.iterator(chunk_size=EXPORT_CHUNK_SIZE):
+        yield write_row(row)
+
+
+async def aexport_rows(queryset, export_format):
+    """
+    Asynchronous version of export_rows(), which is streamed by an ASGI server without
+    loading the whole export into memory.
+    """
+    header, write_row = get_row_writer(export_format)
+    if header:
+        yield header
+
+    async for row in queryset.aiterator(chunk_size=EXPORT_CHUNK_SIZE):
+        yield write_row(row)
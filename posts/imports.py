@@ -0,0 +1,115 @@
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import transaction
+
+from posts.models import Comment, ModerationStatus, Post
+from posts.moderation import moderate_instances
+from posts.stats import count_comments
+from posts.tasks import schedule_pending_moderation
+from posts.threads import set_comment_paths
+from posts.views.views_tools import schedule_auto_reply_if_enabled
+
+IMPORT_BATCH_SIZE = 1000
+IMPORT_MAX_COMMENTS = 5000  # per request of the bulk endpoint
+
+
+def validate_comments(items, default_author_id):
+    """
+    Validates the imported comments with one query per referenced model.
+    `parent_id` must be the ID of a comment which already exists in the database: the comments of one import
+    can't reply to each other, and the IDs of another database (e.g. of an `export_comments` file) are not mapped.
+    :param items: list of dicts with post_id, content, parent_id and author_id (optional) keys
+    :param default_author_id: int, the author of the comments without author_id
+    :return: list of the valid Comment instances, list of errors ({"index": int, "detail": str})
+    """
+    posts = Post.objects.only("id", "is_blocked", "author_id", "auto_reply_enabled", "reply_delay").in_bulk(
+        {item["post_id"] for item in items}
+    )
+    parents = Comment.objects.only("id", "post_id", "is_blocked", "path").in_bulk(
+        {item["parent_id"] for item in items if item.get("parent_id")}
+    )
+    authors = set(User.objects.filter(
+        id__in={item.get("author_id") or default_author_id for item in items}
+    ).values_list("id", flat=True))
+
+    comments, errors = [], []
+    for index, item in enumerate(items):
+        post = posts.get(item["post_id"])
+        parent = parents.get(item.get("parent_id")) if item.get("parent_id") else None
+        author_id = item.get("author_id") or default_author_id
+
+        if post is None:
+            detail = "Post not found."
+        elif item.get("parent_id") and (parent is None or parent.post_id != post.id):
+            detail = "Parent comment not found."
+        elif post.is_blocked or (parent is not None and parent.is_blocked):
+            detail = "You cannot create a comment for blocked content."
+        elif author_id not in authors:
+            detail = "Author not found."
+        elif not item.get("content"):
+            detail = "Content is required."
+        else:
+            comments.append(Comment(author_id=author_id, post=post, parent=parent, content=item["content"]))
+            continue
+
+        errors.append({"index": index, "detail": detail})
+
+    return comments, errors
+
+
+def moderate_comments(comments, pending=False):
+    """
+    Moderates the comments in batches of `MODERATION_BATCH_SIZE` texts per request to the AI-service.
+    In the asynchronous moderation mode or if `pending` is set the comments are only marked as pending.
+    """
+    if settings.MODERATION_ASYNC or pending:
+        for comment in comments:
+            comment.moderation_status = ModerationStatus.PENDING
+        return
+
+    batch_size = settings.MODERATION_BATCH_SIZE
+    for start in range(0, len(comments), batch_size):
+        moderate_instances(comments[start:start + batch_size])
+
+
+def import_comments(items, default_author_id, pending=False):
+    """
+    Creates the comments in bulk.
+
+    Unlike create_comment(), the posts, parents and authors are validated with one query each,
+    the comments are moderated in batches and inserted with bulk_create(), and the auto replies
+    are scheduled in one pass after the commit. The signals are bypassed, so the tree paths and
+    the daily stats are updated here.
+    :param items: list of dicts with post_id, content, parent_id and author_id (optional) keys
+    :param default_author_id: int, the author of the comments without author_id
+    :param pending: Bool, save the comments as pending to be moderated by a Celery task
+    :return: dict with the numbers of created, blocked and pending comments and the errors of the invalid items
+    """
+    comments, errors = validate_comments(items, default_author_id)
+    moderate_comments(comments, pending)
+    # Also the comments queued by the "queue" failure policy while the AI-service is not available
+    pending_count = sum(comment.moderation_status == ModerationStatus.PENDING for comment in comments)
+
+    with transaction.atomic():
+        Comment.objects.bulk_create(comments, batch_size=IMPORT_BATCH_SIZE)
+        set_comment_paths(comments)
+        count_comments(comments)
+
+        # bulk_create() doesn't send post_save, so the pending moderation is scheduled here
+        if pending_count:
+            transaction.on_commit(schedule_pending_moderation)
+
+        def schedule_auto_replies():
+            for comment in comments:
+                # Auto replies are created by the post author and must not be answered again
+                if comment.author_id != comment.post.author_id:
+                    schedule_auto_reply_if_enabled(comment.post, comment)
+
+        transaction.on_commit(schedule_auto_replies)
+
+    return {
+        "created": len(comments),
+        "blocked": sum(comment.is_blocked for comment in comments),
+        "pending": pending_count,
+        "errors": errors,
+    }
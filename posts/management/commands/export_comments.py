@@ -0,0 +1,45 @@
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.dateparse import parse_date
+
+from posts.exports import EXPORT_FORMATS, export_rows, get_export_queryset
+
+
+class Command(BaseCommand):
+    help = "Exports the comments with their moderation results as CSV or NDJSON."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--format", choices=list(EXPORT_FORMATS), default="csv", dest="export_format")
+        parser.add_argument("--date-from", help="First creation date (YYYY-MM-DD).")
+        parser.add_argument("--date-to", help="Last creation date (YYYY-MM-DD).")
+        blocked = parser.add_mutually_exclusive_group()
+        blocked.add_argument("--blocked", action="store_true", help="Export only blocked comments.")
+        blocked.add_argument("--not-blocked", action="store_true", help="Export only not blocked comments.")
+        parser.add_argument("--output", help="Output file, stdout by default.")
+
+    def handle(self, *args, **options):
+        is_blocked = True if options["blocked"] else False if options["not_blocked"] else None
+        comments = get_export_queryset(
+            self.parse_date_option(options["date_from"]),
+            self.parse_date_option(options["date_to"]),
+            is_blocked,
+        )
+
+        output = open(options["output"], "w", encoding="utf-8", newline="") if options["output"] else sys.stdout
+        try:
+            for line in export_rows(comments, options["export_format"]):
+                output.write(line)
+        finally:
+            if output is not sys.stdout:
+                output.close()
+
+    @staticmethod
+    def parse_date_option(value):
+        if value is None:
+            return None
+
+        date = parse_date(value)
+        if date is None:
+            raise CommandError(f"Invalid date: {value}.")
+        return date
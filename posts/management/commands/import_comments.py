@@ -0,0 +1,65 @@
+import csv
+import json
+import sys
+from itertools import islice
+
+from django.core.management.base import BaseCommand, CommandError
+
+from posts.exports import EXPORT_FORMATS
+from posts.imports import IMPORT_BATCH_SIZE, import_comments
+
+IMPORT_FIELDS = ("post_id", "parent_id", "author_id")
+
+
+class Command(BaseCommand):
+    help = (
+        "Imports comments in bulk from CSV or NDJSON (e.g. created by export_comments). "
+        "parent_id must be the ID of a comment which already exists in this database."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--format", choices=list(EXPORT_FORMATS), default="csv", dest="import_format")
+        parser.add_argument("--input", help="Input file, stdin by default.")
+        parser.add_argument("--author-id", type=int, help="Author of the comments without author_id.")
+        parser.add_argument("--batch-size", type=int, default=IMPORT_BATCH_SIZE)
+
+    def handle(self, *args, **options):
+        input_file = open(options["input"], encoding="utf-8", newline="") if options["input"] else sys.stdin
+        try:
+            rows = self.read_rows(input_file, options["import_format"])
+            created, blocked, pending, errors, offset = 0, 0, 0, 0, 0
+            while batch := list(islice(rows, options["batch_size"])):
+                result = import_comments(batch, options["author_id"])
+                for error in result["errors"]:
+                    self.stderr.write(f"Row {offset + error['index'] + 1}: {error['detail']}")
+
+                created += result["created"]
+                blocked += result["blocked"]
+                pending += result["pending"]
+                errors += len(result["errors"])
+                offset += len(batch)
+        finally:
+            if input_file is not sys.stdin:
+                input_file.close()
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Imported {created} comment(s), {blocked} blocked, {pending} pending moderation, {errors} skipped."
+        ))
+
+    @staticmethod
+    def read_rows(input_file, import_format):
+        """
+        Yields the rows as dicts with post_id, content, parent_id and author_id keys.
+        """
+        rows = csv.DictReader(input_file) if import_format == "csv" else (line for line in input_file if line.strip())
+
+        for number, row in enumerate(rows, start=1):
+            try:
+                if import_format != "csv":
+                    row = json.loads(row)
+                yield {
+                    "content": row.get("content"),
+                    **{field: int(row[field]) if row.get(field) not in (None, "") else None for field in IMPORT_FIELDS},
+                }
+            except (AttributeError, TypeError, ValueError):
+                raise CommandError(f"Invalid row {number}.")
@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.dateparse import parse_date
+
+from posts.stats import rebuild_comment_stats
+
+
+class Command(BaseCommand):
+    help = "Backfills or rebuilds the daily comment stats used by the analytics."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--date-from", help="First date to rebuild (YYYY-MM-DD), all dates by default.")
+        parser.add_argument("--date-to", help="Last date to rebuild (YYYY-MM-DD), all dates by default.")
+
+    def handle(self, *args, **options):
+        start_date = self.parse_date_option(options["date_from"])
+        end_date = self.parse_date_option(options["date_to"])
+        if start_date and end_date and start_date > end_date:
+            raise CommandError("--date-from must be earlier than --date-to.")
+
+        days = rebuild_comment_stats(start_date, end_date)
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt the comment stats for {days} day(s)."))
+
+    @staticmethod
+    def parse_date_option(value):
+        if value is None:
+            return None
+
+        date = parse_date(value)
+        if date is None:
+            raise CommandError(f"Invalid date: {value}.")
+        return date
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from posts.stats import rebuild_post_counters
+
+
+class Command(BaseCommand):
+    help = "Recalculates the denormalized comment counters of the posts."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--post-id", type=int, action="append", dest="post_ids", help="Post to reconcile, all by default.")
+
+    def handle(self, *args, **options):
+        posts = rebuild_post_counters(options["post_ids"])
+        self.stdout.write(self.style.SUCCESS(f"Reconciled the comment counters of {posts} post(s)."))
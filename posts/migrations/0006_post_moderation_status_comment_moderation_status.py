@@ -0,0 +1,45 @@
+# Generated by Django 5.1.2 on 2026-10-16 20:36
+
+from django.db import migrations, models
+
+
+def set_blocked_status(apps, schema_editor):
+    for model_name in ("Post", "Comment"):
+        model = apps.get_model("posts", model_name)
+        model.objects.filter(is_blocked=True).update(moderation_status="blocked")
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("posts", "0005_post_auto_reply_enabled_post_reply_delay"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="comment",
+            name="moderation_status",
+            field=models.CharField(
+                choices=[
+                    ("pending", "Pending"),
+                    ("approved", "Approved"),
+                    ("blocked", "Blocked"),
+                ],
+                default="approved",
+                max_length=16,
+            ),
+        ),
+        migrations.AddField(
+            model_name="post",
+            name="moderation_status",
+            field=models.CharField(
+                choices=[
+                    ("pending", "Pending"),
+                    ("approved", "Approved"),
+                    ("blocked", "Blocked"),
+                ],
+                default="approved",
+                max_length=16,
+            ),
+        ),
+        migrations.RunPython(set_blocked_status, migrations.RunPython.noop),
+    ]
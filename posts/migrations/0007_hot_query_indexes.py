@@ -0,0 +1,58 @@
+# Generated by Django 5.1.2 on 2026-10-16 20:47
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("posts", "0006_post_moderation_status_comment_moderation_status"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="comment",
+            index=models.Index(
+                condition=models.Q(
+                    ("is_blocked", False), ("moderation_status", "approved")
+                ),
+                fields=["post", "created_at", "id"],
+                name="comment_visible_post_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="comment",
+            index=models.Index(
+                fields=["created_at"],
+                include=("is_blocked",),
+                name="comment_created_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="comment",
+            index=models.Index(
+                condition=models.Q(("moderation_status", "pending")),
+                fields=["id"],
+                name="comment_pending_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="post",
+            index=models.Index(
+                condition=models.Q(
+                    ("is_blocked", False), ("moderation_status", "approved")
+                ),
+                fields=["created_at", "id"],
+                name="post_visible_created_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="post",
+            index=models.Index(
+                condition=models.Q(("moderation_status", "pending")),
+                fields=["id"],
+                name="post_pending_idx",
+            ),
+        ),
+    ]
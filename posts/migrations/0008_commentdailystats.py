@@ -0,0 +1,53 @@
+# Generated by Django 5.1.2 on 2026-10-16 20:51
+
+from django.db import migrations, models
+
+
+def backfill_comment_stats(apps, schema_editor):
+    Comment = apps.get_model("posts", "Comment")
+    CommentDailyStats = apps.get_model("posts", "CommentDailyStats")
+    rows = (
+        Comment.objects.values("created_at__date")
+        .annotate(
+            total_comments=models.Count("id"),
+            blocked_comments=models.Count("id", filter=models.Q(is_blocked=True)),
+        )
+        .order_by("created_at__date")
+    )
+    CommentDailyStats.objects.bulk_create(
+        [
+            CommentDailyStats(
+                date=row["created_at__date"],
+                total_comments=row["total_comments"],
+                blocked_comments=row["blocked_comments"],
+            )
+            for row in rows
+        ]
+    )
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("posts", "0007_hot_query_indexes"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="CommentDailyStats",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("date", models.DateField(unique=True)),
+                ("total_comments", models.IntegerField(default=0)),
+                ("blocked_comments", models.IntegerField(default=0)),
+            ],
+        ),
+        migrations.RunPython(backfill_comment_stats, migrations.RunPython.noop),
+    ]
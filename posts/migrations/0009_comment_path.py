@@ -0,0 +1,47 @@
+# Generated by Django 5.1.2 on 2026-10-16 21:20
+
+from django.db import migrations, models
+
+import posts.models
+
+# Builds the materialized paths of the existing comments from the roots down
+BACKFILL_COMMENT_PATHS = """
+WITH RECURSIVE tree (id, path) AS (
+    SELECT id, LPAD(id::text, 10, '0') FROM posts_comment WHERE parent_id IS NULL
+    UNION ALL
+    SELECT comment.id, tree.path || LPAD(comment.id::text, 10, '0')
+    FROM posts_comment comment JOIN tree ON comment.parent_id = tree.id
+)
+UPDATE posts_comment SET path = tree.path FROM tree WHERE posts_comment.id = tree.id
+"""
+
+
+def backfill_comment_paths(apps, schema_editor):
+    # The paths on the other databases are backfilled by the migration 0013
+    if schema_editor.connection.vendor == "postgresql":
+        schema_editor.execute(BACKFILL_COMMENT_PATHS)
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("posts", "0008_commentdailystats"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="comment",
+            name="path",
+            field=posts.models.PathField(db_collation="C", default="", editable=False),
+        ),
+        migrations.RunPython(backfill_comment_paths, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name="comment",
+            index=models.Index(
+                condition=models.Q(
+                    ("is_blocked", False), ("moderation_status", "approved")
+                ),
+                fields=["post", "path"],
+                name="comment_visible_path_idx",
+            ),
+        ),
+    ]
@@ -0,0 +1,61 @@
+# Generated by Django 5.1.2 on 2026-10-16 21:35
+
+from django.db import migrations, models
+from django.db.models.functions import Coalesce
+
+
+def backfill_post_counters(apps, schema_editor):
+    Comment = apps.get_model("posts", "Comment")
+    Post = apps.get_model("posts", "Post")
+
+    def aggregate(expression, **filters):
+        return models.Subquery(
+            Comment.objects.filter(post=models.OuterRef("pk"), **filters)
+            .order_by()
+            .values("post")
+            .annotate(value=expression)
+            .values("value")
+        )
+
+    Post.objects.update(
+        comment_count=Coalesce(aggregate(models.Count("id")), 0),
+        blocked_comment_count=Coalesce(aggregate(models.Count("id"), is_blocked=True), 0),
+        last_comment_at=aggregate(models.Max("created_at")),
+    )
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("posts", "0009_comment_path"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="post",
+            name="comment_count",
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name="post",
+            name="blocked_comment_count",
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name="post",
+            name="last_comment_at",
+            field=models.DateTimeField(blank=True, editable=False, null=True),
+        ),
+        migrations.RunPython(backfill_post_counters, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name="post",
+            index=models.Index(
+                condition=models.Q(
+                    ("is_blocked", False),
+                    ("last_comment_at__isnull", False),
+                    ("moderation_status", "approved"),
+                ),
+                fields=["last_comment_at", "id"],
+                name="post_visible_activity_idx",
+            ),
+        ),
+    ]
@@ -0,0 +1,72 @@
+# Generated by Django 5.1.2 on 2026-10-16 21:50
+
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import SearchVector
+from django.db import migrations
+
+# The expressions of posts/search.py at the time of the migration, the search must use the same ones
+# to be served by the indexes
+POST_SEARCH_VECTOR = (
+    SearchVector("title", weight="A", config="english")
+    + SearchVector("content", weight="B", config="english")
+)
+COMMENT_SEARCH_VECTOR = SearchVector("content", config="english")
+
+# FTS5 tables of the posts and comments for the local development on SQLite, kept up to date by triggers
+SQLITE_FTS_TABLES = {
+    "posts_post": ("posts_post_fts", ("title", "content")),
+    "posts_comment": ("posts_comment_fts", ("content",)),
+}
+
+
+def get_sqlite_fts_sql(table, fts_table, columns):
+    column_list = ", ".join(columns)
+    new_values = ", ".join(f"new.{column}" for column in columns)
+    old_values = ", ".join(f"old.{column}" for column in columns)
+    insert = f"INSERT INTO {fts_table}(rowid, {column_list}) VALUES (new.id, {new_values});"
+    delete = f"INSERT INTO {fts_table}({fts_table}, rowid, {column_list}) VALUES ('delete', old.id, {old_values});"
+    return [
+        f"CREATE VIRTUAL TABLE {fts_table} USING fts5({column_list}, content='{table}', content_rowid='id')",
+        f"CREATE TRIGGER {fts_table}_ai AFTER INSERT ON {table} BEGIN {insert} END",
+        f"CREATE TRIGGER {fts_table}_ad AFTER DELETE ON {table} BEGIN {delete} END",
+        f"CREATE TRIGGER {fts_table}_au AFTER UPDATE OF {column_list} ON {table} BEGIN {delete} {insert} END",
+        f"INSERT INTO {fts_table}({fts_table}) VALUES ('rebuild')",
+    ]
+
+
+def create_search_indexes(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == "postgresql":
+        schema_editor.add_index(
+            apps.get_model("posts", "Post"), GinIndex(POST_SEARCH_VECTOR, name="post_search_idx")
+        )
+        schema_editor.add_index(
+            apps.get_model("posts", "Comment"), GinIndex(COMMENT_SEARCH_VECTOR, name="comment_search_idx")
+        )
+    elif vendor == "sqlite":
+        for table, (fts_table, columns) in SQLITE_FTS_TABLES.items():
+            for sql in get_sqlite_fts_sql(table, fts_table, columns):
+                schema_editor.execute(sql)
+
+
+def drop_search_indexes(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == "postgresql":
+        schema_editor.execute("DROP INDEX IF EXISTS post_search_idx")
+        schema_editor.execute("DROP INDEX IF EXISTS comment_search_idx")
+    elif vendor == "sqlite":
+        for fts_table, _ in SQLITE_FTS_TABLES.values():
+            # The triggers outlive the table and would break the writes to the posts and comments
+            for suffix in ("ai", "ad", "au"):
+                schema_editor.execute(f"DROP TRIGGER IF EXISTS {fts_table}_{suffix}")
+            schema_editor.execute(f"DROP TABLE IF EXISTS {fts_table}")
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("posts", "0010_post_comment_counters"),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_indexes, drop_search_indexes),
+    ]
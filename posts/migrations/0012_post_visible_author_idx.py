@@ -0,0 +1,20 @@
+# Generated by Django 5.1.2 on 2026-10-16 23:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("posts", "0011_search_indexes"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="post",
+            index=models.Index(
+                condition=models.Q(("is_blocked", False), ("moderation_status", "approved")),
+                fields=["author", "created_at", "id"],
+                name="post_visible_author_idx",
+            ),
+        ),
+    ]
@@ -0,0 +1,46 @@
+# Generated by Django 5.1.2 on 2026-10-16 23:15
+
+from django.db import migrations
+
+PATH_SEGMENT_LENGTH = 10
+
+
+def backfill_comment_paths(apps, schema_editor):
+    """
+    Builds the missing materialized paths on the databases other than PostgreSQL (e.g. SQLite for the local
+    development), where the migration 0009 doesn't backfill them.
+    """
+    if schema_editor.connection.vendor == "postgresql":
+        return
+
+    Comment = apps.get_model("posts", "Comment")
+    parents = dict(Comment.objects.values_list("id", "parent_id"))
+    paths = {}
+
+    def get_path(comment_id):
+        ancestors = []
+        while comment_id is not None and comment_id not in paths:
+            ancestors.append(comment_id)
+            comment_id = parents.get(comment_id)
+
+        path = paths.get(comment_id, "")
+        for ancestor_id in reversed(ancestors):
+            path += str(ancestor_id).zfill(PATH_SEGMENT_LENGTH)
+            paths[ancestor_id] = path
+        return path
+
+    comments = [
+        Comment(id=comment_id, path=get_path(comment_id))
+        for comment_id in Comment.objects.filter(path="").values_list("id", flat=True)
+    ]
+    Comment.objects.bulk_update(comments, ["path"], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("posts", "0012_post_visible_author_idx"),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_comment_paths, migrations.RunPython.noop),
+    ]
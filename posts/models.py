@@ -1,8 +1,64 @@
 from django.db import models
 from django.contrib.auth.models import User
+from django.utils import timezone
 
+NOT_MODERATED = object()
+# Width of one comment ID in the materialized path of the comment tree
+PATH_SEGMENT_LENGTH = 10
 
-class Post(models.Model):
+
+class PathField(models.TextField):
+    """
+    Text field whose `db_collation` is used only on PostgreSQL. The other databases (SQLite) have no "C"
+    collation, but compare the text byte by byte by default.
+    """
+
+    def db_parameters(self, connection):
+        db_params = super().db_parameters(connection)
+        if connection.vendor != "postgresql":
+            db_params["collation"] = None
+        return db_params
+
+
+class ModerationStatus(models.TextChoices):
+    PENDING = "pending", "Pending"
+    APPROVED = "approved", "Approved"
+    BLOCKED = "blocked", "Blocked"
+
+
+class ModeratedModel(models.Model):
+    """
+    Base class for models whose text fields are checked by the AI moderation.
+    It remembers the moderated values of the fields, so that only changed fields are checked again.
+    """
+    moderated_fields = ()
+
+    class Meta:
+        abstract = True
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Values stored in the database have already been moderated, unless the moderation is pending
+        if instance.__dict__.get("moderation_status") != ModerationStatus.PENDING:
+            instance.mark_as_moderated()
+        return instance
+
+    def mark_as_moderated(self):
+        # Deferred fields are not in the instance __dict__ and are skipped
+        self._moderated_values = {
+            field: self.__dict__[field] for field in self.moderated_fields if field in self.__dict__
+        }
+
+    def get_unmoderated_fields(self):
+        moderated_values = getattr(self, "_moderated_values", {})
+        return [
+            field for field in self.moderated_fields
+            if field in self.__dict__ and self.__dict__[field] != moderated_values.get(field, NOT_MODERATED)
+        ]
+
+
+class Post(ModeratedModel):
     title = models.CharField(max_length=255)
     content = models.TextField()
     created_at = models.DateTimeField(auto_now_add=True)
@@ -10,14 +66,57 @@ class Post(models.Model):
     author = models.ForeignKey(User, on_delete=models.CASCADE)
     is_blocked = models.BooleanField(default=False)
     block_reason = models.CharField(max_length=255, null=True, blank=True, default="")
+    moderation_status = models.CharField(
+        max_length=16, choices=ModerationStatus.choices, default=ModerationStatus.APPROVED
+    )
     auto_reply_enabled = models.BooleanField(default=False)
     reply_delay = models.IntegerField(default=0)  # minutes
+    # Denormalized comment counters, updated by the comment signals (see posts/stats.py)
+    comment_count = models.IntegerField(default=0, editable=False)
+    blocked_comment_count = models.IntegerField(default=0, editable=False)
+    last_comment_at = models.DateTimeField(null=True, blank=True, editable=False)
+
+    moderated_fields = ("title", "content")
+    counter_fields = ("comment_count", "blocked_comment_count", "last_comment_at")
+
+    class Meta:
+        indexes = [
+            # list_posts: visible posts ordered by (created_at, id)
+            models.Index(
+                fields=["created_at", "id"],
+                name="post_visible_created_idx",
+                condition=models.Q(is_blocked=False, moderation_status="approved"),
+            ),
+            # list_posts sorted by activity: visible commented posts ordered by (last_comment_at, id)
+            models.Index(
+                fields=["last_comment_at", "id"],
+                name="post_visible_activity_idx",
+                condition=models.Q(is_blocked=False, moderation_status="approved", last_comment_at__isnull=False),
+            ),
+            # Feed: visible posts of an author ordered by (created_at, id)
+            models.Index(
+                fields=["author", "created_at", "id"],
+                name="post_visible_author_idx",
+                condition=models.Q(is_blocked=False, moderation_status="approved"),
+            ),
+            # Batch moderation of pending posts
+            models.Index(fields=["id"], name="post_pending_idx", condition=models.Q(moderation_status="pending")),
+        ]
+
+    def save(self, *args, **kwargs):
+        # The counters are changed concurrently with F() updates, saving a loaded post must not overwrite them
+        if not self._state.adding and kwargs.get("update_fields") is None:
+            kwargs["update_fields"] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.name not in self.counter_fields and field.attname in self.__dict__
+            ]
+        super().save(*args, **kwargs)
 
     def __str__(self):
         return self.title
 
 
-class Comment(models.Model):
+class Comment(ModeratedModel):
     post = models.ForeignKey(Post, on_delete=models.CASCADE, related_name='comments')
     parent = models.ForeignKey('self', null=True, blank=True, on_delete=models.CASCADE, related_name='replies')
     content = models.TextField()
@@ -26,6 +125,67 @@ class Comment(models.Model):
     author = models.ForeignKey(User, on_delete=models.CASCADE)
     is_blocked = models.BooleanField(default=False)
     block_reason = models.CharField(max_length=255, null=True, blank=True, default="")
+    moderation_status = models.CharField(
+        max_length=16, choices=ModerationStatus.choices, default=ModerationStatus.APPROVED
+    )
+    # Materialized path: zero-padded IDs of the root comment, ..., the parent and the comment itself,
+    # see posts/threads.py. Ordering by it returns the threads depth-first. The byte order ("C" collation)
+    # lets the index on the path serve both the ordering and the prefix (LIKE) filters.
+    path = PathField(default="", editable=False, db_collation="C")
+
+    moderated_fields = ("content",)
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Remember the state counted in CommentDailyStats, deferred fields are loaded only when needed
+        if "created_at" in instance.__dict__ and "is_blocked" in instance.__dict__:
+            instance.mark_as_counted()
+        # Remember the parent the path was built for, so that moving the comment rebuilds the paths
+        if "parent_id" in instance.__dict__:
+            instance._path_parent_id = instance.parent_id
+        return instance
+
+    def get_counted_state(self):
+        """Returns the (date, is_blocked) pair the comment is counted with in CommentDailyStats."""
+        return timezone.localdate(self.created_at), self.is_blocked
+
+    def mark_as_counted(self):
+        self._counted_state = self.get_counted_state()
+
+    class Meta:
+        indexes = [
+            # list_comments: visible comments of a post ordered by (created_at, id)
+            models.Index(
+                fields=["post", "created_at", "id"],
+                name="comment_visible_post_idx",
+                condition=models.Q(is_blocked=False, moderation_status="approved"),
+            ),
+            # Analytics: created_at ranges, the blocked counts are read from the index only
+            models.Index(fields=["created_at"], include=["is_blocked"], name="comment_created_idx"),
+            # Batch moderation of pending comments
+            models.Index(fields=["id"], name="comment_pending_idx", condition=models.Q(moderation_status="pending")),
+            # Comment tree: visible comments of a post (or a subtree by the path prefix) in the thread order
+            models.Index(
+                fields=["post", "path"],
+                name="comment_visible_path_idx",
+                condition=models.Q(is_blocked=False, moderation_status="approved"),
+            ),
+        ]
 
     def __str__(self):
         return f"Comment by {self.author} on {self.post}"
+
+
+class CommentDailyStats(models.Model):
+    """
+    Daily rollup of the comments, which is read by the analytics instead of the Comment table.
+    It is updated incrementally by the signals (see posts/stats.py) and can be rebuilt
+    with the `rebuild_comment_stats` management command.
+    """
+    date = models.DateField(unique=True)
+    total_comments = models.IntegerField(default=0)
+    blocked_comments = models.IntegerField(default=0)
+
+    def __str__(self):
+        return f"Comments on {self.date}"
@@ -0,0 +1,137 @@
+from django.conf import settings
+
+from posts.ai_tools import (
+    AIServiceUnavailable,
+    MODERATION_UNAVAILABLE_VERDICT,
+    amoderate_contents_with_ai,
+    moderate_contents_with_ai,
+)
+from posts.models import ModerationStatus
+
+
+def get_unmoderated_texts(instances):
+    """
+    Returns the changed non-empty text fields of the instances.
+    :param instances: list of Post or Comment instances
+    :return: list of (instance, field)
+    """
+    return [
+        (instance, field)
+        for instance in instances
+        for field in instance.get_unmoderated_fields()
+        if getattr(instance, field)
+    ]
+
+
+def get_failure_verdicts(instances, fields):
+    """
+    Applies the `MODERATION_FAILURE_POLICY` setting when the AI-service is not available.
+    :return: instances with a verdict and the verdicts of the fields
+    """
+    print("AI-moderation is not available, the policy is applied: ", settings.MODERATION_FAILURE_POLICY)
+    if settings.MODERATION_FAILURE_POLICY == "queue":
+        queued = {id(instance): instance for instance, _ in fields}
+        for instance in queued.values():
+            # The content is saved as pending and moderated later by a Celery task
+            instance.moderation_status = ModerationStatus.PENDING
+            instance._moderation_requested = True
+        return [instance for instance in instances if id(instance) not in queued], []
+
+    if settings.MODERATION_FAILURE_POLICY == "open":
+        return instances, [(False, "")] * len(fields)
+
+    return instances, [MODERATION_UNAVAILABLE_VERDICT] * len(fields)
+
+
+def apply_verdicts(instances, fields, verdicts):
+    """
+    Updates `is_blocked`, `block_reason` and `moderation_status` of the instances.
+    The first inappropriate field of an instance gives the block reason.
+    """
+    blocked = set()
+    for (instance, field), (result, reason) in zip(fields, verdicts):
+        if result and id(instance) not in blocked:
+            blocked.add(id(instance))
+            instance.is_blocked = True
+            instance.block_reason = reason
+
+    for instance in instances:
+        instance.mark_as_moderated()
+        instance.moderation_status = ModerationStatus.BLOCKED if instance.is_blocked else ModerationStatus.APPROVED
+
+
+def moderate_instances(instances):
+    """
+    Checks the changed text fields of the instances for inappropriate content.
+
+    This is the single moderation pipeline for posts and comments. Only the fields which
+    differ from the last moderated (or loaded from the database) values are checked, and
+    all of them are sent to the AI-service in one batch request. The verdict is carried on
+    the instances themselves: `is_blocked`, `block_reason` and `moderation_status` are updated.
+    If the AI-service is not available, the `MODERATION_FAILURE_POLICY` setting is applied.
+    :param instances: list of Post or Comment instances
+    :return: None
+    """
+    fields = get_unmoderated_texts(instances)
+    try:
+        verdicts = moderate_contents_with_ai([getattr(instance, field) for instance, field in fields]) if fields else []
+    except AIServiceUnavailable:
+        instances, verdicts = get_failure_verdicts(instances, fields)
+
+    apply_verdicts(instances, fields, verdicts)
+
+
+async def amoderate_instances(instances):
+    """
+    Async version of moderate_instances().
+    The verdict carried on the instances is reused by the pre_save signals, so they don't check the content again.
+    :param instances: list of Post or Comment instances
+    :return: None
+    """
+    fields = get_unmoderated_texts(instances)
+    try:
+        texts = [getattr(instance, field) for instance, field in fields]
+        verdicts = await amoderate_contents_with_ai(texts) if fields else []
+    except AIServiceUnavailable:
+        instances, verdicts = get_failure_verdicts(instances, fields)
+
+    apply_verdicts(instances, fields, verdicts)
+
+
+def moderate_instance(instance):
+    """
+    Checks the changed text fields of the instance for inappropriate content.
+    :param instance: Post or Comment instance
+    :return: None
+    """
+    moderate_instances([instance])
+
+
+async def amoderate_instance(instance):
+    """
+    Async version of moderate_instance().
+    :param instance: Post or Comment instance
+    :return: None
+    """
+    await amoderate_instances([instance])
+
+
+def request_moderation(instance):
+    """
+    Moderates the instance before saving or, in the asynchronous mode, marks it as pending.
+
+    In the asynchronous mode (`MODERATION_ASYNC` setting) the instance with changed text fields
+    is saved right away with the `pending` status and is moderated later by a Celery task.
+    :param instance: Post or Comment instance
+    :return: None
+    """
+    # The moderation has already been queued
+    if getattr(instance, "_moderation_requested", False):
+        return
+
+    if settings.MODERATION_ASYNC and instance.get_unmoderated_fields():
+        instance.moderation_status = ModerationStatus.PENDING
+        instance._moderation_requested = True
+        return
+
+    moderate_instance(instance)
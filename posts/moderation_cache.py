@@ -0,0 +1,118 @@
+import hashlib
+import re
+import threading
+import time
+
+from cachetools import TTLCache
+from django.conf import settings
+from django.core.cache import caches
+
+
+def normalize_text(text):
+    """
+    Normalizes the text so that trivially different copies share one cache entry.
+    :param text: str
+    :return: str
+    """
+    return re.sub(r"\s+", " ", text or "").strip().casefold()
+
+
+def content_hash(text):
+    """
+    Returns the hash of the normalized text.
+    :param text: str
+    :return: str
+    """
+    return hashlib.sha256(normalize_text(text).encode("utf-8")).hexdigest()
+
+
+class ModerationCache:
+    """
+    Two-tier cache of AI moderation verdicts keyed by the normalized content hash.
+
+    The first tier is an in-process LRU cache with a TTL. The second (optional) tier is
+    a shared Django cache (e.g. Redis), so that verdicts are reused between workers.
+    """
+    key_prefix = "moderation:"
+
+    def __init__(self, max_size, ttl, shared_alias=None, timer=time.monotonic):
+        self.ttl = ttl
+        self.shared_alias = shared_alias
+        self._local = TTLCache(maxsize=max_size, ttl=ttl, timer=timer)
+        self._lock = threading.Lock()
+        self._counters = {"local_hits": 0, "shared_hits": 0, "misses": 0}
+
+    @property
+    def shared(self):
+        if self.shared_alias and self.shared_alias in settings.CACHES:
+            return caches[self.shared_alias]
+        return None
+
+    def _count(self, name):
+        with self._lock:
+            self._counters[name] += 1
+
+    def get(self, text):
+        """
+        Returns the cached verdict for the text or None.
+        :param text: str
+        :return: (Bool, str) or None
+        """
+        key = content_hash(text)
+
+        with self._lock:
+            verdict = self._local.get(key)
+        if verdict is not None:
+            self._count("local_hits")
+            return verdict
+
+        if self.shared is not None:
+            verdict = self.shared.get(self.key_prefix + key)
+            if verdict is not None:
+                verdict = tuple(verdict)
+                with self._lock:
+                    self._local[key] = verdict
+                self._count("shared_hits")
+                return verdict
+
+        self._count("misses")
+        return None
+
+    def set(self, text, verdict):
+        """
+        Stores the verdict for the text in both tiers.
+        :param text: str
+        :param verdict: (Bool, str)
+        """
+        key = content_hash(text)
+        verdict = tuple(verdict)
+
+        with self._lock:
+            self._local[key] = verdict
+        if self.shared is not None:
+            self.shared.set(self.key_prefix + key, list(verdict), timeout=self.ttl)
+
+    def clear(self):
+        with self._lock:
+            self._local.clear()
+            for name in self._counters:
+                self._counters[name] = 0
+
+    def stats(self):
+        """
+        Returns hit/miss counters of the cache.
+        :return: dict
+        """
+        with self._lock:
+            stats = dict(self._counters, size=len(self._local))
+        stats["hits"] = stats["local_hits"] + stats["shared_hits"]
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_ratio"] = stats["hits"] / lookups if lookups else 0.0
+        return stats
+
+
+moderation_cache = ModerationCache(
+    max_size=settings.MODERATION_CACHE_MAX_SIZE,
+    ttl=settings.MODERATION_CACHE_TTL,
+    shared_alias=settings.MODERATION_CACHE_ALIAS,
+)
@@ -0,0 +1,136 @@
+import re
+from collections import deque
+
+from django.conf import settings
+
+# Common character substitutions used to get round word filters
+LEET_TABLE = str.maketrans({"0": "o", "1": "i", "3": "e", "4": "a", "5": "s", "7": "t", "@": "a", "$": "s"})
+
+
+class AhoCorasick:
+    """
+    Aho–Corasick automaton which finds all occurrences of many patterns in one pass over the text.
+    """
+
+    def __init__(self, patterns):
+        """
+        :param patterns: dict of pattern -> value returned for its matches
+        """
+        self.goto = [{}]
+        self.fail = [0]
+        self.output = [[]]
+
+        for pattern, value in patterns.items():
+            self._add(pattern, value)
+        self._build_fail_links()
+
+    def _add(self, pattern, value):
+        state = 0
+        for char in pattern:
+            if char not in self.goto[state]:
+                self.goto.append({})
+                self.fail.append(0)
+                self.output.append([])
+                self.goto[state][char] = len(self.goto) - 1
+            state = self.goto[state][char]
+        self.output[state].append((len(pattern), value))
+
+    def _build_fail_links(self):
+        queue = deque(self.goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, next_state in self.goto[state].items():
+                queue.append(next_state)
+
+                fail = self.fail[state]
+                while fail and char not in self.goto[fail]:
+                    fail = self.fail[fail]
+                self.fail[next_state] = self.goto[fail].get(char, 0)
+                self.output[next_state] += self.output[self.fail[next_state]]
+
+    def iter_matches(self, text):
+        """
+        Yields the matches found in the text.
+        :param text: str
+        :return: iterator of (start, end, value)
+        """
+        state = 0
+        for end, char in enumerate(text, start=1):
+            while state and char not in self.goto[state]:
+                state = self.fail[state]
+            state = self.goto[state].get(char, 0)
+
+            for length, value in self.output[state]:
+                yield end - length, end, value
+
+
+class ContentPrefilter:
+    """
+    Local pre-moderation stage which runs before the AI moderation.
+
+    It blocks texts with the words from the blocklist and approves short texts which consist only
+    of the words from the allowlist. Other texts are ambiguous and have to be checked by the AI-service.
+    """
+    max_allowed_words = 8
+
+    def __init__(self, blocklist, allowlist):
+        """
+        :param blocklist: dict of pattern -> category, see data/blocklist.txt
+        :param allowlist: set of words
+        """
+        patterns = {}
+        for pattern, category in blocklist.items():
+            patterns[pattern.strip("*")] = (pattern.startswith("*"), pattern.endswith("*"), category)
+
+        self.automaton = AhoCorasick(patterns)
+        self.allowlist = allowlist
+
+    @classmethod
+    def from_files(cls, blocklist_path, allowlist_path):
+        blocklist = {}
+        for line in read_list(blocklist_path):
+            pattern, category = line.rsplit(maxsplit=1)
+            blocklist[normalize(pattern)] = category
+
+        return cls(blocklist, set(read_list(allowlist_path)))
+
+    def check(self, text):
+        """
+        Checks the text with the local rules.
+        :param text: str
+        :return: (Bool, str) if the decision is confident, otherwise None
+        """
+        text = normalize(text)
+        if not re.search(r"\w", text):
+            return False, ""
+
+        for variant in {text, text.translate(LEET_TABLE), re.sub(r"(\w)\1{2,}", r"\1", text)}:
+            for start, end, (prefix_allowed, suffix_allowed, category) in self.automaton.iter_matches(variant):
+                if (prefix_allowed or not is_word_char(variant, start - 1)) and \
+                        (suffix_allowed or not is_word_char(variant, end)):
+                    return True, category
+
+        words = re.findall(r"\w+", text)
+        if len(words) <= self.max_allowed_words and all(word in self.allowlist for word in words):
+            return False, ""
+
+        return None
+
+
+def normalize(text):
+    return re.sub(r"\s+", " ", text or "").strip().casefold()
+
+
+def is_word_char(text, index):
+    return 0 <= index < len(text) and text[index].isalnum()
+
+
+def read_list(path):
+    with open(path, encoding="utf-8") as file:
+        return [line.strip() for line in file if line.strip() and not line.startswith("#")]
+
+
+prefilter = ContentPrefilter.from_files(
+    settings.MODERATION_BLOCKLIST_PATH,
+    settings.MODERATION_ALLOWLIST_PATH,
+)
@@ -0,0 +1,83 @@
+import threading
+import time
+
+import redis
+from django.conf import settings
+
+from posts.cache_tools import get_shared_redis
+
+# Refills the bucket and takes the tokens atomically, returns the wait time (ms) if there are not enough tokens
+TOKEN_BUCKET_SCRIPT = """
+local capacity = tonumber(ARGV[1])
+local rate = tonumber(ARGV[2])
+local now = tonumber(ARGV[3])
+local requested = tonumber(ARGV[4])
+
+local bucket = redis.call("HMGET", KEYS[1], "tokens", "updated_at")
+local tokens = tonumber(bucket[1]) or capacity
+local updated_at = tonumber(bucket[2]) or now
+tokens = math.min(capacity, tokens + math.max(0, now - updated_at) * rate)
+
+local wait = 0
+if tokens >= requested then
+    tokens = tokens - requested
+else
+    wait = math.ceil((requested - tokens) / rate * 1000)
+end
+
+redis.call("HSET", KEYS[1], "tokens", tokens, "updated_at", now)
+redis.call("PEXPIRE", KEYS[1], math.ceil(capacity / rate * 1000) + 1000)
+return wait
+"""
+
+
+class TokenBucket:
+    """
+    Token bucket rate limiter of the requests to an external service.
+
+    The bucket holds up to `capacity` tokens and is refilled with `rate` tokens per second.
+    If Redis is configured (`REDIS_CACHE_URL`), the bucket is shared by all processes and updated
+    atomically by a Lua script, otherwise it is kept in the memory of the process. The cache API can't
+    refill and take the tokens atomically, so the script is run by the client of the shared cache.
+    """
+
+    def __init__(self, name, rate, capacity, client=None, timer=time.time):
+        self.key = f"rate_limiter:{name}"
+        self.rate = rate
+        self.capacity = capacity
+        self.timer = timer
+        self._script = client.register_script(TOKEN_BUCKET_SCRIPT) if client is not None else None
+        self._lock = threading.Lock()
+        self._tokens = capacity
+        self._updated_at = None
+
+    def try_acquire(self, tokens=1):
+        """
+        Takes the tokens if the bucket has enough of them.
+        :param tokens: int
+        :return: float, 0 if the tokens have been taken, otherwise seconds to wait before the next attempt
+        """
+        if self._script is not None:
+            try:
+                return self._script(keys=[self.key], args=[self.capacity, self.rate, self.timer(), tokens]) / 1000
+            except redis.RedisError as e:
+                print("Rate limiter falls back to the local bucket: ", str(e))
+
+        with self._lock:
+            now = self.timer()
+            if self._updated_at is not None:
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated_at) * self.rate)
+            self._updated_at = now
+
+            if self._tokens >= tokens:
+                self._tokens -= tokens
+                return 0
+            return (tokens - self._tokens) / self.rate
+
+
+ai_rate_limiter = TokenBucket(
+    "gemini",
+    rate=settings.AI_RATE_LIMIT_PER_MINUTE / 60,
+    capacity=settings.AI_RATE_LIMIT_BURST,
+    client=get_shared_redis(),
+)
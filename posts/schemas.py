@@ -1,5 +1,5 @@
 from ninja import Schema
-from typing import Optional
+from typing import ClassVar, List, Optional
 from datetime import datetime
 
 
@@ -20,9 +20,19 @@ class PostOutSchema(Schema):
     updated_at: datetime
     is_blocked: bool
     block_reason: str
+    moderation_status: str
     author: str
     auto_reply_enabled: bool
     reply_delay: int
+    comment_count: int
+    last_comment_at: Optional[datetime] = None
+
+    # Columns read by from_orm(), the author is loaded with the same query
+    orm_fields: ClassVar[tuple] = (
+        "id", "title", "content", "created_at", "updated_at", "is_blocked", "block_reason",
+        "moderation_status", "author__username", "auto_reply_enabled", "reply_delay",
+        "comment_count", "last_comment_at",
+    )
 
     class Config:
         from_attributes = True
@@ -45,9 +55,12 @@ class PostOutSchema(Schema):
             "updated_at": post.updated_at,
             "is_blocked": post.is_blocked,
             "block_reason": post.block_reason,
+            "moderation_status": post.moderation_status,
             "author": post.author.username,
             "auto_reply_enabled": post.auto_reply_enabled,
-            "reply_delay": post.reply_delay
+            "reply_delay": post.reply_delay,
+            "comment_count": post.comment_count,
+            "last_comment_at": post.last_comment_at,
         }
 
 
@@ -57,6 +70,14 @@ class CommentInSchema(Schema):
     parent_id: Optional[int] = None  # For replies to comments
 
 
+# Comment schema for the bulk import
+class CommentImportSchema(Schema):
+    post_id: int
+    content: str
+    parent_id: Optional[int] = None
+    author_id: Optional[int] = None  # The current user by default
+
+
 # Comment schema for responses
 class CommentOutSchema(Schema):
     id: int
@@ -66,8 +87,15 @@ class CommentOutSchema(Schema):
     created_at: datetime
     updated_at: datetime
     is_blocked: bool
+    moderation_status: str
     author: str
 
+    # Columns read by from_orm(), the author is loaded with the same query
+    orm_fields: ClassVar[tuple] = (
+        "id", "content", "post_id", "parent_id", "created_at", "updated_at", "is_blocked", "block_reason",
+        "moderation_status", "author__username",
+    )
+
     class Config:
         from_attributes = True
         json_encoders = {
@@ -90,5 +118,16 @@ class CommentOutSchema(Schema):
             "updated_at": comment.updated_at,
             "is_blocked": comment.is_blocked,
             "block_reason": comment.block_reason,
+            "moderation_status": comment.moderation_status,
             "author": comment.author.username,
         }
+
+
+# Comment schema for the nested threads
+class CommentTreeSchema(CommentOutSchema):
+    replies: List["CommentTreeSchema"] = []
+
+
+# Post schema for the feed, with the latest visible comments
+class FeedPostSchema(PostOutSchema):
+    latest_comments: List[CommentOutSchema] = []
@@ -0,0 +1,71 @@
+import re
+
+from django.contrib.postgres.search import SearchQuery, SearchRank, SearchVector
+from django.db import connection
+from django.db.models import F
+from django.db.models.expressions import RawSQL
+
+SEARCH_CONFIG = "english"
+
+
+def get_post_search_vector():
+    """
+    Returns the PostgreSQL search vector of the posts, the title is ranked higher than the content.
+    The GIN index of the migration 0011 is built on the same expression.
+    """
+    return (
+        SearchVector("title", weight="A", config=SEARCH_CONFIG)
+        + SearchVector("content", weight="B", config=SEARCH_CONFIG)
+    )
+
+
+def get_comment_search_vector():
+    return SearchVector("content", config=SEARCH_CONFIG)
+
+
+def get_fts5_query(text):
+    """
+    Converts the user input to a FTS5 query, which matches all words of the input.
+    :param text: str
+    :return: str or None if there are no words
+    """
+    words = re.findall(r"\w+", text)
+    return " ".join(f'"{word}"' for word in words) or None
+
+
+def search(queryset, text, vector, fts_table):
+    """
+    Filters the queryset by the full-text search and orders it by the rank, the best matches first.
+
+    PostgreSQL matches the search vector, which is read from the GIN index. On SQLite (local development)
+    the FTS5 table kept up to date by triggers is used instead.
+    :param queryset: QuerySet of posts or comments
+    :param text: str, the search query in the web search syntax (PostgreSQL)
+    :param vector: function, which returns the search vector of the model
+    :param fts_table: str, the name of the FTS5 table of the model
+    :return: QuerySet annotated with `rank`
+    """
+    if connection.vendor == "postgresql":
+        query = SearchQuery(text, config=SEARCH_CONFIG, search_type="websearch")
+        queryset = queryset.annotate(search=vector()).filter(search=query).annotate(rank=SearchRank(F("search"), query))
+        return queryset.order_by("-rank", "-id")
+
+    match = get_fts5_query(text)
+    if match is None:
+        return queryset.none()
+
+    table = queryset.model._meta.db_table
+    return queryset.filter(
+        id__in=RawSQL(f"SELECT rowid FROM {fts_table} WHERE {fts_table} MATCH %s", [match])
+    ).annotate(
+        # bm25() is lower for the better matches
+        rank=RawSQL(f"SELECT -bm25({fts_table}) FROM {fts_table} WHERE {fts_table} MATCH %s AND rowid = {table}.id", [match])
+    ).order_by("-rank", "-id")
+
+
+def search_posts(queryset, text):
+    return search(queryset, text, get_post_search_vector, "posts_post_fts")
+
+
+def search_comments(queryset, text):
+    return search(queryset, text, get_comment_search_vector, "posts_comment_fts")
@@ -1,8 +1,14 @@
-from django.db.models.signals import pre_save
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save, pre_save
 from django.dispatch import receiver
+from django.utils import timezone
 
-from .ai_tools import moderate_content_with_ai
-from .models import Comment, Post
+from .models import Comment, ModerationStatus, Post
+from .moderation import request_moderation
+from .stats import get_stats_changes, update_comment_stats, update_post_counters
+from .tasks import schedule_pending_moderation
+from .threads import move_comment_subtree, set_comment_path
+from .timelines import post_timelines
 
 
 @receiver(pre_save, sender=Comment)
@@ -13,7 +19,9 @@ def check_comment_content(sender, instance, **kwargs):
     This method is triggered before a comment is saved to the database. It uses an AI-based
     moderation tool to analyze the comment's content. If inappropriate content is detected,
     the comment is marked as blocked by setting the `is_blocked` field to True, and the
-    `block_reason` field is populated with the reason for the block.
+    `block_reason` field is populated with the reason for the block. The content is checked
+    only if it has changed since the last moderation. In the asynchronous moderation mode
+    the comment is only marked as pending.
 
     Args:
         sender: The model class (Comment) that sent the signal.
@@ -24,10 +32,7 @@ def check_comment_content(sender, instance, **kwargs):
         None: The method modifies the `instance` directly by updating its fields if inappropriate
               content is detected.
     """
-    result, reason = moderate_content_with_ai(instance.content)
-    if result:
-        instance.is_blocked = True
-        instance.block_reason = reason
+    request_moderation(instance)
 
 
 @receiver(pre_save, sender=Post)
@@ -39,7 +44,9 @@ def check_post_content(sender, instance, **kwargs):
     to analyze the post's title and content. If either contains inappropriate material, the post is marked
     as blocked by setting the `is_blocked` field to True, and the `block_reason` field is updated with
     the reason for blocking. The post is saved regardless of content moderation results, but marked
-    as blocked if necessary.
+    as blocked if necessary. Only the fields changed since the last moderation are checked, both
+    with a single request to the AI-service. In the asynchronous moderation mode the post is only
+    marked as pending.
 
     Args:
         sender: The model class (Post) that sent the signal.
@@ -50,14 +57,114 @@ def check_post_content(sender, instance, **kwargs):
         None: The method modifies the `instance` directly by updating its fields if inappropriate
               content or title is detected.
     """
-    if instance.title:
-        result, reason = moderate_content_with_ai(instance.title)
-        if result:
-            instance.is_blocked = True
-            instance.block_reason = reason
-
-    if hasattr(instance, 'content'):
-        result, reason = moderate_content_with_ai(instance.content)
-        if result:
-            instance.is_blocked = True
-            instance.block_reason = reason
+    request_moderation(instance)
+
+
+@receiver(post_save, sender=Comment)
+@receiver(post_save, sender=Post)
+def schedule_content_moderation(sender, instance, **kwargs):
+    """
+    Post-save signal handler to schedule the asynchronous moderation of a pending post or comment.
+
+    The pending content is moderated in batches. The Celery task is sent after the transaction
+    is committed, so that the task can load the saved object.
+    """
+    if not getattr(instance, "_moderation_requested", False):
+        return
+
+    instance._moderation_requested = False
+    transaction.on_commit(schedule_pending_moderation)
+
+
+@receiver(pre_save, sender=Comment)
+def load_counted_comment_state(sender, instance, **kwargs):
+    """
+    Pre-save signal handler which loads the state of a comment counted in the daily stats,
+    if the comment has not been loaded from the database with both `created_at` and `is_blocked`.
+    """
+    if instance._state.adding or hasattr(instance, "_counted_state"):
+        return
+
+    row = Comment.objects.filter(pk=instance.pk).values_list("created_at", "is_blocked").first()
+    if row:
+        created_at, is_blocked = row
+        instance._counted_state = timezone.localdate(created_at), is_blocked
+
+
+@receiver(post_save, sender=Comment)
+def update_daily_stats_on_save(sender, instance, created, **kwargs):
+    """
+    Post-save signal handler to keep the daily comment stats and the post comment counters up to date.
+
+    A new comment is added to the stats of its day and to the counters of its post. For an updated
+    comment the previously counted state is replaced, so that blocking the comment or changing its
+    `created_at` moves the counts.
+    """
+    counted_state = None if created else getattr(instance, "_counted_state", None)
+    state = instance.get_counted_state()
+    if state != counted_state:
+        update_comment_stats(get_stats_changes(removed=[counted_state] if counted_state else [], added=[state]))
+
+    if created:
+        update_post_counters(instance.post_id, 1, int(instance.is_blocked), instance.created_at)
+    elif counted_state and state != counted_state:
+        _, was_blocked = counted_state
+        update_post_counters(
+            instance.post_id,
+            blocked=int(instance.is_blocked) - int(was_blocked),
+            refresh_last_comment_at=counted_state[0] != state[0],
+        )
+    instance._counted_state = state
+
+
+@receiver(post_delete, sender=Comment)
+def update_daily_stats_on_delete(sender, instance, **kwargs):
+    """
+    Post-delete signal handler to remove the deleted comment from the daily stats and the post counters.
+    """
+    counted_state = getattr(instance, "_counted_state", None)
+    if counted_state:
+        update_comment_stats(get_stats_changes(removed=[counted_state]))
+        update_post_counters(instance.post_id, -1, -int(counted_state[1]), refresh_last_comment_at=True)
+
+
+@receiver(post_save, sender=Comment)
+def update_comment_path(sender, instance, created, **kwargs):
+    """
+    Post-save signal handler to keep the materialized path of the comment tree up to date.
+
+    The path of a new comment is built from its ID and the parent path. If the comment has been
+    moved to another parent, the paths of the comment and all its replies are rebuilt.
+    """
+    if created:
+        set_comment_path(instance)
+    elif hasattr(instance, "_path_parent_id") and instance._path_parent_id != instance.parent_id:
+        move_comment_subtree(instance)
+
+
+@receiver(post_save, sender=Post)
+def update_post_timeline_on_save(sender, instance, **kwargs):
+    """
+    Post-save signal handler to keep the feed timeline of the post author up to date.
+
+    A visible post is added to the timeline, a blocked or pending post is removed from it.
+    The timeline is updated after the transaction is committed.
+    """
+    if not post_timelines.enabled:
+        return
+
+    visible = not instance.is_blocked and instance.moderation_status == ModerationStatus.APPROVED
+    author_id, post_id, created_at = instance.author_id, instance.pk, instance.created_at if visible else None
+    transaction.on_commit(lambda: post_timelines.update(author_id, post_id, created_at))
+
+
+@receiver(post_delete, sender=Post)
+def update_post_timeline_on_delete(sender, instance, **kwargs):
+    """
+    Post-delete signal handler to remove the deleted post from the feed timeline of its author.
+    """
+    if not post_timelines.enabled:
+        return
+
+    author_id, post_id = instance.author_id, instance.pk
+    transaction.on_commit(lambda: post_timelines.update(author_id, post_id))
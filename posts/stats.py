@@ -0,0 +1,183 @@
+from collections import Counter
+
+from django.db import IntegrityError, models, transaction
+from django.db.models import Count, F, Max, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce, Greatest
+
+from posts.cache_tools import get_shared_cache
+from posts.models import Comment, CommentDailyStats, Post
+
+
+def get_stats_cache_key(date):
+    return f"comment_daily_stats:{date.isoformat()}"
+
+
+def invalidate_comment_stats_cache(dates):
+    """
+    Removes the cached analytics of the dates. It is repeated after the commit, so that the old value
+    read by a concurrent request before the commit does not stay in the cache.
+    :param dates: list of dates
+    """
+    keys = [get_stats_cache_key(date) for date in dates]
+    if not keys:
+        return
+
+    get_shared_cache().delete_many(keys)
+    transaction.on_commit(lambda: get_shared_cache().delete_many(keys))
+
+
+def update_comment_stats(changes):
+    """
+    Applies the changes to the daily comment stats with atomic F() updates.
+    :param changes: dict of date -> (total_comments delta, blocked_comments delta)
+    """
+    invalidate_comment_stats_cache([date for date, delta in changes.items() if any(delta)])
+
+    for date, (total, blocked) in sorted(changes.items()):
+        if not total and not blocked:
+            continue
+
+        updated = CommentDailyStats.objects.filter(date=date).update(
+            total_comments=F("total_comments") + total,
+            blocked_comments=F("blocked_comments") + blocked,
+        )
+        if updated:
+            continue
+
+        try:
+            with transaction.atomic():
+                CommentDailyStats.objects.create(date=date, total_comments=total, blocked_comments=blocked)
+        except IntegrityError:
+            # The row has been created by a concurrent request
+            CommentDailyStats.objects.filter(date=date).update(
+                total_comments=F("total_comments") + total,
+                blocked_comments=F("blocked_comments") + blocked,
+            )
+
+
+def get_stats_changes(removed=(), added=()):
+    """
+    Collects the stats changes for the comment states removed from and added to the counts.
+    :param removed: iterable of (date, is_blocked)
+    :param added: iterable of (date, is_blocked)
+    :return: dict of date -> (total_comments delta, blocked_comments delta)
+    """
+    totals = Counter()
+    blocked = Counter()
+    for sign, states in ((-1, removed), (1, added)):
+        for date, is_blocked in states:
+            totals[date] += sign
+            blocked[date] += sign * is_blocked
+
+    return {date: (totals[date], blocked[date]) for date in totals}
+
+
+def get_last_comment_at_subquery():
+    return Subquery(
+        Comment.objects.filter(post=OuterRef("pk")).order_by().values("post").annotate(last=Max("created_at"))
+        .values("last")
+    )
+
+
+def update_post_counters(post_id, total=0, blocked=0, last_comment_at=None, refresh_last_comment_at=False):
+    """
+    Updates the denormalized comment counters of the post with one atomic F() update.
+    :param post_id: int
+    :param total: int, comment_count delta
+    :param blocked: int, blocked_comment_count delta
+    :param last_comment_at: datetime, the creation time of a new comment, last_comment_at only moves forward
+    :param refresh_last_comment_at: Bool, recalculate last_comment_at, e.g. after a comment has been deleted
+    """
+    updates = {}
+    if total:
+        updates["comment_count"] = F("comment_count") + total
+    if blocked:
+        updates["blocked_comment_count"] = F("blocked_comment_count") + blocked
+    if refresh_last_comment_at:
+        updates["last_comment_at"] = get_last_comment_at_subquery()
+    elif last_comment_at is not None:
+        updates["last_comment_at"] = Greatest(Coalesce("last_comment_at", Value(last_comment_at)), Value(last_comment_at))
+
+    if updates:
+        Post.objects.filter(pk=post_id).update(**updates)
+
+
+def count_comments(comments):
+    """
+    Adds the comments created bypassing the signals (e.g. with bulk_create) to the stats and the post counters.
+    :param comments: iterable of saved Comment instances
+    """
+    comments = list(comments)
+    update_comment_stats(get_stats_changes(added=[comment.get_counted_state() for comment in comments]))
+
+    totals, blocked, last_comment_at = Counter(), Counter(), {}
+    for comment in comments:
+        comment.mark_as_counted()
+        totals[comment.post_id] += 1
+        blocked[comment.post_id] += comment.is_blocked
+        last_comment_at[comment.post_id] = max(last_comment_at.get(comment.post_id, comment.created_at), comment.created_at)
+
+    for post_id in sorted(totals):
+        update_post_counters(post_id, totals[post_id], blocked[post_id], last_comment_at[post_id])
+
+
+def rebuild_post_counters(post_ids=None):
+    """
+    Recalculates the denormalized comment counters of the posts from the Comment table.
+    :param post_ids: list of the post IDs to rebuild, all posts if not set
+    :return: number of rebuilt posts
+    """
+    def count(**filters):
+        return Coalesce(Subquery(
+            Comment.objects.filter(post=OuterRef("pk"), **filters).order_by().values("post")
+            .annotate(count=Count("id")).values("count")
+        ), 0)
+
+    posts = Post.objects.all()
+    if post_ids:
+        posts = posts.filter(pk__in=post_ids)
+
+    return posts.update(
+        comment_count=count(),
+        blocked_comment_count=count(is_blocked=True),
+        last_comment_at=get_last_comment_at_subquery(),
+    )
+
+
+def rebuild_comment_stats(start_date=None, end_date=None):
+    """
+    Recalculates the daily comment stats from the Comment table.
+    :param start_date: first date to rebuild, all dates if not set
+    :param end_date: last date to rebuild, all dates if not set
+    :return: number of rebuilt days
+    """
+    comments = Comment.objects.all()
+    stats = CommentDailyStats.objects.all()
+    if start_date:
+        comments = comments.filter(created_at__date__gte=start_date)
+        stats = stats.filter(date__gte=start_date)
+    if end_date:
+        comments = comments.filter(created_at__date__lte=end_date)
+        stats = stats.filter(date__lte=end_date)
+
+    rows = (
+        comments.values("created_at__date")
+        .annotate(total_comments=Count("id"), blocked_comments=Count("id", filter=models.Q(is_blocked=True)))
+        .order_by("created_at__date")
+    )
+
+    with transaction.atomic():
+        invalidate_comment_stats_cache(list(stats.values_list("date", flat=True)) + [
+            row["created_at__date"] for row in rows
+        ])
+        stats.delete()
+        CommentDailyStats.objects.bulk_create([
+            CommentDailyStats(
+                date=row["created_at__date"],
+                total_comments=row["total_comments"],
+                blocked_comments=row["blocked_comments"],
+            )
+            for row in rows
+        ])
+
+    return len(rows)
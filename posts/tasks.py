@@ -1,29 +1,199 @@
 from celery import shared_task
+from django.conf import settings
+from django.db import transaction
 from django.http import JsonResponse
+from django.utils.dateparse import parse_datetime
 
-from posts.ai_tools import generate_relevant_reply
-from posts.models import Comment, Post
+from posts.ai_tools import AIServiceUnavailable, generate_relevant_replies, generate_relevant_reply
+from posts.models import Comment, Post, ModerationStatus
+from posts.cache_tools import get_shared_cache
+from posts.moderation import moderate_instances
 
 
-@shared_task
-def send_auto_reply(post_id, comment_id):
+def create_auto_replies(post, replies):
+    """
+    Creates the auto replies of the post author, unless the comments have already been answered.
+    The replies are moderated before the transaction, so the comments are not locked while the AI-service
+    is called. The replied comment is the idempotency key: the comments are locked and checked in one
+    transaction, so retried or concurrent tasks don't reply twice.
+    :param post: Post instance
+    :param replies: dict of the reply text by the comment ID
+    :return: list of created replies
+    """
+    instances = [
+        Comment(author_id=post.author_id, post=post, content=content, parent_id=comment_id)
+        for comment_id, content in replies.items()
+    ]
+    # In the asynchronous moderation mode the replies are saved as pending by the pre_save signal
+    if not settings.MODERATION_ASYNC:
+        moderate_instances(instances)
+
+    created = []
+    with transaction.atomic():
+        comments = Comment.objects.select_for_update().in_bulk(list(replies))
+        answered = set(
+            Comment.objects.filter(parent_id__in=list(comments), author_id=post.author_id)
+            .values_list("parent_id", flat=True)
+        )
+        for reply in instances:
+            if reply.parent_id not in comments or reply.parent_id in answered:
+                continue
+
+            # The pre_save signal reuses the verdict carried on the reply
+            reply.parent = comments[reply.parent_id]
+            reply.save()
+            created.append(reply)
+
+    return created
+
+
+@shared_task(bind=True, max_retries=5, priority=settings.AUTO_REPLY_TASK_PRIORITY)
+def send_auto_reply(self, post_id, comment_id):
     try:
-        post = Post.objects.get(id=post_id)
-        comment = Comment.objects.get(id=comment_id)
+        # The post is loaded with the comment by one query
+        comment = Comment.objects.select_related("post").get(id=comment_id, post_id=post_id)
+        post = comment.post
 
         # Relevant answer generate
-        reply_content = generate_relevant_reply(post, comment)
+        try:
+            reply_content = generate_relevant_reply(post, comment)
+        except AIServiceUnavailable as e:
+            raise self.retry(exc=e, countdown=settings.AI_CIRCUIT_RECOVERY_TIMEOUT)
 
         # Comment create
-        comment = Comment.objects.create(
-            author=post.author,
+        for comment in create_auto_replies(post, {comment.id: reply_content}):
+            print(f"Auto reply has been created: {comment.content}")
+    except Comment.DoesNotExist:
+        return JsonResponse({"error": "Comment not found"}, status=404)
+
+
+def get_auto_reply_key(post_id):
+    return f"auto_reply:scheduled:{post_id}"
+
+
+def schedule_coalesced_auto_reply(post, comment):
+    """
+    Schedules one auto reply task for the comments of the post arriving within its `reply_delay` window.
+    The window starts with the first comment, the next comments join the already scheduled task.
+    """
+    delay = post.reply_delay * 60
+    if get_shared_cache().add(get_auto_reply_key(post.id), True, timeout=delay + 60):
+        send_auto_replies.apply_async(args=[post.id, comment.created_at.isoformat()], countdown=delay)
+
+
+def get_unanswered_comments(post, since):
+    """
+    Returns the approved comments of the post created since the given time, which have no auto reply yet.
+    The auto replies themselves and the comments of the post author are not answered.
+    """
+    return list(
+        Comment.objects.filter(
             post=post,
-            content=reply_content,
-            parent=comment,
+            created_at__gte=since,
+            is_blocked=False,
+            moderation_status=ModerationStatus.APPROVED,
         )
+        .exclude(author_id=post.author_id)
+        .exclude(replies__author_id=post.author_id)
+        .order_by("id")
+    )
+
+
+@shared_task(bind=True, max_retries=5, priority=settings.AUTO_REPLY_TASK_PRIORITY)
+def send_auto_replies(self, post_id, since):
+    """
+    Replies to all comments of the post collected within the `reply_delay` window with one generation.
+    :param post_id: int
+    :param since: str, the creation time (ISO 8601) of the first comment of the window
+    """
+    # New comments schedule the next task
+    get_shared_cache().delete(get_auto_reply_key(post_id))
+
+    post = Post.objects.filter(id=post_id).first()
+    if post is None:
+        return
+
+    comments = get_unanswered_comments(post, parse_datetime(since))
+    if not comments:
+        return
+
+    try:
+        replies = generate_relevant_replies(post, comments)
+    except AIServiceUnavailable as e:
+        raise self.retry(exc=e, countdown=settings.AI_CIRCUIT_RECOVERY_TIMEOUT)
+
+    for comment in create_auto_replies(post, replies):
         print(f"Auto reply has been created: {comment.content}")
-    except Post.DoesNotExist:
-        return JsonResponse({"error": "Post not found"}, status=404)
 
-    except Comment.DoesNotExist:
-        return JsonResponse({"error": "Comment not found"}, status=404)
+
+PENDING_MODERATION_KEY = "moderation:pending_batch_scheduled"
+
+
+def schedule_pending_moderation():
+    """
+    Schedules the batch moderation of the pending content.
+    Content created within `MODERATION_BATCH_DELAY` seconds is moderated by one task.
+    """
+    delay = settings.MODERATION_BATCH_DELAY
+    if get_shared_cache().add(PENDING_MODERATION_KEY, True, timeout=delay + 60):
+        moderate_pending_content.apply_async(countdown=delay)
+
+
+def save_moderation_verdicts(model, instances):
+    """
+    Saves the moderation verdicts of the instances, unless their text has been changed in the meantime
+    (the new version is moderated by the next batch).
+    :return: list of saved instances
+    """
+    saved = []
+    with transaction.atomic():
+        current = model.objects.select_for_update().in_bulk([instance.id for instance in instances])
+        for instance in instances:
+            current_instance = current.get(instance.id)
+            if current_instance is None or any(
+                getattr(current_instance, field) != getattr(instance, field) for field in instance.moderated_fields
+            ):
+                continue
+
+            instance.save(update_fields=["is_blocked", "block_reason", "moderation_status"])
+            saved.append(instance)
+
+    return saved
+
+
+@shared_task(priority=settings.MODERATION_TASK_PRIORITY)
+def moderate_pending_content():
+    """
+    Moderates pending posts and comments in the asynchronous moderation mode.
+    Up to `MODERATION_BATCH_SIZE` posts and comments are taken per run, their texts are checked
+    with requests of up to `MODERATION_BATCH_SIZE` texts to the AI-service (a post has two texts).
+    """
+    from posts.views.views_tools import schedule_auto_reply_if_enabled
+
+    # New pending content schedules the next batch
+    get_shared_cache().delete(PENDING_MODERATION_KEY)
+
+    batch_size = settings.MODERATION_BATCH_SIZE
+    posts = list(Post.objects.filter(moderation_status=ModerationStatus.PENDING).order_by("id")[:batch_size])
+    comments = list(
+        Comment.objects.filter(moderation_status=ModerationStatus.PENDING)
+        .select_related("post")
+        .order_by("id")[:batch_size - len(posts)]
+    )
+    if not posts and not comments:
+        return
+
+    moderate_instances(posts + comments)
+    # The content stays pending if the AI-service is not available ("queue" failure policy)
+    pending = [instance for instance in posts + comments if instance.moderation_status == ModerationStatus.PENDING]
+
+    save_moderation_verdicts(Post, [post for post in posts if post not in pending])
+    for comment in save_moderation_verdicts(Comment, [comment for comment in comments if comment not in pending]):
+        # Auto replies are created by the post author and must not be answered again
+        if comment.author_id != comment.post.author_id:
+            schedule_auto_reply_if_enabled(comment.post, comment)
+
+    if pending:
+        moderate_pending_content.apply_async(countdown=settings.AI_CIRCUIT_RECOVERY_TIMEOUT)
+    elif len(posts) + len(comments) == batch_size:
+        moderate_pending_content.delay()
@@ -1,10 +1,19 @@
 import pytest
 from django.contrib.auth.models import User
+from django.core.cache import caches
 from rest_framework.test import APIClient
 from posts.models import Post
+from users.cache import user_cache
 from rest_framework_simplejwt.tokens import AccessToken
 
 
+@pytest.fixture(autouse=True)
+def clear_caches():
+    for cache in caches.all():
+        cache.clear()
+    user_cache.clear()
+
+
 @pytest.fixture
 def api_client():
     return APIClient()
@@ -0,0 +1,58 @@
+from datetime import date
+
+import pytest
+from django.db import connection
+
+from posts.models import Comment, ModerationStatus, Post
+from posts.search import search_posts
+from posts.views.views_analytics import get_datetime_range
+
+pytestmark = [
+    pytest.mark.django_db,
+    pytest.mark.skipif(connection.vendor != "postgresql", reason="EXPLAIN output is checked for PostgreSQL"),
+]
+
+
+@pytest.fixture(autouse=True)
+def disable_seqscan():
+    # The test tables are tiny, so the sequential scan would always be cheaper
+    with connection.cursor() as cursor:
+        cursor.execute("SET enable_seqscan = off")
+    yield
+    with connection.cursor() as cursor:
+        cursor.execute("RESET enable_seqscan")
+
+
+def test_list_posts_uses_visible_posts_index():
+    queryset = Post.objects.filter(
+        is_blocked=False, moderation_status=ModerationStatus.APPROVED
+    ).order_by("-created_at", "-id")[:50]
+
+    assert "post_visible_created_idx" in queryset.explain()
+
+
+def test_list_comments_uses_visible_comments_index(post):
+    queryset = Comment.objects.filter(
+        post_id=post.id, is_blocked=False, moderation_status=ModerationStatus.APPROVED
+    ).order_by("created_at", "id")[:50]
+
+    assert "comment_visible_post_idx" in queryset.explain()
+
+
+def test_analytics_uses_created_at_index():
+    start, end = get_datetime_range(date(2024, 1, 1), date(2024, 12, 31))
+    queryset = Comment.objects.filter(created_at__gte=start, created_at__lt=end).values("is_blocked")
+
+    assert "comment_created_idx" in queryset.explain()
+
+
+def test_comments_tree_uses_path_index(post):
+    queryset = Comment.objects.filter(
+        post_id=post.id, is_blocked=False, moderation_status=ModerationStatus.APPROVED, path__startswith="0000000001"
+    ).order_by("path")
+
+    assert "comment_visible_path_idx" in queryset.explain()
+
+
+def test_search_uses_gin_index():
+    assert "post_search_idx" in search_posts(Post.objects.all(), "gardening").explain()
@@ -0,0 +1,185 @@
+import pytest
+from django.urls import reverse
+
+from posts import moderation
+from posts.ai_tools import AIServiceUnavailable
+from posts.models import Comment, ModerationStatus, Post
+from posts.tasks import moderate_pending_content
+
+
+def fake_verdict(text):
+    return ("bad" in text), ("HARM_CATEGORY_HARASSMENT" if "bad" in text else "")
+
+
+@pytest.mark.django_db
+class TestModerateInstance:
+    @pytest.fixture(autouse=True)
+    def setup(self, monkeypatch, user_with_jwt):
+        self.user, _ = user_with_jwt
+        self.checked = []
+
+        def fake_moderate(texts):
+            self.checked.append(texts)
+            return [fake_verdict(text) for text in texts]
+
+        monkeypatch.setattr(moderation, "moderate_contents_with_ai", fake_moderate)
+
+    def test_post_create_checks_fields_with_one_request(self):
+        post = Post.objects.create(author=self.user, title="Title", content="bad content")
+
+        assert self.checked == [["Title", "bad content"]]
+        assert post.is_blocked
+        assert post.block_reason == "HARM_CATEGORY_HARASSMENT"
+
+    def test_only_changed_fields_are_checked(self):
+        post = Post.objects.create(author=self.user, title="Title", content="Content")
+        post = Post.objects.get(id=post.id)
+        self.checked.clear()
+
+        post.title = "Title"
+        post.content = "New content"
+        post.save()
+        post.save()
+
+        assert self.checked == [["New content"]]
+
+    def test_unchanged_comment_is_not_checked(self):
+        post = Post.objects.create(author=self.user, title="Title", content="Content")
+        comment = Comment.objects.create(author=self.user, post=post, content="Comment")
+        self.checked.clear()
+
+        comment.save()
+        Comment.objects.get(id=comment.id).save()
+
+        assert self.checked == []
+
+    @pytest.mark.parametrize("policy, is_blocked, status", [
+        ("block", True, ModerationStatus.BLOCKED),
+        ("open", False, ModerationStatus.APPROVED),
+        ("queue", False, ModerationStatus.PENDING),
+    ])
+    def test_failure_policy(self, monkeypatch, settings, policy, is_blocked, status):
+        settings.MODERATION_FAILURE_POLICY = policy
+
+        def unavailable(texts):
+            raise AIServiceUnavailable()
+
+        monkeypatch.setattr(moderation, "moderate_contents_with_ai", unavailable)
+        post = Post.objects.create(author=self.user, title="Title", content="Content")
+
+        assert post.is_blocked == is_blocked
+        assert post.moderation_status == status
+
+
+@pytest.mark.django_db
+class TestAsyncModeration:
+    @pytest.fixture(autouse=True)
+    def setup(self, monkeypatch, settings, api_client, user_with_jwt, django_capture_on_commit_callbacks):
+        self.user, self.token = user_with_jwt
+        self.api_client = api_client
+        self.api_client.credentials(HTTP_AUTHORIZATION=f'Bearer {self.token}')
+        self.capture_on_commit = django_capture_on_commit_callbacks
+        self.scheduled = []
+        self.checked = []
+
+        def fake_moderate(texts):
+            self.checked.append(texts)
+            return [fake_verdict(text) for text in texts]
+
+        monkeypatch.setattr(moderation, "moderate_contents_with_ai", fake_moderate)
+        monkeypatch.setattr(moderate_pending_content, "apply_async", lambda **kwargs: self.scheduled.append(kwargs))
+
+        # The post is approved by the mock before the asynchronous mode is enabled
+        self.post = Post.objects.create(author=self.user, title='This is title', content='This is text')
+        self.checked.clear()
+        settings.MODERATION_ASYNC = True
+
+    def test_comment_is_pending_until_moderated(self):
+        url = reverse('api-1.0.0:create_comment', args=[self.post.id])
+        with self.capture_on_commit(execute=True):
+            response = self.api_client.post(url, {"content": "Pending comment"}, format='json')
+        comment_id = response.json()["id"]
+
+        assert response.status_code == 202
+        assert response.json()["moderation_status"] == ModerationStatus.PENDING
+        assert len(self.scheduled) == 1
+
+        list_url = reverse('api-1.0.0:list_comments', args=[self.post.id])
+        assert self.api_client.get(list_url).json() == []
+
+        moderate_pending_content()
+
+        assert Comment.objects.get(id=comment_id).moderation_status == ModerationStatus.APPROVED
+        assert len(self.api_client.get(list_url).json()) == 1
+
+    def test_revalidated_post_is_changed_by_moderation(self):
+        with self.capture_on_commit(execute=True):
+            post = Post.objects.create(author=self.user, title="Title", content="Pending post")
+        url = reverse('api-1.0.0:get_post', args=[post.id])
+        etag = self.api_client.get(url)['ETag']
+
+        moderate_pending_content()
+        response = self.api_client.get(url, HTTP_IF_NONE_MATCH=etag)
+
+        # The moderation doesn't change updated_at, but the post is not the same
+        assert response.status_code == 200
+        assert response.json()["moderation_status"] == ModerationStatus.APPROVED
+
+    def test_pending_content_is_moderated_in_one_batch(self):
+        with self.capture_on_commit(execute=True):
+            post = Post.objects.create(author=self.user, title="Title", content="bad content")
+            comments = [
+                Comment.objects.create(author=self.user, post=self.post, content=f"Comment {i}") for i in range(3)
+            ]
+        assert post.moderation_status == ModerationStatus.PENDING
+        assert len(self.scheduled) == 1
+
+        moderate_pending_content()
+        post.refresh_from_db()
+
+        assert self.checked == [["Title", "bad content", "Comment 0", "Comment 1", "Comment 2"]]
+        assert post.is_blocked
+        assert post.moderation_status == ModerationStatus.BLOCKED
+        assert post.block_reason == "HARM_CATEGORY_HARASSMENT"
+        assert all(
+            Comment.objects.get(id=comment.id).moderation_status == ModerationStatus.APPROVED for comment in comments
+        )
+
+
+@pytest.mark.django_db
+class TestAsyncViewsModeration:
+    @pytest.fixture(autouse=True)
+    def setup(self, monkeypatch, api_client, user_with_jwt):
+        self.user, self.token = user_with_jwt
+        self.api_client = api_client
+        self.api_client.credentials(HTTP_AUTHORIZATION=f'Bearer {self.token}')
+        self.checked = []
+
+        # The post and the comment of the tests are approved by the mock
+        monkeypatch.setattr(moderation, "moderate_contents_with_ai", lambda texts: [(False, "")] * len(texts))
+        post = Post.objects.create(author=self.user, title='This is title', content='This is text')
+        self.comment = Comment.objects.create(author=self.user, post=post, content="Old comment")
+
+        async def fake_amoderate(texts):
+            self.checked.append(texts)
+            return [fake_verdict(text) for text in texts]
+
+        def sync_moderate(texts):
+            raise AssertionError("The content must be checked by the async client")
+
+        monkeypatch.setattr(moderation, "amoderate_contents_with_ai", fake_amoderate)
+        monkeypatch.setattr(moderation, "moderate_contents_with_ai", sync_moderate)
+
+    def test_create_post_is_moderated_once_by_async_client(self):
+        url = reverse('api-1.0.0:create_post')
+        response = self.api_client.post(url, {"title": "Title", "content": "bad content"}, format='json')
+
+        assert response.status_code == 400
+        assert self.checked == [["Title", "bad content"]]
+
+    def test_update_comment_checks_changed_content(self):
+        url = reverse('api-1.0.0:update_comment', args=[self.comment.id])
+        response = self.api_client.put(url, {"content": "New comment"}, format='json')
+
+        assert response.status_code == 200
+        assert self.checked == [["New comment"]]
@@ -0,0 +1,71 @@
+import pytest
+from django.contrib.auth.models import User
+from django.db import connection
+
+from posts import moderation, tasks
+from posts.models import Comment
+from posts.tasks import send_auto_replies
+from posts.views.views_tools import schedule_auto_reply_if_enabled
+
+
+@pytest.mark.django_db
+class TestCoalescedAutoReplies:
+    @pytest.fixture(autouse=True)
+    def setup(self, monkeypatch, settings, post):
+        settings.AUTO_REPLY_COALESCE = True
+        self.post = post
+        self.post.auto_reply_enabled = True
+        self.post.reply_delay = 5
+        self.commenter = User.objects.create_user(username='commenter', password='testpass')
+        self.scheduled = []
+        self.generated = []
+
+        def fake_generate(post, comments):
+            self.generated.append([comment.id for comment in comments])
+            return {comment.id: f"Reply to {comment.content}" for comment in comments}
+
+        monkeypatch.setattr(moderation, "moderate_contents_with_ai", lambda texts: [(False, "")] * len(texts))
+        monkeypatch.setattr(tasks, "generate_relevant_replies", fake_generate)
+        monkeypatch.setattr(send_auto_replies, "apply_async", lambda **kwargs: self.scheduled.append(kwargs))
+
+    def create_comments(self, count):
+        return [
+            Comment.objects.create(author=self.commenter, post=self.post, content=f"Comment {i}") for i in range(count)
+        ]
+
+    def test_comments_within_window_are_scheduled_once(self):
+        comments = self.create_comments(3)
+        for comment in comments:
+            schedule_auto_reply_if_enabled(self.post, comment)
+
+        assert len(self.scheduled) == 1
+        assert self.scheduled[0]["countdown"] == 5 * 60
+        assert self.scheduled[0]["args"] == [self.post.id, comments[0].created_at.isoformat()]
+
+    def test_comments_are_answered_with_one_generation(self):
+        comments = self.create_comments(3)
+        since = comments[0].created_at.isoformat()
+
+        send_auto_replies(self.post.id, since)
+        # A retried or duplicated task doesn't reply again
+        send_auto_replies(self.post.id, since)
+
+        assert self.generated == [[comment.id for comment in comments]]
+        for comment in comments:
+            replies = Comment.objects.filter(parent=comment, author=self.post.author)
+            assert [reply.content for reply in replies] == [f"Reply to {comment.content}"]
+
+    def test_replies_are_moderated_before_comments_are_locked(self, monkeypatch):
+        comments = self.create_comments(2)
+        savepoints = len(connection.savepoint_ids)
+        checked = []
+
+        def fake_moderate(texts):
+            checked.append((texts, len(connection.savepoint_ids)))
+            return [(False, "")] * len(texts)
+
+        monkeypatch.setattr(moderation, "moderate_contents_with_ai", fake_moderate)
+        send_auto_replies(self.post.id, comments[0].created_at.isoformat())
+
+        assert checked == [([f"Reply to {comment.content}" for comment in comments], savepoints)]
+        assert Comment.objects.filter(parent__in=comments, author=self.post.author).count() == 2
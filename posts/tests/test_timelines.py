@@ -0,0 +1,171 @@
+from datetime import timedelta
+
+import pytest
+from django.contrib.auth.models import User
+from django.urls import reverse
+from django.utils import timezone
+
+from posts.models import Post
+from posts.timelines import PostTimelines, post_timelines
+
+
+class FakeRedis:
+    """In-memory subset of the Redis sorted set commands used by the timelines."""
+
+    def __init__(self):
+        self.sets = {}
+
+    @staticmethod
+    def encode(member):
+        return member if isinstance(member, bytes) else str(member).encode()
+
+    @staticmethod
+    def parse_score(value):
+        value = str(value)
+        exclusive = value.startswith("(")
+        return float(value.lstrip("(")), exclusive
+
+    def sorted_items(self, key):
+        return sorted(self.sets.get(key, {}).items(), key=lambda item: (item[1], item[0]))
+
+    def zadd(self, key, mapping):
+        self.sets.setdefault(key, {}).update({self.encode(member): float(score) for member, score in mapping.items()})
+
+    def zrem(self, key, *members):
+        for member in members:
+            self.sets.get(key, {}).pop(self.encode(member), None)
+
+    def zcard(self, key):
+        return len(self.sets.get(key, {}))
+
+    def zscore(self, key, member):
+        return self.sets.get(key, {}).get(self.encode(member))
+
+    def delete(self, key):
+        self.sets.pop(key, None)
+
+    def zremrangebyrank(self, key, start, end):
+        items = self.sorted_items(key)
+        for member, _ in items[start:len(items) + end + 1 if end < 0 else end + 1]:
+            del self.sets[key][member]
+
+    def zrevrangebyscore(self, key, max_score, min_score, start=0, num=None, withscores=False):
+        (max_value, max_exclusive), (min_value, min_exclusive) = self.parse_score(max_score), self.parse_score(min_score)
+        items = [
+            (member, score) for member, score in reversed(self.sorted_items(key))
+            if (score < max_value if max_exclusive else score <= max_value)
+            and (score > min_value if min_exclusive else score >= min_value)
+        ]
+        items = items[start:start + num if num is not None else None]
+        return items if withscores else [member for member, _ in items]
+
+    def pipeline(self):
+        return FakePipeline(self)
+
+
+class FakePipeline:
+    def __init__(self, client):
+        self.client = client
+        self.commands = []
+
+    def __getattr__(self, name):
+        return lambda *args, **kwargs: self.commands.append((name, args, kwargs))
+
+    def execute(self):
+        results = [getattr(self.client, name)(*args, **kwargs) for name, args, kwargs in self.commands]
+        self.commands = []
+        return results
+
+
+@pytest.fixture
+def timelines(monkeypatch):
+    monkeypatch.setattr(post_timelines, "_redis", FakeRedis())
+    return post_timelines
+
+
+@pytest.fixture
+def author(db):
+    return User.objects.create_user(username='author', password='testpass')
+
+
+def create_posts(author, count):
+    # Distinct creation times, oldest first
+    posts = [Post.objects.create(author=author, title='Great post', content='Thanks') for _ in range(count)]
+    for i, post in enumerate(posts):
+        post.created_at = timezone.now() - timedelta(minutes=count - i)
+        Post.objects.filter(id=post.id).update(created_at=post.created_at)
+    return posts
+
+
+@pytest.mark.django_db
+def test_page_is_read_from_built_timeline(timelines, author, django_assert_num_queries):
+    posts = create_posts(author, 3)
+
+    with django_assert_num_queries(1):
+        first_page = timelines.get_page([author.id], count=2)
+    with django_assert_num_queries(0):
+        assert timelines.get_page([author.id], count=2) == first_page
+
+    assert [post_id for _, post_id in first_page] == [posts[2].id, posts[1].id]
+    before = (posts[1].created_at, posts[1].id)
+    with django_assert_num_queries(0):
+        assert [post_id for _, post_id in timelines.get_page([author.id], before, count=2)] == [posts[0].id]
+
+
+@pytest.mark.django_db
+def test_timeline_is_updated_by_signals(timelines, author, django_capture_on_commit_callbacks):
+    posts = create_posts(author, 2)
+    timelines.get_page([author.id])
+
+    with django_capture_on_commit_callbacks(execute=True):
+        new_post = Post.objects.create(author=author, title='Great post', content='Thanks')
+        posts[0].is_blocked = True
+        posts[0].save()
+
+    assert [post_id for _, post_id in timelines.get_page([author.id])] == [new_post.id, posts[1].id]
+
+    with django_capture_on_commit_callbacks(execute=True):
+        new_post.delete()
+
+    assert [post_id for _, post_id in timelines.get_page([author.id])] == [posts[1].id]
+
+
+@pytest.mark.django_db
+def test_post_added_before_build_is_kept(timelines, author):
+    posts = create_posts(author, 1)
+    # The post committed while the timeline was built from the database
+    timelines.update(author.id, posts[0].id + 1, timezone.now())
+
+    assert [post_id for _, post_id in timelines.get_page([author.id])] == [posts[0].id + 1, posts[0].id]
+
+
+@pytest.mark.django_db
+def test_older_pages_of_trimmed_timeline_are_read_from_db(author, django_assert_num_queries):
+    timelines = PostTimelines(max_length=2, client=FakeRedis())
+    posts = create_posts(author, 3)
+    timelines.get_page([author.id])
+
+    before = (posts[1].created_at, posts[1].id)
+    with django_assert_num_queries(1):
+        assert [post_id for _, post_id in timelines.get_page([author.id], before)] == [posts[0].id]
+
+    # Removing a post from the full timeline drops it, the next read builds it again
+    timelines.update(author.id, posts[2].id)
+    assert timelines.get_page([author.id]) == timelines.get_page_from_db([author.id], None, 50)
+
+
+@pytest.mark.django_db
+def test_feed_from_timelines(timelines, api_client, author):
+    other = User.objects.create_user(username='other', password='testpass')
+    posts = create_posts(author, 2) + create_posts(other, 2)
+    url = reverse('api-1.0.0:feed')
+
+    response = api_client.get(url, {'authors': f'{author.id},{other.id}', 'limit': 3})
+    first_page = [post['id'] for post in response.json()]
+    response = api_client.get(url, {'authors': f'{author.id},{other.id}', 'limit': 3,
+                                    'cursor': response['X-Next-Cursor']})
+
+    # The posts of both authors are merged by the creation time
+    assert first_page + [post['id'] for post in response.json()] == [
+        posts[3].id, posts[1].id, posts[2].id, posts[0].id
+    ]
@@ -1,9 +1,13 @@
-from datetime import datetime
+from datetime import date, datetime
 import json
 import pytest
+from asgiref.sync import async_to_sync
+from django.core.management import call_command
 from django.utils import timezone
-from posts.models import Comment
+from posts.models import Comment, CommentDailyStats
+from posts.moderation_cache import moderation_cache
 from posts.views.views_analytics import validate_dates, get_date_range, get_comments_data, build_analytics_dict
+from rest_framework_simplejwt.tokens import AccessToken
 
 
 class TestValidateDates:
@@ -105,6 +109,53 @@ class TestGetCommentsData:
                 assert entry["blocked_comments"] == 0
 
 
+@pytest.mark.django_db
+class TestCommentDailyStats:
+    @pytest.fixture(autouse=True)
+    def setup(self, user_with_jwt, post):
+        self.user, self.token = user_with_jwt
+        self.post = post
+
+    def get_stats(self):
+        return {
+            stats.date: (stats.total_comments, stats.blocked_comments)
+            for stats in CommentDailyStats.objects.exclude(total_comments=0)
+        }
+
+    def create_comment(self, day, **kwargs):
+        comment = Comment.objects.create(author=self.user, post=self.post, content="Great post", **kwargs)
+        comment.created_at = timezone.make_aware(datetime(2024, 1, day))
+        comment.save()
+        return comment
+
+    def test_stats_follow_comment_changes(self):
+        comment = self.create_comment(1)
+        self.create_comment(1, is_blocked=True)
+        assert self.get_stats() == {date(2024, 1, 1): (2, 1)}
+
+        comment.is_blocked = True
+        comment.save()
+        assert self.get_stats() == {date(2024, 1, 1): (2, 2)}
+
+        comment = Comment.objects.get(pk=comment.pk)
+        comment.created_at = timezone.make_aware(datetime(2024, 1, 2))
+        comment.save()
+        assert self.get_stats() == {date(2024, 1, 1): (1, 1), date(2024, 1, 2): (1, 1)}
+
+        comment.delete()
+        assert self.get_stats() == {date(2024, 1, 1): (1, 1)}
+
+    def test_rebuild_comment_stats(self):
+        self.create_comment(1)
+        self.create_comment(2, is_blocked=True)
+        CommentDailyStats.objects.all().delete()
+        CommentDailyStats.objects.create(date=date(2024, 1, 5), total_comments=10)
+
+        call_command("rebuild_comment_stats", "--date-from=2024-01-02", "--date-to=2024-01-05")
+
+        assert self.get_stats() == {date(2024, 1, 2): (1, 1)}
+
+
 class TestBuildAnalyticsDict:
 
     def test_build_analytics_dict(self):
@@ -140,3 +191,102 @@ class TestCommentsDailyBreakdown:
         response = client.get(url)
         assert response.status_code == 400
         assert "date_from must be earlier than date_to" in response.json()["error"]
+
+    def test_comments_daily_breakdown_is_cached(self, client, django_assert_num_queries, user_with_jwt, post):
+        user, _ = user_with_jwt
+        comment = Comment.objects.create(author=user, post=post, content="Great post")
+        comment.created_at = timezone.make_aware(datetime(2024, 10, 2))
+        comment.save()
+        url = "/api/posts/analytics/comments-daily-breakdown?date_from=2024-10-01&date_to=2024-10-03"
+
+        assert client.get(url).json()["2024-10-02"] == {"total_comments": 1, "blocked_comments": 0}
+        with django_assert_num_queries(0):
+            assert client.get(url).json()["2024-10-02"] == {"total_comments": 1, "blocked_comments": 0}
+
+        # Blocking the comment invalidates only its day
+        comment.is_blocked = True
+        comment.save()
+        with django_assert_num_queries(1):
+            assert client.get(url).json()["2024-10-02"] == {"total_comments": 1, "blocked_comments": 1}
+
+    def test_past_days_expire_without_shared_cache(self, client, django_assert_num_queries, settings):
+        # The other workers don't see the invalidation of the per-process cache
+        settings.ANALYTICS_CACHE_TTL = 0
+        url = "/api/posts/analytics/comments-daily-breakdown?date_from=2024-10-01&date_to=2024-10-03"
+
+        client.get(url)
+        with django_assert_num_queries(1):
+            client.get(url)
+
+
+@pytest.mark.django_db
+class TestCommentsBreakdown:
+    url = "/api/posts/analytics/comments-breakdown?date_from=2024-01-01&date_to=2024-01-14"
+
+    @pytest.fixture(autouse=True)
+    def setup(self, user_with_jwt, post):
+        self.user, self.token = user_with_jwt
+        self.post = post
+        for day, hour, is_blocked in [(1, 10, False), (1, 10, True), (1, 11, False), (9, 12, False)]:
+            comment = Comment.objects.create(author=self.user, post=post, content="Great post", is_blocked=is_blocked)
+            comment.created_at = timezone.make_aware(datetime(2024, 1, day, hour))
+            comment.save()
+
+    def get_counts(self, rows):
+        return [(row["total_comments"], row["blocked_comments"]) for row in rows]
+
+    def test_granularity(self, client):
+        assert self.get_counts(client.get(self.url + "&granularity=hour").json()) == [(2, 1), (1, 0), (1, 0)]
+        assert self.get_counts(client.get(self.url).json()) == [(3, 1), (1, 0)]
+        assert self.get_counts(client.get(self.url + "&granularity=week").json()) == [(3, 1), (1, 0)]
+
+    def test_group_by(self, client):
+        rows = client.get(self.url + "&granularity=week&group_by=author").json()
+
+        assert rows[0]["author__username"] == self.user.username
+        assert self.get_counts(rows) == [(3, 1), (1, 0)]
+
+    def test_ndjson_stream(self, client):
+        response = client.get(self.url + "&group_by=post&format=ndjson")
+        rows = [json.loads(line) for line in b"".join(response.streaming_content).splitlines()]
+
+        assert response["Content-Type"] == "application/x-ndjson"
+        assert [row["post_id"] for row in rows] == [self.post.id, self.post.id]
+        assert self.get_counts(rows) == [(3, 1), (1, 0)]
+
+    def test_ndjson_stream_under_asgi(self, async_client):
+        async def get_rows():
+            response = await async_client.get(self.url + "&format=ndjson")
+            # An asynchronous iterator is streamed by an ASGI server without buffering
+            assert response.is_async
+            return [json.loads(line) async for line in response.streaming_content]
+
+        assert self.get_counts(async_to_sync(get_rows)()) == [(3, 1), (1, 0)]
+
+    def test_invalid_params(self, client):
+        assert client.get(self.url + "&granularity=month").status_code == 400
+        assert client.get(self.url + "&group_by=title").status_code == 400
+
+
+@pytest.mark.django_db
+class TestCacheStats:
+    url = "/api/posts/analytics/cache-stats"
+
+    def test_cache_stats(self, client, admin_user):
+        moderation_cache.clear()
+        moderation_cache.set("Great post", (False, ""))
+        moderation_cache.get("Great post")
+        moderation_cache.get("Another post")
+
+        response = client.get(self.url, HTTP_AUTHORIZATION=f"Bearer {AccessToken.for_user(admin_user)}")
+        stats = response.json()["moderation_cache"]
+
+        assert response.status_code == 200
+        assert (stats["hits"], stats["misses"], stats["hit_ratio"]) == (1, 1, 0.5)
+        # The admin has been looked up once by the request
+        assert response.json()["user_cache"]["misses"] == 1
+
+    def test_cache_stats_requires_admin(self, client, user_with_jwt):
+        _, token = user_with_jwt
+
+        assert client.get(self.url, HTTP_AUTHORIZATION=f"Bearer {token}").status_code == 403
@@ -1,9 +1,19 @@
+import csv
+import io
+import json
 import random
 import time
 import pytest
+from django.contrib.auth.models import User
+from django.core.management import call_command
 from django.urls import reverse
-from posts.models import Comment
+from posts import moderation
+from posts.ai_tools import AIServiceUnavailable
+from posts.models import Comment, ModerationStatus
+from posts.tasks import moderate_pending_content
 from posts.tests.tools import safety_categories, storage, pause
+from rest_framework_simplejwt.tokens import AccessToken
+from users.tokens import get_tokens_for_user
 
 
 class TestCommentAPI:
@@ -162,3 +172,254 @@ class TestCommentAPI:
         assert response.status_code == 400
         assert any(reason in data['detail'] for reason in self.safety_categories), \
             f"Expected one of {self.safety_categories}, but got {data['detail']}"
+
+
+@pytest.mark.django_db
+def test_list_comments_query_count(api_client, post, django_assert_num_queries):
+    for i in range(5):
+        author = User.objects.create_user(username=f'author_{i}', password='testpass')
+        Comment.objects.create(author=author, post=post, content='Great post, thanks')  # No AI requests
+
+    url = reverse('api-1.0.0:list_comments', args=[post.id])
+    with django_assert_num_queries(1):
+        response = api_client.get(url)
+
+    assert response.status_code == 200
+    assert {comment['author'] for comment in response.json()} == {f'author_{i}' for i in range(5)}
+
+
+@pytest.mark.django_db
+def test_list_comments_conditional_request(api_client, user_with_jwt, post, django_assert_num_queries):
+    user, _ = user_with_jwt
+    comments = [Comment.objects.create(author=user, post=post, content='Great post, thanks') for _ in range(2)]
+    url = reverse('api-1.0.0:list_comments', args=[post.id])
+
+    response = api_client.get(url, {'limit': 2})
+    etag = response['ETag']
+    assert response.has_header('Last-Modified')
+
+    # The revalidation is answered by the precheck query
+    with django_assert_num_queries(1):
+        response = api_client.get(url, {'limit': 2}, HTTP_IF_NONE_MATCH=etag)
+    assert response.status_code == 304
+
+    # A new comment adds the next page, an edited comment changes the page
+    Comment.objects.create(author=user, post=post, content='Great post, thanks')
+    response = api_client.get(url, {'limit': 2}, HTTP_IF_NONE_MATCH=etag)
+    assert response.status_code == 200
+    assert 'X-Next-Cursor' in response
+    etag = response['ETag']
+
+    comments[0].content = 'Thanks'
+    comments[0].save()
+    response = api_client.get(url, {'limit': 2}, HTTP_IF_NONE_MATCH=etag)
+    assert response.status_code == 200
+    assert response.json()[0]['content'] == 'Thanks'
+
+
+@pytest.mark.django_db
+def test_list_comments_cursor_pagination(api_client, user_with_jwt, post):
+    user, _ = user_with_jwt
+    comments = [Comment.objects.create(author=user, post=post, content='Thanks') for _ in range(3)]
+    url = reverse('api-1.0.0:list_comments', args=[post.id])
+
+    response = api_client.get(url, {'limit': 2})
+    first_page = [comment['id'] for comment in response.json()]
+
+    response = api_client.get(url, {'limit': 2, 'cursor': response['X-Next-Cursor']})
+    second_page = [comment['id'] for comment in response.json()]
+
+    # Oldest first
+    assert first_page + second_page == [comment.id for comment in comments]
+    assert 'X-Next-Cursor' not in response
+
+
+@pytest.mark.django_db
+class TestExportComments:
+    @pytest.fixture(autouse=True)
+    def setup(self, api_client, user_with_jwt, admin_user, post):
+        self.api_client = api_client
+        self.user, self.token = user_with_jwt
+        self.comments = [
+            Comment.objects.create(author=self.user, post=post, content='Great post,\nthanks'),
+            Comment.objects.create(author=self.user, post=post, content='Thanks', is_blocked=True),
+        ]
+        self.api_client.credentials(HTTP_AUTHORIZATION=f'Bearer {AccessToken.for_user(admin_user)}')
+        self.url = reverse('api-1.0.0:export_comments')
+
+    def test_export_csv(self):
+        response = self.api_client.get(self.url)
+        rows = list(csv.DictReader(io.StringIO(b''.join(response.streaming_content).decode())))
+
+        assert response.status_code == 200
+        assert [int(row['id']) for row in rows] == [comment.id for comment in self.comments]
+        assert rows[0]['content'] == 'Great post,\nthanks'
+        assert rows[1]['is_blocked'] == 'True'
+
+    def test_export_ndjson_filters(self):
+        response = self.api_client.get(self.url, {'format': 'ndjson', 'is_blocked': True, 'date_from': '2024-01-01'})
+        rows = [json.loads(line) for line in b''.join(response.streaming_content).splitlines()]
+
+        assert [row['id'] for row in rows] == [self.comments[1].id]
+        assert rows[0]['author__username'] == self.user.username
+
+    def test_export_requires_admin(self):
+        self.api_client.credentials(HTTP_AUTHORIZATION=f'Bearer {self.token}')
+
+        assert self.api_client.get(self.url).status_code == 403
+
+    def test_demoted_admin_with_stateless_token_cannot_export(self, admin_user):
+        token = get_tokens_for_user(admin_user, embed_claims=True)['access']
+        User.objects.filter(id=admin_user.id).update(is_staff=False)
+        self.api_client.credentials(HTTP_AUTHORIZATION=f'Bearer {token}')
+
+        assert self.api_client.get(self.url).status_code == 403
+
+    def test_export_command(self, tmp_path):
+        output = tmp_path / 'comments.ndjson'
+        call_command('export_comments', '--format=ndjson', '--not-blocked', f'--output={output}')
+
+        rows = [json.loads(line) for line in output.read_text().splitlines()]
+        assert [row['id'] for row in rows] == [self.comments[0].id]
+
+
+@pytest.mark.django_db
+class TestBulkCreateComments:
+    @pytest.fixture(autouse=True)
+    def setup(self, monkeypatch, api_client, user_with_jwt, admin_user, post):
+        self.api_client = api_client
+        self.user, self.token = user_with_jwt
+        self.post = post
+        self.checked = []
+
+        def fake_moderate(texts):
+            self.checked.append(texts)
+            return [(("bad" in text), "HARM_CATEGORY_HARASSMENT" if "bad" in text else "") for text in texts]
+
+        monkeypatch.setattr(moderation, "moderate_contents_with_ai", fake_moderate)
+        self.api_client.credentials(HTTP_AUTHORIZATION=f'Bearer {AccessToken.for_user(admin_user)}')
+        self.url = reverse('api-1.0.0:bulk_create_comments')
+
+    def test_bulk_create(self, monkeypatch, settings, django_capture_on_commit_callbacks):
+        settings.MODERATION_BATCH_SIZE = 2
+        scheduled = []
+        monkeypatch.setattr(moderate_pending_content, "apply_async", lambda *args, **kwargs: scheduled.append(kwargs))
+        parent = Comment.objects.create(author=self.user, post=self.post, content='Parent')
+        self.checked.clear()
+        payload = [
+            {"post_id": self.post.id, "content": "First"},
+            {"post_id": self.post.id, "content": "Reply", "parent_id": parent.id, "author_id": self.user.id},
+            {"post_id": self.post.id, "content": "bad comment"},
+            {"post_id": self.post.id + 1, "content": "Unknown post"},
+            {"post_id": self.post.id, "content": "Unknown parent", "parent_id": parent.id + 100},
+        ]
+
+        with django_capture_on_commit_callbacks(execute=True):
+            response = self.api_client.post(self.url, payload, format='json')
+        data = response.json()
+
+        # The comments are not moderated by the request
+        assert response.status_code == 201
+        assert (data['created'], data['blocked'], data['pending']) == (3, 0, 3)
+        assert [error['index'] for error in data['errors']] == [3, 4]
+        assert self.checked == []
+        assert Comment.objects.get(content="Reply").parent_id == parent.id
+        assert len(scheduled) == 1
+
+        # Two batches of MODERATION_BATCH_SIZE comments
+        moderate_pending_content()
+        moderate_pending_content()
+
+        assert self.checked == [["First", "Reply"], ["bad comment"]]
+        assert Comment.objects.get(content="bad comment").is_blocked
+
+    def test_bulk_create_requires_admin(self):
+        self.api_client.credentials(HTTP_AUTHORIZATION=f'Bearer {self.token}')
+        response = self.api_client.post(self.url, [{"post_id": self.post.id, "content": "First"}], format='json')
+
+        assert response.status_code == 403
+
+    def test_import_command(self, tmp_path):
+        source = tmp_path / 'comments.ndjson'
+        source.write_text("\n".join(
+            json.dumps({"post_id": self.post.id, "content": f"Comment {i}"}) for i in range(3)
+        ))
+
+        call_command('import_comments', '--format=ndjson', f'--input={source}', f'--author-id={self.user.id}')
+
+        assert Comment.objects.filter(
+            post=self.post, author=self.user, moderation_status=ModerationStatus.APPROVED
+        ).count() == 3
+        assert self.checked == [[f"Comment {i}" for i in range(3)]]
+
+    def test_import_command_queues_comments_while_ai_is_unavailable(self, monkeypatch, settings, tmp_path,
+                                                                     django_capture_on_commit_callbacks):
+        settings.MODERATION_FAILURE_POLICY = "queue"
+        scheduled = []
+        monkeypatch.setattr(moderate_pending_content, "apply_async", lambda *args, **kwargs: scheduled.append(kwargs))
+
+        def unavailable(texts):
+            raise AIServiceUnavailable()
+
+        monkeypatch.setattr(moderation, "moderate_contents_with_ai", unavailable)
+        source = tmp_path / 'comments.ndjson'
+        source.write_text(json.dumps({"post_id": self.post.id, "content": "Comment"}))
+        output = io.StringIO()
+
+        with django_capture_on_commit_callbacks(execute=True):
+            call_command('import_comments', '--format=ndjson', f'--input={source}', f'--author-id={self.user.id}',
+                         stdout=output)
+
+        assert Comment.objects.get(content="Comment").moderation_status == ModerationStatus.PENDING
+        assert len(scheduled) == 1
+        assert "1 pending moderation" in output.getvalue()
+
+
+@pytest.mark.django_db
+class TestCommentsTree:
+    @pytest.fixture(autouse=True)
+    def setup(self, monkeypatch, api_client, user_with_jwt, post):
+        monkeypatch.setattr(moderation, "moderate_contents_with_ai", lambda texts: [(False, "")] * len(texts))
+        self.api_client = api_client
+        self.user, _ = user_with_jwt
+        self.post = post
+        self.first = Comment.objects.create(author=self.user, post=post, content='First')
+        self.reply = Comment.objects.create(author=self.user, post=post, content='Reply', parent=self.first)
+        self.nested_reply = Comment.objects.create(author=self.user, post=post, content='Nested', parent=self.reply)
+        self.second = Comment.objects.create(author=self.user, post=post, content='Second')
+        self.url = reverse('api-1.0.0:comments_tree', args=[post.id])
+
+    @staticmethod
+    def get_ids(nodes):
+        return [(node['id'], TestCommentsTree.get_ids(node['replies'])) for node in nodes]
+
+    def test_tree(self, django_assert_num_queries):
+        with django_assert_num_queries(1):
+            response = self.api_client.get(self.url)
+
+        assert response.status_code == 200
+        assert self.get_ids(response.json()) == [
+            (self.first.id, [(self.reply.id, [(self.nested_reply.id, [])])]),
+            (self.second.id, []),
+        ]
+
+    def test_subtree_with_depth(self):
+        response = self.api_client.get(self.url, {'root_id': self.first.id, 'depth': 1})
+
+        assert self.get_ids(response.json()) == [(self.first.id, [(self.reply.id, [])])]
+
+    def test_tree_with_depth(self):
+        response = self.api_client.get(self.url, {'depth': 1})
+
+        assert self.get_ids(response.json()) == [(self.first.id, [(self.reply.id, [])]), (self.second.id, [])]
+
+    def test_moved_comment_path(self):
+        self.reply.parent = self.second
+        self.reply.save()
+        self.nested_reply.refresh_from_db()
+
+        assert self.nested_reply.path.startswith(self.second.path)
+        assert self.get_ids(self.api_client.get(self.url).json()) == [
+            (self.first.id, []),
+            (self.second.id, [(self.reply.id, [(self.nested_reply.id, [])])]),
+        ]
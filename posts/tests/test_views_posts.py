@@ -2,8 +2,11 @@ import time
 import random
 
 import pytest
+from django.contrib.auth.models import User
+from django.core.management import call_command
 from django.urls import reverse
-from posts.models import Post
+from django.utils.http import http_date
+from posts.models import Comment, Post
 from posts.tests.tools import safety_categories, storage, pause
 
 
@@ -162,3 +165,140 @@ class TestPostsAPI:
         # Assertions
         assert response.status_code == 403
         assert data['detail'] == "You are not allowed to edit this post."
+
+
+@pytest.mark.django_db
+def test_list_posts_query_count(api_client, django_assert_num_queries):
+    for i in range(5):
+        author = User.objects.create_user(username=f'author_{i}', password='testpass')
+        Post.objects.create(author=author, title='Great post', content='Thanks')  # No AI requests
+
+    url = reverse('api-1.0.0:list_posts')
+    with django_assert_num_queries(1):
+        response = api_client.get(url)
+
+    assert response.status_code == 200
+    assert {post['author'] for post in response.json()} == {f'author_{i}' for i in range(5)}
+
+
+@pytest.mark.django_db
+def test_get_post_conditional_request(api_client, user_with_jwt, post, django_assert_num_queries):
+    user, _ = user_with_jwt
+    url = reverse('api-1.0.0:get_post', args=[post.id])
+
+    response = api_client.get(url)
+    etag = response['ETag']
+    # The counters and the verdict aren't timestamped, so the post has no Last-Modified time
+    assert not response.has_header('Last-Modified')
+
+    with django_assert_num_queries(1):
+        response = api_client.get(url, HTTP_IF_NONE_MATCH=etag)
+    assert response.status_code == 304
+
+    # The comment counters are a part of the version
+    Comment.objects.create(author=user, post=post, content='Great post, thanks')
+    response = api_client.get(url, HTTP_IF_NONE_MATCH=etag)
+    assert response.status_code == 200
+    assert response.json()['comment_count'] == 1
+    assert response['ETag'] != etag
+
+    # A client with only the time of its copy gets the new counters
+    response = api_client.get(url, HTTP_IF_MODIFIED_SINCE=http_date(time.time() + 60))
+    assert response.status_code == 200
+    assert response.json()['comment_count'] == 1
+
+
+@pytest.mark.django_db
+def test_list_posts_cursor_pagination(api_client, user_with_jwt):
+    user, _ = user_with_jwt
+    posts = [Post.objects.create(author=user, title='Great post', content='Thanks') for _ in range(3)]
+    url = reverse('api-1.0.0:list_posts')
+
+    response = api_client.get(url, {'limit': 2})
+    first_page = [post['id'] for post in response.json()]
+    cursor = response['X-Next-Cursor']
+
+    response = api_client.get(url, {'limit': 2, 'cursor': cursor})
+    second_page = [post['id'] for post in response.json()]
+
+    # Newest first
+    assert first_page + second_page == [post.id for post in reversed(posts)]
+    assert 'X-Next-Cursor' not in response
+
+    response = api_client.get(url, {'cursor': 'invalid'})
+    assert response.status_code == 400
+
+
+@pytest.mark.django_db
+def test_post_comment_counters(user_with_jwt, post):
+    user, _ = user_with_jwt
+    comments = [Comment.objects.create(author=user, post=post, content='Great post, thanks') for _ in range(3)]
+
+    comments[0].is_blocked = True
+    comments[0].save()
+    comments[2].delete()
+    # Saving the loaded post doesn't overwrite the counters
+    post.title = 'New title'
+    post.save()
+    post.refresh_from_db()
+
+    assert (post.comment_count, post.blocked_comment_count) == (2, 1)
+    assert post.last_comment_at == comments[1].created_at
+
+    Post.objects.filter(id=post.id).update(comment_count=0, blocked_comment_count=0, last_comment_at=None)
+    call_command('reconcile_post_counters')
+    post.refresh_from_db()
+
+    assert (post.comment_count, post.blocked_comment_count) == (2, 1)
+    assert post.last_comment_at == comments[1].created_at
+
+
+@pytest.mark.django_db
+def test_list_posts_sorted_by_activity(api_client, user_with_jwt):
+    user, _ = user_with_jwt
+    posts = [Post.objects.create(author=user, title='Great post', content='Thanks') for _ in range(3)]
+    Comment.objects.create(author=user, post=posts[0], content='Great post, thanks')
+    Comment.objects.create(author=user, post=posts[1], content='Great post, thanks')
+    Comment.objects.create(author=user, post=posts[0], content='Great post, thanks')
+
+    response = api_client.get(reverse('api-1.0.0:list_posts'), {'sort': 'activity'})
+
+    assert [post['id'] for post in response.json()] == [posts[0].id, posts[1].id]
+    assert response.json()[0]['comment_count'] == 2
+
+
+@pytest.mark.django_db
+def test_feed(api_client, user_with_jwt):
+    user, token = user_with_jwt
+    author = User.objects.create_user(username='author', password='testpass')
+    other = User.objects.create_user(username='other', password='testpass')
+    posts = [Post.objects.create(author=post_author, title='Great post', content='Thanks')
+             for post_author in (user, author, other, author, user)]
+    Post.objects.create(author=author, title='Great post', content='Thanks', is_blocked=True)
+    comments = [Comment.objects.create(author=other, post=posts[4], content='Great post, thanks') for _ in range(4)]
+    url = reverse('api-1.0.0:feed')
+
+    response = api_client.get(url, {'authors': f'{user.id},{author.id}', 'limit': 2})
+    first_page = response.json()
+    response = api_client.get(url, {'authors': f'{user.id},{author.id}', 'limit': 2,
+                                    'cursor': response['X-Next-Cursor']})
+    second_page = response.json()
+
+    # Newest first, the posts of the other authors and the blocked posts are skipped
+    assert [post['id'] for post in first_page + second_page] == [posts[4].id, posts[3].id, posts[1].id, posts[0].id]
+    assert 'X-Next-Cursor' not in response
+    assert [comment['id'] for comment in first_page[0]['latest_comments']] == [comment.id for comment in comments[:0:-1]]
+    assert first_page[1]['latest_comments'] == []
+
+    # The posts of the current user by default
+    api_client.credentials(HTTP_AUTHORIZATION=f'Bearer {token}')
+    response = api_client.get(url)
+    assert [post['id'] for post in response.json()] == [posts[4].id, posts[0].id]
+
+
+@pytest.mark.django_db
+def test_feed_invalid_request(api_client):
+    url = reverse('api-1.0.0:feed')
+
+    assert api_client.get(url).status_code == 401
+    assert api_client.get(url, {'authors': '1,abc'}).status_code == 400
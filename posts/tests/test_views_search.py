@@ -0,0 +1,40 @@
+import pytest
+from django.urls import reverse
+
+from posts import moderation
+from posts.models import Comment, Post
+
+
+@pytest.mark.django_db
+class TestSearchAPI:
+    @pytest.fixture(autouse=True)
+    def setup(self, monkeypatch, api_client, user_with_jwt):
+        monkeypatch.setattr(moderation, "moderate_contents_with_ai", lambda texts: [(False, "")] * len(texts))
+        self.api_client = api_client
+        self.user, _ = user_with_jwt
+
+    def test_search_posts(self):
+        in_content = Post.objects.create(author=self.user, title='Weekend', content='Notes about gardening tools')
+        in_title = Post.objects.create(author=self.user, title='Gardening tips', content='Water the plants')
+        Post.objects.create(author=self.user, title='Blocked gardening', content='Spam', is_blocked=True)
+        Post.objects.create(author=self.user, title='Cooking', content='Pasta recipes')
+
+        response = self.api_client.get(reverse('api-1.0.0:search_posts_view'), {'q': 'gardening'})
+
+        assert response.status_code == 200
+        # Matches in the title are ranked higher
+        assert [post['id'] for post in response.json()] == [in_title.id, in_content.id]
+
+    def test_search_comments_pagination(self, post):
+        comments = [
+            Comment.objects.create(author=self.user, post=post, content=f'Thanks for the moderation tips {i}')
+            for i in range(3)
+        ]
+        Comment.objects.create(author=self.user, post=post, content='Unrelated')
+        url = reverse('api-1.0.0:search_comments_view')
+
+        first_page = self.api_client.get(url, {'q': 'moderation', 'limit': 2}).json()
+        second_page = self.api_client.get(url, {'q': 'moderation', 'limit': 2, 'offset': 2}).json()
+
+        assert sorted(comment['id'] for comment in first_page + second_page) == [comment.id for comment in comments]
+        assert self.api_client.get(url, {'q': 'moderation', 'offset': -1}).status_code == 400
@@ -0,0 +1,104 @@
+from django.db.models import Value
+from django.db.models.functions import Concat, Length, Substr
+
+from posts.models import PATH_SEGMENT_LENGTH, Comment
+
+
+def get_path_segment(comment_id):
+    return str(comment_id).zfill(PATH_SEGMENT_LENGTH)
+
+
+def get_depth(path):
+    """
+    Returns the depth of the comment in the tree, 0 for the top-level comments.
+    """
+    return len(path) // PATH_SEGMENT_LENGTH - 1
+
+
+def set_comment_path(comment):
+    """
+    Sets the materialized path of the saved comment. The path is built from the parent path by the database,
+    so it takes one query and the parent doesn't have to be loaded.
+    :param comment: saved Comment instance
+    """
+    segment = get_path_segment(comment.pk)
+    if comment.parent_id:
+        parent_path = Comment.objects.filter(pk=comment.parent_id).values("path")
+        Comment.objects.filter(pk=comment.pk).update(path=Concat(parent_path, Value(segment)))
+        comment.path = Comment.objects.filter(pk=comment.pk).values_list("path", flat=True).get()
+    else:
+        Comment.objects.filter(pk=comment.pk).update(path=segment)
+        comment.path = segment
+    comment._path_parent_id = comment.parent_id
+
+
+def move_comment_subtree(comment):
+    """
+    Rebuilds the paths of the comment and its replies after the comment has been moved to another parent.
+    :param comment: saved Comment instance
+    """
+    old_path = Comment.objects.filter(pk=comment.pk).values_list("path", flat=True).get()
+    set_comment_path(comment)
+    Comment.objects.filter(post_id=comment.post_id, path__startswith=old_path).exclude(pk=comment.pk).update(
+        path=Concat(Value(comment.path), Substr("path", len(old_path) + 1))
+    )
+
+
+def set_comment_paths(comments):
+    """
+    Sets the paths of the comments created with bulk_create(), which bypasses the signals.
+    The parents must have been saved before, with their paths loaded.
+    :param comments: list of saved Comment instances
+    """
+    for comment in comments:
+        parent_path = comment.parent.path if comment.parent_id else ""
+        comment.path = parent_path + get_path_segment(comment.pk)
+        comment._path_parent_id = comment.parent_id
+    Comment.objects.bulk_update(comments, ["path"], batch_size=1000)
+
+
+def get_thread_queryset(queryset, root=None, depth=None):
+    """
+    Returns the comments of the tree in the thread (depth-first) order, read by one ordered index scan.
+    :param queryset: QuerySet of the comments of one post
+    :param root: Comment instance, the root of the subtree, all threads if None
+    :param depth: int, the maximum depth of the replies below the root (or the top-level comments), unlimited if None
+    :return: QuerySet
+    """
+    root_depth = 0
+    if root is not None:
+        queryset = queryset.filter(path__startswith=root.path)
+        root_depth = get_depth(root.path)
+
+    if depth is not None:
+        # The path of a comment at the depth N is N + 1 segments long
+        max_length = (root_depth + depth + 1) * PATH_SEGMENT_LENGTH
+        queryset = queryset.alias(path_length=Length("path")).filter(path_length__lte=max_length)
+
+    return queryset.order_by("path")
+
+
+def build_comment_tree(comments, serialize, top_depth=0):
+    """
+    Nests the comments ordered by the path into threads.
+    The replies whose parent is not in the list (e.g. blocked) are skipped with their replies.
+    :param comments: iterable of Comment instances in the thread order
+    :param serialize: function, which converts a comment to a dict
+    :param top_depth: int, the depth of the returned top-level comments
+    :return: list of dicts with the nested `replies`
+    """
+    roots = []
+    nodes = {}
+    for comment in comments:
+        if get_depth(comment.path) == top_depth:
+            siblings = roots
+        elif comment.parent_id in nodes:
+            siblings = nodes[comment.parent_id]["replies"]
+        else:
+            continue
+
+        node = dict(serialize(comment), replies=[])
+        siblings.append(node)
+        nodes[comment.id] = node
+
+    return roots
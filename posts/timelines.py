@@ -0,0 +1,154 @@
+import heapq
+
+import redis
+from django.conf import settings
+from django.db.models import Q
+
+from posts.cache_tools import get_shared_redis
+from posts.models import ModerationStatus, Post
+
+# Member with the lowest score, which marks a timeline built from the database
+BUILT_MARKER = b"built"
+
+
+class PostTimelines:
+    """
+    Per-author timelines of the visible post IDs, used by the feed.
+
+    If Redis is configured (`REDIS_CACHE_URL`), each timeline is a sorted set of the latest `max_length`
+    post IDs scored by the creation time, so a feed page costs O(page) per author. The timelines are
+    updated on post save and delete (see posts/signals.py) and built from the database on the first read.
+    Without Redis, or for the pages older than the kept timelines, the posts are read from the database
+    by one query.
+    """
+    key_prefix = "timeline:"
+
+    def __init__(self, max_length, client=None):
+        self.max_length = max_length
+        self._redis = client
+
+    def get_key(self, author_id):
+        return f"{self.key_prefix}{author_id}"
+
+    @property
+    def enabled(self):
+        return self._redis is not None
+
+    def update(self, author_id, post_id, created_at=None):
+        """
+        Adds the visible post to the timeline of its author or removes the hidden or deleted post from it.
+        :param author_id: int
+        :param post_id: int
+        :param created_at: datetime of the visible post, None to remove the post
+        """
+        if self._redis is None:
+            return
+
+        key = self.get_key(author_id)
+        try:
+            if created_at is None:
+                # A full timeline may have been trimmed, so it is rebuilt by the next read instead of being
+                # left shorter than max_length, which would mean there are no older posts
+                if self._redis.zcard(key) > self.max_length:
+                    self._redis.delete(key)
+                else:
+                    self._redis.zrem(key, post_id)
+            else:
+                # The post is added even if the timeline is not built yet, so that a build reading
+                # the database before the post has been committed doesn't miss it
+                pipeline = self._redis.pipeline()
+                pipeline.zadd(key, {post_id: created_at.timestamp()})
+                # The marker has the lowest rank, it is kept
+                pipeline.zremrangebyrank(key, 1, -self.max_length - 1)
+                pipeline.execute()
+        except redis.RedisError as e:
+            print("Post timeline is not updated: ", str(e))
+
+    @staticmethod
+    def get_page_from_db(author_ids, before, count):
+        """
+        Returns the newest visible posts of the authors older than the cursor, read by one query.
+        """
+        posts = Post.objects.filter(
+            author_id__in=author_ids, is_blocked=False, moderation_status=ModerationStatus.APPROVED
+        )
+        if before:
+            created_at, post_id = before
+            posts = posts.filter(Q(created_at__lt=created_at) | Q(created_at=created_at, id__lt=post_id))
+        rows = posts.order_by("-created_at", "-id").values_list("created_at", "id")[:count]
+        return [(created_at.timestamp(), post_id) for created_at, post_id in rows]
+
+    def build(self, author_id):
+        """
+        Adds the latest posts of the author from the database to the timeline and marks it as built.
+        """
+        entries = self.get_page_from_db([author_id], None, self.max_length)
+        pipeline = self._redis.pipeline()
+        pipeline.zadd(self.get_key(author_id), {
+            BUILT_MARKER: float("-inf"), **{post_id: score for score, post_id in entries}
+        })
+        pipeline.zremrangebyrank(self.get_key(author_id), 1, -self.max_length - 1)
+        pipeline.execute()
+
+    def get_page_from_redis(self, author_id, before, count):
+        """
+        Returns the page of the author timeline or None if the page is older than the kept timeline.
+        """
+        key = self.get_key(author_id)
+        cursor = (before[0].timestamp(), before[1]) if before else None
+
+        for _ in range(2):
+            pipeline = self._redis.pipeline()
+            pipeline.zscore(key, BUILT_MARKER)
+            pipeline.zcard(key)
+            # The posts created at the same time as the cursor post are filtered out by the ID below,
+            # so a few more entries than the page size are read
+            pipeline.zrevrangebyscore(
+                key, cursor[0] if cursor else "+inf", "(-inf", start=0, num=count + 10, withscores=True
+            )
+            built, length, rows = pipeline.execute()
+            if built is not None:
+                break
+            self.build(author_id)
+        else:
+            return None
+
+        entries = sorted(((score, int(post_id)) for post_id, score in rows), reverse=True)
+        if cursor:
+            entries = [entry for entry in entries if entry < cursor]
+        entries = entries[:count]
+
+        # The timeline keeps only the latest posts, the older pages are read from the database
+        if len(entries) < count and length > self.max_length:
+            return None
+        return entries
+
+    def get_page(self, author_ids, before=None, count=50):
+        """
+        Returns the newest posts of the authors older than the cursor, merged from their timelines.
+        :param author_ids: list of int
+        :param before: (created_at, post ID) of the last post of the previous page or None
+        :param count: int
+        :return: list of (creation timestamp, post ID), newest first
+        """
+        pages = []
+        db_author_ids = []
+        for author_id in author_ids:
+            page = None
+            if self._redis is not None:
+                try:
+                    page = self.get_page_from_redis(author_id, before, count)
+                except redis.RedisError as e:
+                    print("Post timeline is not available: ", str(e))
+            if page is None:
+                db_author_ids.append(author_id)
+            else:
+                pages.append(page)
+
+        if db_author_ids:
+            pages.append(self.get_page_from_db(db_author_ids, before, count))
+
+        return list(heapq.merge(*pages, reverse=True))[:count]
+
+
+post_timelines = PostTimelines(settings.POST_TIMELINE_MAX_LENGTH, client=get_shared_redis())
@@ -1,14 +1,37 @@
-from django.db import models
-from django.db.models import Count
+import json
+import os
+
+from django.conf import settings
+from django.core.handlers.asgi import ASGIRequest
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Count, Q
+from django.db.models.functions import Trunc
+from django.http import StreamingHttpResponse
+from django.utils import timezone
 from django.utils.dateparse import parse_date
-from datetime import timedelta
+from datetime import datetime, time, timedelta
 from ninja import Router
+from ninja.errors import HttpError
 from ninja.responses import Response
 
-from posts.models import Comment
+from posts.cache_tools import get_shared_cache, is_cache_shared
+from posts.models import Comment, CommentDailyStats
+from posts.moderation_cache import moderation_cache
+from posts.stats import get_stats_cache_key
+from posts.views.views_tools import is_staff_user
+from users.cache import user_cache
 
 router = Router()
 
+GRANULARITIES = ("hour", "day", "week")
+# Values returned for each group of the breakdown
+GROUP_BY_FIELDS = {
+    "post": ("post_id",),
+    "author": ("author_id", "author__username"),
+    "block_reason": ("block_reason",),
+}
+BREAKDOWN_CHUNK_SIZE = 2000
+
 
 def validate_dates(date_from, date_to):
     """Validate date parameters."""
@@ -29,17 +52,34 @@ def get_date_range(start_date, end_date):
     return [start_date + timedelta(days=i) for i in range((end_date - start_date).days + 1)]
 
 
+def get_datetime_range(start_date, end_date):
+    """
+    Convert the date range to the range of aware datetimes [start, end).
+    Unlike `created_at__date`, filtering by it can use the index on `created_at`.
+    """
+    start = timezone.make_aware(datetime.combine(start_date, time.min))
+    end = timezone.make_aware(datetime.combine(end_date + timedelta(days=1), time.min))
+    return start, end
+
+
 def get_comments_data(start_date, end_date):
-    """Retrieve aggregated comments data for the specified date range."""
-    return (
-        Comment.objects.filter(created_at__date__range=(start_date, end_date))
-        .values("created_at__date")
-        .annotate(
-            total_comments=Count("id"),
-            blocked_comments=Count("id", filter=models.Q(is_blocked=True))
-        )
-        .order_by("created_at__date")
+    """
+    Retrieve aggregated comments data for the specified date range.
+    The data is read from the daily rollup, so the cost depends on the number of days, not comments.
+    """
+    stats = (
+        CommentDailyStats.objects.filter(date__gte=start_date, date__lte=end_date)
+        .values("date", "total_comments", "blocked_comments")
+        .order_by("date")
     )
+    return [
+        {
+            "created_at__date": row["date"],
+            "total_comments": row["total_comments"],
+            "blocked_comments": row["blocked_comments"],
+        }
+        for row in stats
+    ]
 
 
 def build_analytics_dict(date_range, comments_data):
@@ -54,6 +94,34 @@ def build_analytics_dict(date_range, comments_data):
     return analytics
 
 
+def get_cached_analytics(date_range):
+    """
+    Build the analytics dict using the per-day cache.
+    Only the days missing in the cache are read from the database with one query. Past days are cached
+    until their stats change, the current and future days expire after `ANALYTICS_CACHE_TTL` seconds.
+    Without the shared cache the invalidation reaches only the current worker, so past days expire too.
+    """
+    cache = get_shared_cache()
+    keys = {date: get_stats_cache_key(date) for date in date_range}
+    cached = cache.get_many(keys.values())
+
+    missing = [date for date in date_range if keys[date] not in cached]
+    if missing:
+        missing_analytics = build_analytics_dict(missing, get_comments_data(missing[0], missing[-1]))
+        today = timezone.localdate()
+        past_days = {}
+        open_days = {}
+        for date in missing:
+            day_analytics = missing_analytics[date.strftime("%Y-%m-%d")]
+            (past_days if date < today else open_days)[keys[date]] = day_analytics
+            cached[keys[date]] = day_analytics
+
+        cache.set_many(past_days, timeout=None if is_cache_shared() else settings.ANALYTICS_CACHE_TTL)
+        cache.set_many(open_days, timeout=settings.ANALYTICS_CACHE_TTL)
+
+    return {date.strftime("%Y-%m-%d"): cached[keys[date]] for date in date_range}
+
+
 @router.get("/comments-daily-breakdown")
 def comments_daily_breakdown(request):
     """
@@ -87,10 +155,116 @@ def comments_daily_breakdown(request):
     # Range date create
     date_range = get_date_range(start_date, end_date)
 
-    # Get aggregated data
-    comments_data = get_comments_data(start_date, end_date)
-
-    # Create analytics
-    analytics = build_analytics_dict(date_range, comments_data)
+    # Create analytics from the cached days and the aggregated data of the missing ones
+    analytics = get_cached_analytics(date_range)
 
     return Response(analytics)
+
+
+def validate_breakdown_params(granularity, group_by):
+    """Validate the granularity and grouping parameters of the breakdown."""
+    if granularity not in GRANULARITIES:
+        return Response({"error": f"granularity must be one of: {', '.join(GRANULARITIES)}."}, status=400)
+
+    if group_by is not None and group_by not in GROUP_BY_FIELDS:
+        return Response({"error": f"group_by must be one of: {', '.join(GROUP_BY_FIELDS)}."}, status=400)
+
+    return None
+
+
+def get_comments_breakdown(start_date, end_date, granularity="day", group_by=None):
+    """
+    Build the query which aggregates the comments by periods and, optionally, by post, author or block reason.
+    The whole aggregation is done by the database with one GROUP BY query.
+    """
+    start, end = get_datetime_range(start_date, end_date)
+    group_fields = GROUP_BY_FIELDS[group_by] if group_by else ()
+
+    return (
+        Comment.objects.filter(created_at__gte=start, created_at__lt=end)
+        .annotate(period=Trunc("created_at", granularity))
+        .values("period", *group_fields)
+        .annotate(
+            total_comments=Count("id"),
+            blocked_comments=Count("id", filter=Q(is_blocked=True)),
+        )
+        .order_by("period", *group_fields)
+    )
+
+
+def stream_ndjson(rows):
+    """Yield the rows of the queryset as newline-delimited JSON."""
+    for row in rows.iterator(chunk_size=BREAKDOWN_CHUNK_SIZE):
+        yield json.dumps(row, cls=DjangoJSONEncoder) + "\n"
+
+
+async def astream_ndjson(rows):
+    """Asynchronous version of stream_ndjson(), which is streamed by an ASGI server without buffering."""
+    async for row in rows.aiterator(chunk_size=BREAKDOWN_CHUNK_SIZE):
+        yield json.dumps(row, cls=DjangoJSONEncoder) + "\n"
+
+
+@router.get("/comments-breakdown")
+def comments_breakdown(request):
+    """
+    Retrieve the comments breakdown by periods and, optionally, by post, author or block reason.
+
+    Args:
+        request: The HTTP request object.
+
+    Returns:
+        Response: A JSON list of rows with the period, the group fields, `total_comments`
+        and `blocked_comments`, or a streaming NDJSON response if `format=ndjson`.
+
+    The method accepts the query parameters `date_from` and `date_to` (required), `granularity`
+    (`hour`, `day` or `week`, `day` by default), `group_by` (`post`, `author` or `block_reason`,
+    no grouping by default) and `format` (`json` or `ndjson`). Periods without comments are omitted.
+    The NDJSON response is streamed from a server-side cursor, so large ranges are not loaded into memory.
+    Django reads the whole iterator of another type into memory before streaming it, so a WSGI
+    server gets a synchronous iterator and an ASGI server an asynchronous one.
+    """
+    start_date, end_date, error_response = validate_dates(request.GET.get("date_from"), request.GET.get("date_to"))
+    if error_response:
+        return error_response
+
+    granularity = request.GET.get("granularity", "day")
+    group_by = request.GET.get("group_by")
+    error_response = validate_breakdown_params(granularity, group_by)
+    if error_response:
+        return error_response
+
+    rows = get_comments_breakdown(start_date, end_date, granularity, group_by)
+
+    if request.GET.get("format") == "ndjson":
+        stream = astream_ndjson if isinstance(request, ASGIRequest) else stream_ndjson
+        return StreamingHttpResponse(stream(rows), content_type="application/x-ndjson")
+
+    return Response(list(rows))
+
+
+@router.get("/cache-stats")
+def cache_stats(request):
+    """
+    Retrieve the hit/miss metrics of the in-process caches.
+
+    Args:
+        request: The HTTP request object.
+
+    Returns:
+        Response: The process ID of the worker and the stats of the AI moderation verdict cache
+        and of the cache of the users authenticated by JWT.
+
+    Raises:
+        HttpError: If the user is not an admin.
+
+    The counters are kept by each worker process since its start, so the response describes
+    only the worker which has handled the request.
+    """
+    if not is_staff_user(request.user):
+        raise HttpError(403, "You are not allowed to view the cache stats.")
+
+    return Response({
+        "pid": os.getpid(),
+        "moderation_cache": moderation_cache.stats(),
+        "user_cache": user_cache.stats(),
+    })
@@ -1,20 +1,44 @@
+from datetime import date
+
+from django.conf import settings
 from django.core.exceptions import PermissionDenied
-from ninja import Router
-from django.shortcuts import get_object_or_404
+from django.core.handlers.asgi import ASGIRequest
+from django.http import StreamingHttpResponse
+from asgiref.sync import sync_to_async
+from ninja import Query, Router
+from django.shortcuts import aget_object_or_404, get_object_or_404
 from ninja.errors import HttpError
 from ninja.responses import Response
 
-from posts.models import Post, Comment
-from posts.schemas import CommentInSchema, CommentOutSchema
-from typing import List
-from posts.views.views_tools import check_post_blocked, check_parent_comment_blocked, schedule_auto_reply_if_enabled
+from posts.exports import EXPORT_FORMATS, aexport_rows, export_rows, get_export_queryset
+from posts.imports import IMPORT_MAX_COMMENTS, import_comments
+from posts.models import Post, Comment, ModerationStatus
+from posts.moderation import amoderate_instance
+from posts.schemas import CommentImportSchema, CommentInSchema, CommentOutSchema, CommentTreeSchema
+from posts.threads import build_comment_tree, get_depth, get_thread_queryset
+from typing import List, Optional
+from posts.views.views_tools import (
+    DEFAULT_PAGE_SIZE,
+    MAX_TREE_SIZE,
+    acheck_parent_comment_blocked,
+    check_post_blocked,
+    get_not_modified_response,
+    get_page_version,
+    get_version,
+    is_conditional_request,
+    is_staff_user,
+    paginate_by_cursor,
+    paginated_response,
+    schedule_auto_reply_if_enabled,
+    set_version_headers,
+)
 
 router = Router()
 
 # CRUD for Comments
 
 @router.post("/{post_id}/create/", response=CommentOutSchema)
-def create_comment(request, post_id: int, payload: CommentInSchema):
+async def create_comment(request, post_id: int, payload: CommentInSchema):
     """
     Handle the creation of a comment for a specific post.
 
@@ -24,6 +48,8 @@ def create_comment(request, post_id: int, payload: CommentInSchema):
     The content of the comment is analyzed, and if inappropriate, the comment is saved but marked
     as blocked, with the reason stored in the `block_reason` field. If the post has an auto-reply
     feature enabled, a task to send an automatic reply is scheduled after the specified delay.
+    In the asynchronous moderation mode the comment is saved as pending and 202 status is returned.
+    The view is asynchronous, so the worker isn't blocked while the AI-service checks the content.
 
     If the post or parent comment is blocked, or the content is deemed inappropriate, a relevant
     error message is returned as a JSON response.
@@ -42,9 +68,10 @@ def create_comment(request, post_id: int, payload: CommentInSchema):
     Raises:
         PermissionDenied: If the post or parent comment is blocked, preventing further actions.
     """
-    post = get_object_or_404(Post, id=post_id)
+    post = await aget_object_or_404(Post, id=post_id)
+    user = await request.auser()
 
-    if not request.user.is_authenticated:
+    if not user.is_authenticated:
         raise HttpError(401, "Authentication required")
 
     try:
@@ -53,16 +80,22 @@ def create_comment(request, post_id: int, payload: CommentInSchema):
 
         # Check if the parent comment is blocked
         if payload.parent_id:
-            check_parent_comment_blocked(payload.parent_id)
+            await acheck_parent_comment_blocked(payload.parent_id)
 
         # Create comment
-        comment = Comment.objects.create(
-            author=request.user,
+        comment = Comment(
+            author=user,
             post=post,
             content=payload.content,
             parent_id=payload.parent_id
         )
 
+        # The verdict is carried on the comment, so the pre_save signal doesn't check the content again
+        if not settings.MODERATION_ASYNC:
+            await amoderate_instance(comment)
+
+        await comment.asave()
+
         if comment.is_blocked:
             return Response(
                 {"detail": f"Comment was blocked, reason - it contains inappropriate content: {comment.block_reason}"},
@@ -70,35 +103,173 @@ def create_comment(request, post_id: int, payload: CommentInSchema):
             )
 
         # Schedule auto-reply if enabled
-        schedule_auto_reply_if_enabled(post, comment)
+        await sync_to_async(schedule_auto_reply_if_enabled)(post, comment)
+
+        # The pending comment is moderated asynchronously
+        status = 202 if comment.moderation_status == ModerationStatus.PENDING else 201
 
-        return Response(CommentOutSchema.from_orm(comment), status=201)
+        return Response(CommentOutSchema.from_orm(comment), status=status)
 
     except PermissionDenied as e:
         return Response({"detail": str(e)}, status=403)
 
 
 @router.get("/{post_id}/comments/", response=List[CommentOutSchema])
-def list_comments(request, post_id: int):
+def list_comments(request, post_id: int, limit: int = DEFAULT_PAGE_SIZE, cursor: Optional[str] = None):
     """
-    Retrieve a list of comments for a specific post.
+    Retrieve a page of comments for a specific post, oldest first.
 
     Args:
         request: The HTTP request object.
         post_id (int): The ID of the post for which to retrieve comments.
+        limit (int): The page size (up to 200).
+        cursor (str): The cursor of the page from the `X-Next-Cursor` header of the previous page.
 
     Returns:
         List[CommentOutSchema]: A list of comments associated with the specified post,
-        excluding any comments that are marked as blocked.
+        excluding any comments that are marked as blocked or are not approved yet.
+        The comments and their authors are fetched with a single query. The `X-Next-Cursor`
+        header contains the cursor of the next page, if there is one.
+
+    The `ETag` and `Last-Modified` headers are derived from the IDs and `updated_at` of the page comments.
+    A conditional request (`If-None-Match` or `If-Modified-Since`) is first answered by a precheck query
+    of only these columns, and if the page hasn't changed, `304 Not Modified` is returned without
+    loading the comments.
     """
-    comments = Comment.objects.filter(post_id=post_id, is_blocked=False)
+    comments = Comment.objects.filter(
+        post_id=post_id, is_blocked=False, moderation_status=ModerationStatus.APPROVED
+    )
+    if is_conditional_request(request):
+        not_modified = get_not_modified_response(request, get_page_version(comments, cursor, limit))
+        if not_modified:
+            return not_modified
+
+    comments = comments.select_related("author").only(*CommentOutSchema.orm_fields)
+    comments, next_cursor = paginate_by_cursor(comments, cursor, limit)
     comments_list = [CommentOutSchema.from_orm(comment) for comment in comments]
 
-    return Response(comments_list)
+    version = get_version([(comment.id, comment.updated_at) for comment in comments], next_cursor is not None)
+    return set_version_headers(paginated_response(comments_list, next_cursor), version)
+
+
+@router.get("/{post_id}/tree/", response=List[CommentTreeSchema])
+def comments_tree(request, post_id: int, root_id: Optional[int] = None, depth: Optional[int] = None):
+    """
+    Retrieve the comments of a post as nested threads.
+
+    Args:
+        request: The HTTP request object.
+        post_id (int): The ID of the post for which to retrieve comments.
+        root_id (int): The ID of the comment whose subtree is returned, all threads by default.
+        depth (int): The maximum depth of the replies below the top-level (or the root) comments, unlimited by default.
+
+    Returns:
+        List[CommentTreeSchema]: The top-level comments (or the root comment) with the nested `replies`,
+        oldest first. Blocked and not approved comments are excluded together with their replies.
+        Up to 1000 comments are returned.
+
+    The comments are ordered by their materialized path, so the whole tree is read by one query
+    (one more to find the root comment).
+    """
+    comments = (
+        Comment.objects.filter(post_id=post_id, is_blocked=False, moderation_status=ModerationStatus.APPROVED)
+        .select_related("author")
+        .only("path", *CommentOutSchema.orm_fields)
+    )
+
+    if depth is not None and depth < 0:
+        raise HttpError(400, "depth must not be negative.")
+
+    root = None
+    if root_id is not None:
+        root = get_object_or_404(Comment.objects.only("path"), id=root_id, post_id=post_id)
+
+    comments = get_thread_queryset(comments, root, depth)[:MAX_TREE_SIZE]
+    top_depth = get_depth(root.path) if root else 0
+
+    return build_comment_tree(comments, CommentTreeSchema.from_orm, top_depth)
+
+
+@router.get("/export/")
+def export_comments(
+    request,
+    date_from: Optional[date] = None,
+    date_to: Optional[date] = None,
+    is_blocked: Optional[bool] = None,
+    export_format: str = Query("csv", alias="format"),
+):
+    """
+    Export the comments with their moderation results as a CSV or NDJSON stream.
+
+    Args:
+        request: The HTTP request object.
+        date_from (date): The first creation date of the exported comments.
+        date_to (date): The last creation date of the exported comments.
+        is_blocked (bool): Export only blocked (true) or not blocked (false) comments.
+        export_format (str): The `format` query parameter, `csv` (default) or `ndjson`.
+
+    Returns:
+        StreamingHttpResponse: The exported comments ordered by ID.
+
+    Raises:
+        HttpError: If the user is not an admin or the format is unknown.
+
+    The comments are read with a server-side cursor and streamed chunk by chunk,
+    so the memory use doesn't depend on the number of exported comments.
+    Django reads the whole iterator of another type into memory before streaming it, so a WSGI
+    server gets a synchronous iterator and an ASGI server an asynchronous one.
+    """
+    if not is_staff_user(request.user):
+        raise HttpError(403, "You are not allowed to export comments.")
+
+    if export_format not in EXPORT_FORMATS:
+        raise HttpError(400, f"format must be one of: {', '.join(EXPORT_FORMATS)}.")
+
+    comments = get_export_queryset(date_from, date_to, is_blocked)
+    rows = aexport_rows if isinstance(request, ASGIRequest) else export_rows
+    response = StreamingHttpResponse(rows(comments, export_format), content_type=EXPORT_FORMATS[export_format])
+    response["Content-Disposition"] = f'attachment; filename="comments.{export_format}"'
+    return response
+
+
+@router.post("/bulk/")
+def bulk_create_comments(request, payload: List[CommentImportSchema]):
+    """
+    Import comments in bulk, e.g. from a legacy system.
+
+    Args:
+        request: The HTTP request object.
+        payload (List[CommentImportSchema]): Up to 5000 comments. A comment without `author_id`
+                                             is created by the current user. `parent_id` must be the ID
+                                             of an existing comment, the comments of one request can't
+                                             reply to each other.
+
+    Returns:
+        dict: The numbers of created, blocked and pending comments and the errors of the skipped comments
+              (their index in the payload and the reason).
+
+    Raises:
+        HttpError: If the user is not an admin or there are too many comments.
+
+    The posts, parent comments and authors are validated with one query each and the comments are
+    inserted with `bulk_create`. Invalid comments are skipped. The comments are saved as pending and
+    moderated in batches by a Celery task, so the request doesn't wait for the AI-service; the auto
+    replies are scheduled after the moderation. Use the `import_comments` command to moderate the
+    comments during the import.
+    """
+    if not is_staff_user(request.user):
+        raise HttpError(403, "You are not allowed to import comments.")
+
+    if len(payload) > IMPORT_MAX_COMMENTS:
+        raise HttpError(400, f"Up to {IMPORT_MAX_COMMENTS} comments can be imported at once.")
+
+    result = import_comments([item.dict() for item in payload], request.user.id, pending=True)
+
+    return Response(result, status=201)
 
 
 @router.put("/{comment_id}/", response=CommentOutSchema)
-def update_comment(request, comment_id: int, payload: CommentInSchema):
+async def update_comment(request, comment_id: int, payload: CommentInSchema):
     """
     Update an existing comment.
 
@@ -117,16 +288,21 @@ def update_comment(request, comment_id: int, payload: CommentInSchema):
         - Only the author of the comment or an admin can update it.
 
     The payload fields are updated partially, allowing optional fields to be modified without requiring all fields to be provided.
+    In the asynchronous moderation mode the changed comment is pending and 202 status is returned.
     """
-    comment = get_object_or_404(Comment, id=comment_id)
+    comment = await aget_object_or_404(Comment.objects.select_related("author"), id=comment_id)
+    user = await request.auser()
 
-    if comment.author != request.user and not request.user.is_staff:
+    if comment.author_id != user.id and not user.is_staff:
         raise HttpError(403, "You are not allowed to edit this comment.")
 
     for attr, value in payload.dict(exclude_unset=True).items():
         setattr(comment, attr, value)
 
-    comment.save()
+    if not settings.MODERATION_ASYNC:
+        await amoderate_instance(comment)
+
+    await comment.asave()
 
     if comment.is_blocked:
         return Response(
@@ -134,7 +310,9 @@ def update_comment(request, comment_id: int, payload: CommentInSchema):
             status=400
         )
 
-    return Response(CommentOutSchema.from_orm(comment), status=200)
+    status = 202 if comment.moderation_status == ModerationStatus.PENDING else 200
+
+    return Response(CommentOutSchema.from_orm(comment), status=status)
 
 
 @router.delete("/{comment_id}/")
@@ -1,19 +1,59 @@
+from datetime import datetime, timezone
+
+from django.conf import settings
 from ninja import Router
-from django.shortcuts import get_object_or_404
+from django.shortcuts import aget_object_or_404, get_object_or_404
 from ninja.errors import HttpError
 from ninja.responses import Response
 
-from posts.ai_tools import moderate_content_with_ai
-from posts.models import Post
-from posts.schemas import PostInSchema, PostOutSchema
-from typing import List
+from posts.models import Post, ModerationStatus
+from posts.moderation import amoderate_instance
+from posts.schemas import CommentOutSchema, FeedPostSchema, PostInSchema, PostOutSchema
+from posts.timelines import post_timelines
+from posts.views.views_tools import (
+    DEFAULT_PAGE_SIZE,
+    decode_cursor,
+    encode_cursor,
+    get_latest_comments,
+    get_not_modified_response,
+    get_page_size,
+    get_version,
+    is_conditional_request,
+    paginate_by_cursor,
+    paginated_response,
+    set_version_headers,
+)
+from typing import List, Optional
 
 router = Router()
 
+POST_SORT_FIELDS = {
+    "created": "created_at",
+    "activity": "last_comment_at",
+}
+FEED_MAX_AUTHORS = 100
+FEED_LATEST_COMMENTS = 3
+# Besides updated_at, the post response depends on the comment counters and the moderation verdict,
+# which are updated without it
+POST_VERSION_FIELDS = (
+    "id", "updated_at", "comment_count", "last_comment_at", "is_blocked", "block_reason", "moderation_status",
+)
+
+
+def get_post_version(row):
+    """
+    Returns the ETag of the post and no Last-Modified time: the comment counters and the moderation verdict
+    change without a timestamp, so `If-Modified-Since` would return 304 with stale values.
+    :param row: tuple of POST_VERSION_FIELDS
+    :return: str, None
+    """
+    etag, _ = get_version([row])
+    return etag, None
+
 # CRUD for Posts
 
 @router.post("/create/", response={201: PostOutSchema}, url_name="create_post")
-def create_post(request, payload: PostInSchema):
+async def create_post(request, payload: PostInSchema):
     """
     Create a new post.
 
@@ -29,25 +69,25 @@ def create_post(request, payload: PostInSchema):
 
     This method performs the following actions:
         - Checks if the user is authenticated.
-        - Validates the title and content for inappropriate content using AI moderation.
-        - Creates a new post with the provided data.
+        - Creates a new post with the provided data, the title and content are validated
+          for inappropriate content by the AI moderation before saving.
         - If the content is deemed inappropriate, it returns a 403 response with a relevant message.
+        - In the asynchronous moderation mode the post is saved as pending and 202 status is returned.
+
+    The view is asynchronous, so the worker isn't blocked while the AI-service checks the content.
     """
-    user = request.user
+    user = await request.auser()
 
     if not user.is_authenticated:
         raise HttpError(401, "Authentication required")
 
-    result, reason = moderate_content_with_ai(payload.title)
-    if not result:
-        result, reason = moderate_content_with_ai(payload.content)
+    post = Post(author=user, **payload.dict())
 
-    post = Post.objects.create(
-        author=user,
-        is_blocked=result,
-        block_reason=reason,
-        **payload.dict()
-    )
+    # The verdict is carried on the post, so the pre_save signal doesn't check the content again
+    if not settings.MODERATION_ASYNC:
+        await amoderate_instance(post)
+
+    await post.asave()
 
     if post.is_blocked:
         return Response(
@@ -55,29 +95,115 @@ def create_post(request, payload: PostInSchema):
             status=400
         )
 
-    return Response(PostOutSchema.from_orm(post), status=201)
+    # The pending post is moderated asynchronously
+    status = 202 if post.moderation_status == ModerationStatus.PENDING else 201
+
+    return Response(PostOutSchema.from_orm(post), status=status)
 
 
 
 @router.get("/posts/", response=List[PostOutSchema])
-def list_posts(request):
+def list_posts(request, limit: int = DEFAULT_PAGE_SIZE, cursor: Optional[str] = None, sort: str = "created"):
     """
-    Retrieve a list of all posts.
+    Retrieve a page of posts, newest first.
 
     Args:
         request: The HTTP request object.
+        limit (int): The page size (up to 200).
+        cursor (str): The cursor of the page from the `X-Next-Cursor` header of the previous page.
+        sort (str): `created` (default) - the newest posts first, `activity` - the posts with the latest
+                    comments first (posts without comments are skipped).
 
     Returns:
         List[PostOutSchema]: A list of posts that are not blocked, with their details.
+        The `X-Next-Cursor` header contains the cursor of the next page, if there is one.
 
-    This method fetches all posts from the database, filtering out any posts that are marked as blocked.
+    This method fetches all posts from the database, filtering out any posts that are marked as blocked
+    or are not approved by the asynchronous moderation yet.
     The response contains the details of each post, including title, content, creation date,
-    last updated date, and the author's username.
+    last updated date, and the author's username. The posts and their authors are fetched with a single query.
     """
-    posts = Post.objects.filter(is_blocked=False)
+    if sort not in POST_SORT_FIELDS:
+        raise HttpError(400, f"sort must be one of: {', '.join(POST_SORT_FIELDS)}.")
+
+    posts = (
+        Post.objects.filter(is_blocked=False, moderation_status=ModerationStatus.APPROVED)
+        .select_related("author")
+        .only(*PostOutSchema.orm_fields)
+    )
+    # The activity is read from the denormalized last_comment_at, without aggregating the comments
+    field = POST_SORT_FIELDS[sort]
+    if field == "last_comment_at":
+        posts = posts.filter(last_comment_at__isnull=False)
+    posts, next_cursor = paginate_by_cursor(posts, cursor, limit, field=field, descending=True)
     post_list = [PostOutSchema.from_orm(post) for post in posts]
 
-    return Response(post_list)
+    return paginated_response(post_list, next_cursor)
+
+
+@router.get("/feed/", response=List[FeedPostSchema])
+def feed(request, authors: Optional[str] = None, limit: int = DEFAULT_PAGE_SIZE, cursor: Optional[str] = None):
+    """
+    Retrieve a page of the posts of the given authors, newest first, with their latest comments.
+
+    Args:
+        request: The HTTP request object.
+        authors (str): Comma-separated IDs of the authors (up to 100), the current user by default.
+        limit (int): The page size (up to 200).
+        cursor (str): The cursor of the page from the `X-Next-Cursor` header of the previous page.
+
+    Returns:
+        List[FeedPostSchema]: A list of visible posts, each with its 3 latest visible comments.
+        The `X-Next-Cursor` header contains the cursor of the next page, if there is one.
+
+    Raises:
+        HttpError: If the authors are invalid, or if no authors are given and the user is not authenticated.
+
+    The post IDs are read from the per-author timelines (see posts/timelines.py) and merged, so the page
+    doesn't depend on the total number of posts. The posts and their latest comments are then loaded
+    with one query each.
+    """
+    if authors:
+        try:
+            author_ids = sorted({int(author_id) for author_id in authors.split(",")})
+        except ValueError:
+            raise HttpError(400, "authors must be a comma-separated list of user IDs.")
+        if len(author_ids) > FEED_MAX_AUTHORS:
+            raise HttpError(400, f"Up to {FEED_MAX_AUTHORS} authors are allowed.")
+    elif request.user.is_authenticated:
+        author_ids = [request.user.id]
+    else:
+        raise HttpError(401, "Authentication required")
+
+    limit = get_page_size(limit)
+    before = decode_cursor(cursor) if cursor else None
+    entries = post_timelines.get_page(author_ids, before, limit + 1)
+
+    next_cursor = None
+    if len(entries) > limit:
+        entries = entries[:limit]
+        timestamp, post_id = entries[-1]
+        next_cursor = encode_cursor(datetime.fromtimestamp(timestamp, tz=timezone.utc), post_id)
+
+    post_ids = [post_id for _, post_id in entries]
+    # The visibility is checked again, in case the post has been blocked after the timeline was read
+    posts = (
+        Post.objects.filter(is_blocked=False, moderation_status=ModerationStatus.APPROVED)
+        .select_related("author")
+        .only(*PostOutSchema.orm_fields)
+        .in_bulk(post_ids)
+    )
+    latest_comments = get_latest_comments(list(posts), FEED_LATEST_COMMENTS)
+
+    post_list = [
+        dict(
+            PostOutSchema.from_orm(posts[post_id]),
+            latest_comments=[CommentOutSchema.from_orm(comment) for comment in latest_comments[post_id]],
+        )
+        for post_id in post_ids if post_id in posts
+    ]
+
+    return paginated_response(post_list, next_cursor)
 
 
 @router.get("/{post_id}/", response=PostOutSchema)
@@ -95,14 +221,26 @@ def get_post(request, post_id: int):
 
     This method fetches a post from the database using the provided post ID.
     If the post does not exist, a 404 Not Found error is raised.
+
+    The `ETag` header is derived from `updated_at`, the comment counters and the moderation verdict
+    of the post. No `Last-Modified` header is returned, since the counters and the verdict are not
+    timestamped. A conditional request (`If-None-Match`) is first answered by a precheck query of only
+    these columns, and if the post hasn't changed, `304 Not Modified` is returned without loading the post.
     """
-    post = get_object_or_404(Post, id=post_id)
+    if is_conditional_request(request):
+        row = get_object_or_404(Post.objects.values_list(*POST_VERSION_FIELDS), id=post_id)
+        not_modified = get_not_modified_response(request, get_post_version(row))
+        if not_modified:
+            return not_modified
 
-    return Response(PostOutSchema.from_orm(post), status=200)
+    post = get_object_or_404(Post.objects.select_related("author"), id=post_id)
+    version = get_post_version(tuple(getattr(post, field) for field in POST_VERSION_FIELDS))
+
+    return set_version_headers(Response(PostOutSchema.from_orm(post), status=200), version)
 
 
 @router.put("/{post_id}/", response=PostOutSchema)
-def update_post(request, post_id: int, payload: PostInSchema):
+async def update_post(request, post_id: int, payload: PostInSchema):
     """
     Update an existing post by its ID.
 
@@ -122,17 +260,23 @@ def update_post(request, post_id: int, payload: PostInSchema):
 
     This method retrieves a post from the database using the provided post ID and
     updates its fields based on the provided payload. Only the post's author or
-    an admin can make updates. If the post is not found, a 404 Not Found error is raised.
+    an admin can make updates. Only the changed title or content is checked by the AI moderation,
+    in the asynchronous moderation mode the changed post is pending and 202 status is returned.
+    If the post is not found, a 404 Not Found error is raised.
     """
-    post = get_object_or_404(Post, id=post_id)
+    post = await aget_object_or_404(Post.objects.select_related("author"), id=post_id)
+    user = await request.auser()
 
-    if post.author != request.user and not request.user.is_staff:
+    if post.author_id != user.id and not user.is_staff:
         raise HttpError(403, "You are not allowed to edit this post.")
 
     for attr, value in payload.dict(exclude_unset=True).items():
         setattr(post, attr, value)
 
-    post.save()
+    if not settings.MODERATION_ASYNC:
+        await amoderate_instance(post)
+
+    await post.asave()
 
     if post.is_blocked:
         return Response(
@@ -140,7 +284,9 @@ def update_post(request, post_id: int, payload: PostInSchema):
             status=400
         )
 
-    return Response(PostOutSchema.from_orm(post), status=200)
+    status = 202 if post.moderation_status == ModerationStatus.PENDING else 200
+
+    return Response(PostOutSchema.from_orm(post), status=status)
 
 
 @router.delete("/{post_id}/")
@@ -0,0 +1,74 @@
+from ninja import Router
+from ninja.errors import HttpError
+from typing import List
+
+from posts.models import Comment, ModerationStatus, Post
+from posts.schemas import CommentOutSchema, PostOutSchema
+from posts.search import search_comments, search_posts
+from posts.views.views_tools import DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE
+
+router = Router()
+
+MAX_SEARCH_OFFSET = 1000
+
+
+def get_page(queryset, limit, offset):
+    """
+    Returns the page of the ranked search results.
+    :raises HttpError: if the offset is out of range
+    """
+    if not 0 <= offset <= MAX_SEARCH_OFFSET:
+        raise HttpError(400, f"offset must be between 0 and {MAX_SEARCH_OFFSET}.")
+
+    limit = min(max(limit, 1), MAX_PAGE_SIZE)
+    return queryset[offset:offset + limit]
+
+
+@router.get("/posts/", response=List[PostOutSchema])
+def search_posts_view(request, q: str, limit: int = DEFAULT_PAGE_SIZE, offset: int = 0):
+    """
+    Full-text search over the titles and contents of the posts.
+
+    Args:
+        request: The HTTP request object.
+        q (str): The search query, e.g. `django -flask "moderation tools"`.
+        limit (int): The page size (up to 200).
+        offset (int): The number of skipped results (up to 1000).
+
+    Returns:
+        List[PostOutSchema]: The matching posts, the best matches first. Blocked and not approved
+        posts are excluded. Matches in the title are ranked higher than in the content.
+    """
+    posts = search_posts(
+        Post.objects.filter(is_blocked=False, moderation_status=ModerationStatus.APPROVED)
+        .select_related("author")
+        .only(*PostOutSchema.orm_fields),
+        q,
+    )
+
+    return [PostOutSchema.from_orm(post) for post in get_page(posts, limit, offset)]
+
+
+@router.get("/comments/", response=List[CommentOutSchema])
+def search_comments_view(request, q: str, limit: int = DEFAULT_PAGE_SIZE, offset: int = 0):
+    """
+    Full-text search over the comments.
+
+    Args:
+        request: The HTTP request object.
+        q (str): The search query.
+        limit (int): The page size (up to 200).
+        offset (int): The number of skipped results (up to 1000).
+
+    Returns:
+        List[CommentOutSchema]: The matching comments, the best matches first. Blocked and not approved
+        comments are excluded.
+    """
+    comments = search_comments(
+        Comment.objects.filter(is_blocked=False, moderation_status=ModerationStatus.APPROVED)
+        .select_related("author")
+        .only(*CommentOutSchema.orm_fields),
+        q,
+    )
+
+    return [CommentOutSchema.from_orm(comment) for comment in get_page(comments, limit, offset)]
@@ -1,8 +1,29 @@
+import base64
+import binascii
+import hashlib
+import json
+from collections import defaultdict
+
+from django.conf import settings
+from django.contrib.auth.models import User
 from django.core.exceptions import PermissionDenied
+from django.db.models import F, Q, Window
+from django.db.models.functions import RowNumber
+from django.utils.cache import get_conditional_response
+from django.utils.dateparse import parse_datetime
+from django.utils.http import http_date, quote_etag
+from ninja.errors import HttpError
+from ninja.responses import Response
+
+from posts.models import Post, Comment, ModerationStatus
+from posts.schemas import CommentOutSchema
+from posts.tasks import schedule_coalesced_auto_reply, send_auto_reply
+from django.shortcuts import aget_object_or_404, get_object_or_404
+
 
-from posts.models import Post, Comment
-from posts.tasks import send_auto_reply
-from django.shortcuts import get_object_or_404
+def is_staff_user(user) -> bool:
+    # The staff flag embedded in a stateless token may be stale, so it is checked in the database
+    return user.is_authenticated and User.objects.filter(id=user.id, is_active=True, is_staff=True).exists()
 
 
 def check_post_blocked(post: Post):
@@ -16,9 +37,171 @@ def check_parent_comment_blocked(parent_id: int):
         raise PermissionDenied("You cannot create a comment for blocked content.")
 
 
+async def acheck_parent_comment_blocked(parent_id: int):
+    parent_comment = await aget_object_or_404(Comment, id=parent_id)
+    if parent_comment.is_blocked:
+        raise PermissionDenied("You cannot create a comment for blocked content.")
+
+
 def schedule_auto_reply_if_enabled(post: Post, comment: Comment):
-    if post.auto_reply_enabled and not comment.is_blocked:
+    # Pending comments are answered after the asynchronous moderation
+    if post.auto_reply_enabled and comment.moderation_status == ModerationStatus.APPROVED:
+        # Comments within the reply_delay window are answered by one task
+        if settings.AUTO_REPLY_COALESCE:
+            schedule_coalesced_auto_reply(post, comment)
+            return
+
         send_auto_reply.apply_async(
             args=[post.id, comment.id],
             countdown=post.reply_delay * 60
         )
+
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+MAX_TREE_SIZE = 1000  # comments returned by the comment tree
+
+
+def encode_cursor(value, pk):
+    """
+    Encodes the position in the ordered list to an opaque cursor.
+    """
+    return base64.urlsafe_b64encode(json.dumps([value.isoformat(), pk]).encode()).decode()
+
+
+def decode_cursor(cursor: str):
+    """
+    Decodes the cursor created by encode_cursor().
+    :return: datetime, int
+    :raises HttpError: if the cursor is invalid
+    """
+    try:
+        value, pk = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        value = parse_datetime(value)
+    except (binascii.Error, ValueError, TypeError):
+        value, pk = None, None
+
+    if value is None or not isinstance(pk, int):
+        raise HttpError(400, "Invalid cursor.")
+
+    return value, pk
+
+
+def get_page_size(limit):
+    return min(max(limit, 1), MAX_PAGE_SIZE)
+
+
+def get_page_queryset(queryset, cursor, field="created_at", descending=False):
+    """
+    Filters the queryset by the cursor and orders it by (field, id), see paginate_by_cursor().
+    """
+    if cursor:
+        value, pk = decode_cursor(cursor)
+        lookup = "lt" if descending else "gt"
+        queryset = queryset.filter(Q(**{f"{field}__{lookup}": value}) | Q(**{field: value, f"id__{lookup}": pk}))
+
+    ordering = (f"-{field}", "-id") if descending else (field, "id")
+    return queryset.order_by(*ordering)
+
+
+def paginate_by_cursor(queryset, cursor, limit, field="created_at", descending=False):
+    """
+    Keyset (cursor) pagination over (field, id).
+
+    Unlike OFFSET, the page is found by the index on (field, id), so deep pages cost the same as the first one.
+    :param queryset: QuerySet
+    :param cursor: str or None, the cursor of the previous page
+    :param limit: int, the page size
+    :param field: str, the datetime field to order by
+    :param descending: bool, the order direction
+    :return: list of objects and the cursor of the next page (None for the last page)
+    """
+    limit = get_page_size(limit)
+    items = list(get_page_queryset(queryset, cursor, field, descending)[:limit + 1])
+
+    next_cursor = None
+    if len(items) > limit:
+        items = items[:limit]
+        next_cursor = encode_cursor(getattr(items[-1], field), items[-1].id)
+
+    return items, next_cursor
+
+
+def paginated_response(items, next_cursor):
+    """
+    Returns the page with the cursor of the next page in the X-Next-Cursor header.
+    """
+    response = Response(items)
+    if next_cursor:
+        response["X-Next-Cursor"] = next_cursor
+    return response
+
+
+def get_version(rows, *extra):
+    """
+    Returns the ETag and the Last-Modified time of the response built from the rows.
+    :param rows: list of tuples, which start with the object ID and `updated_at`
+    :param extra: other values the response depends on, e.g. whether there is the next page
+    :return: str, datetime or None
+    """
+    etag = quote_etag(hashlib.md5(repr((rows, extra)).encode()).hexdigest())
+    last_modified = max((row[1] for row in rows), default=None)
+    return etag, last_modified
+
+
+def get_page_version(queryset, cursor, limit, field="created_at", descending=False):
+    """
+    Returns the version of the page of paginate_by_cursor(), read by a precheck query of
+    the IDs and `updated_at` only, without the content and the authors.
+    """
+    limit = get_page_size(limit)
+    queryset = get_page_queryset(queryset, cursor, field, descending)
+    rows = list(queryset.values_list("id", "updated_at")[:limit + 1])
+    return get_version(rows[:limit], len(rows) > limit)
+
+
+def is_conditional_request(request):
+    return "HTTP_IF_NONE_MATCH" in request.META or "HTTP_IF_MODIFIED_SINCE" in request.META
+
+
+def get_not_modified_response(request, version):
+    """
+    Returns 304 Not Modified response if the client has the current version, None otherwise.
+    If-None-Match takes precedence over If-Modified-Since.
+    """
+    etag, last_modified = version
+    return get_conditional_response(
+        request, etag=etag, last_modified=int(last_modified.timestamp()) if last_modified else None
+    )
+
+
+def set_version_headers(response, version):
+    etag, last_modified = version
+    response["ETag"] = etag
+    if last_modified:
+        response["Last-Modified"] = http_date(last_modified.timestamp())
+    return response
+
+
+def get_latest_comments(post_ids, count):
+    """
+    Returns the latest visible comments of each post, loaded with one query.
+    :param post_ids: list of int
+    :param count: int, the number of comments per post
+    :return: dict of post ID to the list of comments, newest first
+    """
+    comments = (
+        Comment.objects.filter(post_id__in=post_ids, is_blocked=False, moderation_status=ModerationStatus.APPROVED)
+        .select_related("author")
+        .only(*CommentOutSchema.orm_fields)
+        .annotate(position=Window(
+            RowNumber(), partition_by=[F("post_id")], order_by=[F("created_at").desc(), F("id").desc()]
+        ))
+        .filter(position__lte=count)
+        .order_by("post_id", "position")
+    )
+
+    latest_comments = defaultdict(list)
+    for comment in comments:
+        latest_comments[comment.post_id].append(comment)
+    return latest_comments
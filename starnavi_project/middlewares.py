@@ -1,10 +1,16 @@
+import time
+
 import jwt
+from asgiref.sync import sync_to_async
 from django.conf import settings
 from django.contrib.auth import get_user_model
 from django.contrib.auth.models import User, AnonymousUser
 from django.utils.deprecation import MiddlewareMixin
 from django.utils.functional import SimpleLazyObject
 
+from users.cache import user_cache
+from users.tokens import get_user_from_claims, has_user_claims
+
 
 class DisableCSRFForAPIMiddleware(MiddlewareMixin):
     def process_request(self, request):
@@ -15,17 +21,48 @@ class DisableCSRFForAPIMiddleware(MiddlewareMixin):
 User = get_user_model()
 
 
-def get_user_from_jwt(request):
+def decode_jwt(request):
+    """
+    Returns the claims of the request bearer token or None if the token is missing or invalid.
+    """
     token = request.headers.get('Authorization', '').split('Bearer ')[-1]
     if token == '':
-        return AnonymousUser()
+        return None
 
     try:
-        decoded_token = jwt.decode(token, settings.SECRET_KEY, algorithms=["HS256"])
-        user_id = decoded_token.get("user_id")
-        return User.objects.get(id=user_id)
-    except (jwt.ExpiredSignatureError, jwt.DecodeError, User.DoesNotExist):
+        return jwt.decode(token, settings.SECRET_KEY, algorithms=["HS256"])
+    except (jwt.ExpiredSignatureError, jwt.DecodeError):
+        return None
+
+
+def get_user_from_jwt(request):
+    """
+    Returns the user of the request bearer token. The users are cached by the user ID and
+    the token `jti` for USER_CACHE_TTL seconds, so repeated requests don't query the database.
+    If the token embeds the user claims issued within USER_CLAIMS_MAX_AGE seconds, the user is built
+    from them without a query, an inactive user is anonymous like in the database path.
+    """
+    claims = decode_jwt(request)
+    if claims is None:
         return AnonymousUser()
+    if has_user_claims(claims):
+        return get_user_from_claims(claims)
+
+    user_id, jti = claims.get("user_id"), claims.get("jti")
+    start = time.perf_counter()
+    user = user_cache.get(user_id, jti)
+    hit = user is not None
+
+    if not hit:
+        try:
+            user = User.objects.get(id=user_id)
+        except User.DoesNotExist:
+            return AnonymousUser()
+        if jti:
+            user_cache.set(user_id, jti, user)
+
+    user_cache.record_lookup(hit, time.perf_counter() - start)
+    return user if user.is_active else AnonymousUser()
 
 
 class JWTAuthenticationMiddleware(MiddlewareMixin):
@@ -34,3 +71,31 @@ class JWTAuthenticationMiddleware(MiddlewareMixin):
             return
 
         request.user = SimpleLazyObject(lambda: get_user_from_jwt(request))
+        request.auser = lambda: aget_user_from_jwt(request)
+
+
+async def aget_user_from_jwt(request):
+    """
+    Async version of get_user_from_jwt() for async views, the user is resolved once per request.
+    A cached user is returned without switching to a thread.
+    """
+    if not hasattr(request, "_acached_user"):
+        request._acached_user = await aresolve_user_from_jwt(request)
+    return request._acached_user
+
+
+async def aresolve_user_from_jwt(request):
+    claims = decode_jwt(request)
+    if claims is None:
+        return AnonymousUser()
+    if has_user_claims(claims):
+        return get_user_from_claims(claims)
+
+    user_id, jti = claims.get("user_id"), claims.get("jti")
+    start = time.perf_counter()
+    user = user_cache.get(user_id, jti)
+    if user is None:
+        return await sync_to_async(get_user_from_jwt)(request)
+
+    user_cache.record_lookup(True, time.perf_counter() - start)
+    return user if user.is_active else AnonymousUser()
@@ -95,6 +95,26 @@ DATABASES = {
 }
 
 
+# Cache
+# https://docs.djangoproject.com/en/5.1/topics/cache/
+
+REDIS_CACHE_URL = os.getenv("REDIS_CACHE_URL")
+SHARED_CACHE_ALIAS = "shared"
+
+CACHES = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+    }
+}
+
+if REDIS_CACHE_URL:
+    # Shared between all workers
+    CACHES[SHARED_CACHE_ALIAS] = {
+        "BACKEND": "django.core.cache.backends.redis.RedisCache",
+        "LOCATION": REDIS_CACHE_URL,
+    }
+
+
 REST_FRAMEWORK = {
     "DEFAULT_AUTHENTICATION_CLASSES": (
         "rest_framework_simplejwt.authentication.JWTAuthentication",
@@ -158,3 +178,70 @@ CELERY_BROKER_URL = 'redis://localhost:6379/0'
 CELERY_ACCEPT_CONTENT = ['json']
 CELERY_TASK_SERIALIZER = 'json'
 CELERY_RESULT_BACKEND = 'redis://localhost:6379/0'
+# The AI tasks are run by a dedicated worker: celery -A starnavi_project worker -Q ai --concurrency=N
+AI_TASK_QUEUE = 'ai'
+CELERY_TASK_ROUTES = {
+    'posts.tasks.moderate_pending_content': {'queue': AI_TASK_QUEUE},
+    'posts.tasks.send_auto_reply': {'queue': AI_TASK_QUEUE},
+    'posts.tasks.send_auto_replies': {'queue': AI_TASK_QUEUE},
+}
+# With the Redis broker 0 is the highest priority, the moderation comes ahead of the auto replies
+CELERY_BROKER_TRANSPORT_OPTIONS = {
+    'priority_steps': list(range(10)),
+    'sep': ':',
+    'queue_order_strategy': 'priority',
+}
+CELERY_WORKER_PREFETCH_MULTIPLIER = 1  # the priorities are applied to all queued tasks
+MODERATION_TASK_PRIORITY = 0
+AUTO_REPLY_TASK_PRIORITY = 5
+
+
+# AI moderation
+# In the asynchronous mode posts and comments are saved as pending and moderated by a Celery task
+MODERATION_ASYNC = os.getenv("MODERATION_ASYNC", "False") == "True"
+MODERATION_CACHE_MAX_SIZE = int(os.getenv("MODERATION_CACHE_MAX_SIZE", 10000))
+MODERATION_CACHE_TTL = int(os.getenv("MODERATION_CACHE_TTL", 60 * 60 * 24))  # seconds
+MODERATION_CACHE_ALIAS = SHARED_CACHE_ALIAS  # is used only if the cache is configured
+MODERATION_BATCH_SIZE = int(os.getenv("MODERATION_BATCH_SIZE", 20))  # texts per request to the AI-service
+# Local pre-moderation, only ambiguous texts are sent to the AI-service
+MODERATION_PREFILTER_ENABLED = os.getenv("MODERATION_PREFILTER_ENABLED", "True") == "True"
+MODERATION_BLOCKLIST_PATH = BASE_DIR / "posts" / "data" / "blocklist.txt"
+MODERATION_ALLOWLIST_PATH = BASE_DIR / "posts" / "data" / "allowlist.txt"
+MODERATION_BATCH_DELAY = int(os.getenv("MODERATION_BATCH_DELAY", 2))  # seconds to collect pending content
+# What to do with content while the AI-service is not available:
+# "block" - block it, "open" - approve it, "queue" - save it as pending and moderate it later by a Celery task
+MODERATION_FAILURE_POLICY = os.getenv("MODERATION_FAILURE_POLICY", "block")
+
+# AI-service requests
+AI_RETRY_ATTEMPTS = int(os.getenv("AI_RETRY_ATTEMPTS", 3))
+AI_RETRY_BASE_DELAY = float(os.getenv("AI_RETRY_BASE_DELAY", 0.5))  # seconds, doubled after each attempt
+AI_RETRY_MAX_DELAY = float(os.getenv("AI_RETRY_MAX_DELAY", 4))  # seconds
+AI_CIRCUIT_FAILURE_THRESHOLD = int(os.getenv("AI_CIRCUIT_FAILURE_THRESHOLD", 5))  # failures to open the circuit
+AI_CIRCUIT_RECOVERY_TIMEOUT = int(os.getenv("AI_CIRCUIT_RECOVERY_TIMEOUT", 30))  # seconds before a probe request
+# Token bucket shared by all workers through Redis (if configured), the requests wait for a token
+AI_RATE_LIMIT_PER_MINUTE = float(os.getenv("AI_RATE_LIMIT_PER_MINUTE", 60))
+AI_RATE_LIMIT_BURST = int(os.getenv("AI_RATE_LIMIT_BURST", 10))
+AI_RATE_LIMIT_MAX_WAIT = float(os.getenv("AI_RATE_LIMIT_MAX_WAIT", 10))  # seconds, then the service is unavailable
+
+# Analytics
+# Past days of the comments daily breakdown are cached until invalidated, the current day expires after this timeout
+# (past days too, if the cache is not shared between workers)
+ANALYTICS_CACHE_TTL = int(os.getenv("ANALYTICS_CACHE_TTL", 60))  # seconds
+
+# Users authenticated by JWT are cached in-process by the user ID and the token jti
+USER_CACHE_MAX_SIZE = int(os.getenv("USER_CACHE_MAX_SIZE", 10000))
+USER_CACHE_TTL = int(os.getenv("USER_CACHE_TTL", 60))  # seconds
+# The user claims embedded in the stateless tokens are trusted for this time after the token is issued,
+# then the user is loaded from the database
+USER_CLAIMS_MAX_AGE = int(os.getenv("USER_CLAIMS_MAX_AGE", 300))  # seconds
+
+# Auto replies
+# Comments of a post arriving within its reply_delay window are answered by one task with one AI request
+AUTO_REPLY_COALESCE = os.getenv("AUTO_REPLY_COALESCE", "False") == "True"
+# Longer posts are summarized once per version for the auto reply prompts
+AUTO_REPLY_CONTEXT_MAX_LENGTH = int(os.getenv("AUTO_REPLY_CONTEXT_MAX_LENGTH", 2000))  # characters
+AUTO_REPLY_CONTEXT_CACHE_TTL = int(os.getenv("AUTO_REPLY_CONTEXT_CACHE_TTL", 60 * 60 * 24))  # seconds
+
+# Feed
+# Latest post IDs kept per author in the Redis timelines, older feed pages are read from the database
+POST_TIMELINE_MAX_LENGTH = int(os.getenv("POST_TIMELINE_MAX_LENGTH", 1000))
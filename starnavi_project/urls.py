@@ -5,6 +5,7 @@ from users.views import router as users_router
 from posts.views.views_posts import router as posts_router
 from posts.views.views_comments import router as comments_router
 from posts.views.views_analytics import router as analytics_router
+from posts.views.views_search import router as search_router
 
 api = NinjaAPI()
 
@@ -12,6 +13,7 @@ api.add_router("/users/", users_router)
 api.add_router("/posts/", posts_router)
 api.add_router("/posts/comments/", comments_router)
 api.add_router("/posts/analytics/", analytics_router)
+api.add_router("/posts/search/", search_router)
 
 urlpatterns = [
     path('admin/', admin.site.urls),
@@ -0,0 +1,84 @@
+import copy
+import threading
+import time
+
+from cachetools import TTLCache
+from django.conf import settings
+
+
+class UserCache:
+    """
+    In-process cache of the users authenticated by JWT, keyed by the user ID and the token `jti`.
+
+    The entries live for a short TTL and are invalidated when the user is saved or deleted
+    (see users/signals.py), so that the other workers see a deactivated user after the TTL at most.
+    """
+
+    def __init__(self, max_size, ttl, timer=time.monotonic):
+        self.ttl = ttl
+        self._local = TTLCache(maxsize=max_size, ttl=ttl, timer=timer)
+        self._lock = threading.Lock()
+        self._counters = {"hits": 0, "misses": 0, "hit_time": 0.0, "miss_time": 0.0}
+
+    def get(self, user_id, jti):
+        """
+        Returns a copy of the cached user or None, so the requests don't share one instance.
+        :param user_id: int
+        :param jti: str
+        :return: User or None
+        """
+        with self._lock:
+            user = self._local.get((user_id, jti))
+        return copy.copy(user) if user is not None else None
+
+    def set(self, user_id, jti, user):
+        with self._lock:
+            self._local[(user_id, jti)] = copy.copy(user)
+
+    def invalidate(self, user_id):
+        """
+        Removes all cached tokens of the user.
+        :param user_id: int
+        """
+        with self._lock:
+            for key in [key for key in self._local if key[0] == user_id]:
+                del self._local[key]
+
+    def record_lookup(self, hit, duration):
+        """
+        Counts the user lookup and its duration (seconds).
+        :param hit: Bool, whether the user was found in the cache
+        :param duration: float
+        """
+        with self._lock:
+            self._counters["hits" if hit else "misses"] += 1
+            self._counters["hit_time" if hit else "miss_time"] += duration
+
+    def clear(self):
+        with self._lock:
+            self._local.clear()
+            for name in self._counters:
+                self._counters[name] = 0
+
+    def stats(self):
+        """
+        Returns hit/miss counters, the hit ratio and the average lookup latency (ms) of the cache.
+        :return: dict
+        """
+        with self._lock:
+            counters = dict(self._counters)
+            size = len(self._local)
+        hits, misses = counters["hits"], counters["misses"]
+        lookups = hits + misses
+        return {
+            "hits": hits,
+            "misses": misses,
+            "size": size,
+            "hit_ratio": hits / lookups if lookups else 0.0,
+            "avg_hit_latency_ms": counters["hit_time"] * 1000 / hits if hits else 0.0,
+            "avg_miss_latency_ms": counters["miss_time"] * 1000 / misses if misses else 0.0,
+            "avg_latency_ms": (counters["hit_time"] + counters["miss_time"]) * 1000 / lookups if lookups else 0.0,
+        }
+
+
+user_cache = UserCache(max_size=settings.USER_CACHE_MAX_SIZE, ttl=settings.USER_CACHE_TTL)
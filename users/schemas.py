@@ -11,3 +11,4 @@ class RegisterSchema(Schema):
 class LoginSchema(Schema):
     username: str
     password: str
+    stateless: bool = False
@@ -0,0 +1,13 @@
+from django.contrib.auth.models import User
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from users.cache import user_cache
+
+
+@receiver([post_save, post_delete], sender=User)
+def invalidate_cached_user(sender, instance, **kwargs):
+    """
+    Drops the cached tokens of the changed, deactivated or deleted user.
+    """
+    user_cache.invalidate(instance.pk)
@@ -1,7 +1,12 @@
 import pytest
 from django.contrib.auth.models import User
+from django.test import RequestFactory
 from django.urls import reverse
 from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import AccessToken
+from starnavi_project.middlewares import get_user_from_jwt
+from users.cache import user_cache
+from users.tokens import get_tokens_for_user
 
 
 @pytest.mark.django_db
@@ -70,3 +75,62 @@ class TestAuthAPI:
         # Assertions
         assert response.status_code == 400
         assert response.json() == {"detail": "Invalid credentials"}
+
+
+@pytest.mark.django_db
+class TestJWTUserCache:
+    def setup_method(self):
+        user_cache.clear()
+        self.user = User.objects.create_user(username="test_user", password="TestPassword123")
+        token = AccessToken.for_user(self.user)
+        self.request = RequestFactory().get("/api/posts/", HTTP_AUTHORIZATION=f"Bearer {token}")
+
+    def test_user_is_cached(self, django_assert_num_queries):
+        with django_assert_num_queries(1):
+            assert get_user_from_jwt(self.request) == self.user
+        with django_assert_num_queries(0):
+            assert get_user_from_jwt(self.request) == self.user
+
+        stats = user_cache.stats()
+        assert (stats["hits"], stats["misses"], stats["hit_ratio"]) == (1, 1, 0.5)
+
+    def test_deactivated_user_is_invalidated(self):
+        get_user_from_jwt(self.request)
+
+        self.user.is_active = False
+        self.user.save()
+
+        assert not get_user_from_jwt(self.request).is_authenticated
+
+    def test_stateless_token_user(self, django_assert_num_queries):
+        response = APIClient().post(
+            reverse("api-1.0.0:login"),
+            {"username": "test_user", "password": "TestPassword123", "stateless": True},
+            format="json",
+        )
+        request = RequestFactory().get("/api/posts/", HTTP_AUTHORIZATION=f"Bearer {response.json()['access']}")
+
+        with django_assert_num_queries(0):
+            user = get_user_from_jwt(request)
+            assert (user.id, user.username, user.is_staff) == (self.user.id, "test_user", False)
+        # The other fields are loaded on access
+        with django_assert_num_queries(1):
+            assert user.email == self.user.email
+
+    def test_inactive_stateless_token_user(self):
+        self.user.is_active = False
+        self.user.save()
+        token = get_tokens_for_user(self.user, embed_claims=True)["access"]
+        request = RequestFactory().get("/api/posts/", HTTP_AUTHORIZATION=f"Bearer {token}")
+
+        assert not get_user_from_jwt(request).is_authenticated
+
+    def test_old_stateless_token_user_is_loaded(self, settings, django_assert_num_queries):
+        settings.USER_CLAIMS_MAX_AGE = -1
+        token = get_tokens_for_user(self.user, embed_claims=True)["access"]
+        User.objects.filter(id=self.user.id).update(is_staff=True)
+        request = RequestFactory().get("/api/posts/", HTTP_AUTHORIZATION=f"Bearer {token}")
+
+        # The claims are not trusted anymore, the user is read from the database
+        with django_assert_num_queries(1):
+            assert get_user_from_jwt(request).is_staff
@@ -0,0 +1,60 @@
+import time
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import AnonymousUser
+from django.db import DEFAULT_DB_ALIAS
+from rest_framework_simplejwt.tokens import RefreshToken
+
+User = get_user_model()
+
+# User fields embedded in the stateless tokens, the other fields are loaded on first access
+USER_CLAIMS = ("username", "is_staff", "is_active")
+
+
+def get_tokens_for_user(user, embed_claims=False):
+    """
+    Returns the refresh and access tokens of the user.
+    :param user: User
+    :param embed_claims: Bool, whether to embed USER_CLAIMS, so that the user is not read from the database
+    :return: dict
+    """
+    refresh = RefreshToken.for_user(user)
+    if embed_claims:
+        # The access token copies the claims of the refresh token
+        for claim in USER_CLAIMS:
+            refresh[claim] = getattr(user, claim)
+
+    return {
+        'access': str(refresh.access_token),
+        'refresh': str(refresh),
+    }
+
+
+def has_user_claims(claims):
+    """
+    Returns True if the token embeds the user claims and they may still be trusted.
+    The claims are trusted for USER_CLAIMS_MAX_AGE seconds after the token has been issued, then the user
+    is loaded from the database, so a deactivated or demoted user doesn't keep the claims of a long-lived token.
+    :param claims: dict of the decoded token
+    :return: Bool
+    """
+    if not all(claim in claims for claim in USER_CLAIMS):
+        return False
+    return time.time() - claims.get("iat", 0) <= settings.USER_CLAIMS_MAX_AGE
+
+
+def get_user_from_claims(claims):
+    """
+    Builds the user from the token claims without a database query.
+    The user is loaded as if its other fields were deferred, so they are read from the database
+    only when something accesses them, and saving it updates only the loaded fields.
+    :param claims: dict of the decoded token
+    :return: User or AnonymousUser if the user is not active
+    """
+    if not claims["is_active"]:
+        return AnonymousUser()
+
+    field_names = ("id",) + USER_CLAIMS
+    values = [claims["user_id"]] + [claims[claim] for claim in USER_CLAIMS]
+    return User.from_db(DEFAULT_DB_ALIAS, field_names, values)
@@ -2,8 +2,8 @@ from ninja import Router
 from django.contrib.auth.models import User
 from django.contrib.auth import authenticate
 from ninja.errors import HttpError
-from rest_framework_simplejwt.tokens import RefreshToken
 from users.schemas import RegisterSchema, LoginSchema
+from users.tokens import get_tokens_for_user
 
 router = Router()
 
@@ -26,9 +26,5 @@ def login(request, payload: LoginSchema):
     if user is None:
         raise HttpError(400, "Invalid credentials")
 
-    # Generation JWT-tokens
-    refresh = RefreshToken.for_user(user)
-    return {
-        'access': str(refresh.access_token),
-        'refresh': str(refresh),
-    }
+    # Generation JWT-tokens, the stateless tokens embed the user claims
+    return get_tokens_for_user(user, embed_claims=payload.stateless)